@@ -0,0 +1,69 @@
+import threading
+import numpy as np
+import pytest
+
+from up_scholarship.tools.captcha_batcher import MicroBatcher
+
+
+def letter_images(value: int, letters=5):
+	return np.full((letters, 20, 20, 1), value, dtype=np.float32)
+
+
+def predict_values(images):
+	""" Read every letter back as the value its image was filled with."""
+	values = images[:, 0, 0, 0]
+	return [str(int(value)) for value in values], values / 10.0
+
+
+def predict_concurrently(batcher, count: int) -> dict:
+	results = {}
+	barrier = threading.Barrier(count)
+
+	def solve(value):
+		barrier.wait()
+		results[value] = batcher.predict(letter_images(value))
+
+	threads = [threading.Thread(target=solve, args=(value,)) for value in range(count)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join(5)
+	return results
+
+
+def test_every_captcha_gets_its_own_predictions():
+	batcher = MicroBatcher(predict_values, window=0.2, max_batch=16)
+	results = predict_concurrently(batcher, 6)
+	assert sorted(results) == list(range(6))
+	for value, (letters, probabilities) in results.items():
+		assert letters == [str(value)] * 5
+		assert np.allclose(probabilities, value / 10.0)
+	stats = batcher.stats()
+	assert stats["captchas"] == 6
+	assert stats["batches"] < 6
+
+
+def test_batches_are_capped_at_max_batch():
+	batcher = MicroBatcher(predict_values, window=0.2, max_batch=2)
+	predict_concurrently(batcher, 5)
+	stats = batcher.stats()
+	assert stats["captchas"] == 5
+	assert max(stats["batch_sizes"]) <= 2
+
+
+def test_zero_window_classifies_captcha_alone():
+	batcher = MicroBatcher(predict_values, window=0, max_batch=16)
+	letters, _ = batcher.predict(letter_images(3, letters=4))
+	assert letters == ["3"] * 4
+	assert batcher.stats()["batch_sizes"] == {1: 1}
+
+
+def test_prediction_error_reaches_every_caller():
+	def fail(images):
+		raise RuntimeError("model failed")
+	batcher = MicroBatcher(fail, window=0)
+	with pytest.raises(RuntimeError):
+		batcher.predict(letter_images(1))
+	# The batcher thread keeps serving after a failed batch
+	batcher.predict_batch = predict_values
+	assert batcher.predict(letter_images(2))[0] == ["2"] * 5
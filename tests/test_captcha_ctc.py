@@ -0,0 +1,35 @@
+import numpy as np
+
+from up_scholarship.tools.captcha_ctc import ctc_greedy_decode
+
+CHARACTERS = ["A", "B", "C"]
+BLANK = len(CHARACTERS)
+
+
+def get_prediction(steps: list, probability=0.9):
+	""" One hot softmax output with the given class winning at each step."""
+	prediction = np.full((len(steps), len(CHARACTERS) + 1), (1 - probability) / len(CHARACTERS))
+	for step, index in enumerate(steps):
+		prediction[step, index] = probability
+	return prediction
+
+
+def test_repeats_are_collapsed_and_blanks_dropped():
+	text, probabilities = ctc_greedy_decode(get_prediction([BLANK, 0, 0, BLANK, 1, 2, 2, BLANK]), CHARACTERS)
+	assert text == "ABC"
+	assert probabilities == [0.9, 0.9, 0.9]
+
+
+def test_blank_separates_repeated_character():
+	text, _ = ctc_greedy_decode(get_prediction([0, 0, BLANK, 0, 1]), CHARACTERS)
+	assert text == "AAB"
+
+
+def test_only_blanks_decode_to_empty_text():
+	assert ctc_greedy_decode(get_prediction([BLANK] * 4), CHARACTERS) == ("", [])
+
+
+def test_probability_of_first_step_is_kept():
+	prediction = get_prediction([1, 1])
+	prediction[1, 1] = 0.5
+	assert ctc_greedy_decode(prediction, CHARACTERS) == ("B", [0.9])
@@ -0,0 +1,60 @@
+import collections
+import numpy as np
+
+from up_scholarship.tools.captcha_ledger import CaptchaLedger, ACCEPTED, REJECTED, REFETCHED
+from up_scholarship.tools.solve_captcha_using_model import PROFILES
+
+
+def get_ledger(tmp_path, counts=None) -> CaptchaLedger:
+	ledger = CaptchaLedger(str(tmp_path / "ledger.csv"))
+	ledger._rng = np.random.default_rng(0)
+	for profile, profile_counts in (counts or {}).items():
+		ledger.counts[profile].update(profile_counts)
+	return ledger
+
+
+def test_empty_ledger_picks_a_known_profile(tmp_path):
+	ledger = get_ledger(tmp_path)
+	assert all(ledger.choose_profile() in PROFILES for _ in range(20))
+
+
+def test_profile_with_most_logins_is_picked(tmp_path):
+	profiles = list(PROFILES)
+	counts = {profile: {ACCEPTED: 5, REJECTED: 95} for profile in profiles}
+	counts[profiles[-1]] = {ACCEPTED: 90, REJECTED: 10}
+	ledger = get_ledger(tmp_path, counts)
+	picks = collections.Counter(ledger.choose_profile() for _ in range(200))
+	assert picks[profiles[-1]] == 200
+
+
+def test_refetches_count_against_a_profile(tmp_path):
+	profiles = list(PROFILES)
+	counts = {profile: {ACCEPTED: 0, REJECTED: 500} for profile in profiles}
+	# Same logins per submitted captcha, but the first needs many extra captcha downloads for them
+	counts[profiles[0]] = {ACCEPTED: 400, REJECTED: 100, REFETCHED: 1500}
+	counts[profiles[1]] = {ACCEPTED: 400, REJECTED: 100, REFETCHED: 0}
+	ledger = get_ledger(tmp_path, counts)
+	picks = collections.Counter(ledger.choose_profile() for _ in range(200))
+	assert picks[profiles[1]] > 190
+
+
+def test_young_ledger_still_explores(tmp_path):
+	profiles = list(PROFILES)
+	counts = {profile: {ACCEPTED: 0, REJECTED: 0} for profile in profiles}
+	counts[profiles[0]] = {ACCEPTED: 2, REJECTED: 1}
+	ledger = get_ledger(tmp_path, counts)
+	picks = collections.Counter(ledger.choose_profile() for _ in range(500))
+	assert len(picks) > 1
+
+
+def test_outcomes_are_read_back(tmp_path):
+	profile = list(PROFILES)[0]
+	filename = tmp_path / "ledger.csv"
+	filename.write_text(
+		"time,image_hash,profile,text,confidence,outcome\n"
+		"2020-01-01T00:00:00,abc,%s,ABCDE,0.9000,%s\n"
+		"2020-01-01T00:00:01,abd,%s,ABCDF,0.9000,%s\n"
+		"2020-01-01T00:00:02,abe,unknown,ABCDG,0.9000,%s\n" % (profile, ACCEPTED, profile, REJECTED, ACCEPTED))
+	ledger = CaptchaLedger(str(filename))
+	assert ledger.counts[profile][ACCEPTED] == 1
+	assert ledger.counts[profile][REJECTED] == 1
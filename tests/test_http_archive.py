@@ -0,0 +1,59 @@
+import gzip
+
+import pytest
+from scrapy.http import Request
+
+from up_scholarship.providers.http_archive import normalize_url, get_exchange_key, check_archive, \
+	HttpArchiveMiddleware, RECORD, REPLAY
+
+CAPTCHA_URL = "https://scholarship.up.gov.in/captcha.ashx"
+
+
+def test_normalize_url_drops_captcha_id():
+	assert normalize_url(CAPTCHA_URL + "?id=0.123") == CAPTCHA_URL
+	assert normalize_url(CAPTCHA_URL + "?id=0.123&w=200") == CAPTCHA_URL + "?w=200"
+
+
+def test_normalize_url_keeps_other_urls():
+	url = "https://scholarship.up.gov.in/Index.aspx?id=5&Appid=A1"
+	assert normalize_url(url) == url
+
+
+def test_exchange_key_matches_across_captcha_ids():
+	first = Request(CAPTCHA_URL + "?id=0.1", meta={"cookiejar": 2})
+	second = Request(CAPTCHA_URL + "?id=0.2", meta={"cookiejar": 2})
+	assert get_exchange_key(first) == get_exchange_key(second) == "GET %s 2" % CAPTCHA_URL
+
+
+def test_exchange_key_separates_methods_and_sessions():
+	keys = {
+		get_exchange_key(Request(CAPTCHA_URL, meta={"cookiejar": 0})),
+		get_exchange_key(Request(CAPTCHA_URL, meta={"cookiejar": 1})),
+		get_exchange_key(Request(CAPTCHA_URL, method="POST", meta={"cookiejar": 0})),
+		get_exchange_key(Request(CAPTCHA_URL)),
+	}
+	assert len(keys) == 4
+
+
+def test_check_archive_record_creates_directory(tmp_path):
+	archive_file = tmp_path / "archives" / "run.jsonl.gz"
+	assert check_archive(RECORD, str(archive_file)) is None
+	assert archive_file.parent.is_dir()
+
+
+def test_check_archive_replay_needs_recorded_file(tmp_path):
+	archive_file = tmp_path / "run.jsonl.gz"
+	assert "not found" in check_archive(REPLAY, str(archive_file))
+	archive_file.write_bytes(b"")
+	assert "empty" in check_archive(REPLAY, str(archive_file))
+	with gzip.open(str(archive_file), "wt") as f:
+		f.write("{}\n")
+	assert check_archive(REPLAY, str(archive_file)) is None
+
+
+def test_replay_without_exchanges_raises_value_error(tmp_path):
+	archive_file = tmp_path / "run.jsonl.gz"
+	with gzip.open(str(archive_file), "wt"):
+		pass
+	with pytest.raises(ValueError):
+		HttpArchiveMiddleware(REPLAY, str(archive_file)).open_archive()
@@ -0,0 +1,76 @@
+import os
+
+from up_scholarship.providers.constants import CommonData, FormKeys
+from up_scholarship.spiders.pipeline import PipelineSpider
+
+
+def get_spider(tmp_path) -> PipelineSpider:
+	spider = PipelineSpider.__new__(PipelineSpider)
+	spider.cd = CommonData()
+	spider.cd.data_dir = str(tmp_path) + "/"
+	return spider
+
+
+def get_student(**stages) -> dict:
+	""" Student with every key any stage requires, each stage marked done unless given."""
+	keys = set(PipelineSpider.common_required_keys + PipelineSpider.post_required_keys)
+	for required_keys in PipelineSpider.stage_required_keys.values():
+		keys.update(required_keys)
+	student = {key: "x" for key in keys}
+	student.update({
+		FormKeys.std(): "11", FormKeys.reg_year(): "2020", FormKeys.aadhaar_no(): "123412341234",
+		FormKeys.aadhaar_authenticated(): "Y", FormKeys.aadhaar_otp_authenticated(): "Y"})
+	student.update({stage: "Y" for stage in PipelineSpider.stages})
+	student.update(stages)
+	return student
+
+
+def add_photo(spider, student):
+	filename = spider.get_photo_file(student)
+	os.makedirs(os.path.dirname(filename), exist_ok=True)
+	open(filename, "wb").close()
+
+
+def test_first_pending_stage_is_returned(tmp_path):
+	spider = get_spider(tmp_path)
+	student = get_student(**{FormKeys.app_filled(): "N", FormKeys.photo_uploaded(): "N"})
+	assert spider.get_pending_stage(student) == FormKeys.app_filled()
+	student[FormKeys.app_filled()] = "Y"
+	add_photo(spider, student)
+	assert spider.get_pending_stage(student) == FormKeys.photo_uploaded()
+
+
+def test_student_with_every_stage_done_is_skipped(tmp_path):
+	assert get_spider(tmp_path).get_pending_stage(get_student()) is None
+
+
+def test_stage_not_marked_n_blocks_later_stages(tmp_path):
+	spider = get_spider(tmp_path)
+	student = get_student(**{FormKeys.submitted_for_check(): "", FormKeys.final_submitted(): "N"})
+	assert spider.get_pending_stage(student) is None
+
+
+def test_stage_missing_required_keys_is_blocked(tmp_path):
+	spider = get_spider(tmp_path)
+	student = get_student(**{FormKeys.app_filled(): "N"})
+	del student[FormKeys.bank_name()]
+	assert spider.get_pending_stage(student) is None
+	student = get_student(**{FormKeys.final_submitted(): "N"})
+	del student[FormKeys.religion()]
+	assert spider.get_pending_stage(student) is None
+
+
+def test_photo_stage_needs_photo_file(tmp_path):
+	spider = get_spider(tmp_path)
+	student = get_student(**{FormKeys.photo_uploaded(): "N"})
+	assert spider.get_pending_stage(student) is None
+	add_photo(spider, student)
+	assert spider.get_pending_stage(student) == FormKeys.photo_uploaded()
+
+
+def test_submit_for_check_needs_aadhaar_authentication(tmp_path):
+	spider = get_spider(tmp_path)
+	student = get_student(**{FormKeys.submitted_for_check(): "N", FormKeys.aadhaar_otp_authenticated(): "N"})
+	assert spider.get_pending_stage(student) is None
+	student[FormKeys.aadhaar_otp_authenticated()] = "Y"
+	assert spider.get_pending_stage(student) == FormKeys.submitted_for_check()
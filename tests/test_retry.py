@@ -0,0 +1,142 @@
+from unittest import mock
+
+from scrapy.http import Request, Response
+from scrapy.spidermiddlewares.httperror import HttpError
+from twisted.internet.defer import Deferred
+from twisted.internet.error import DNSLookupError, TimeoutError, ConnectionLost
+from twisted.python.failure import Failure
+
+from up_scholarship.providers.constants import CommonData, FormKeys
+from up_scholarship.providers.retry import classify_failure, RetryPolicy, BackoffMiddleware, \
+	NETWORK, HTTP, PAGE
+from up_scholarship.spiders.base import StudentSession
+from up_scholarship.spiders.filldata import FillDataSpider
+
+URL = "https://scholarship.up.gov.in/Index.aspx"
+
+
+def get_failure(error):
+	failure = Failure(error)
+	failure.request = Request(URL)
+	return failure
+
+
+def get_cd(**kwargs):
+	cd = CommonData()
+	cd.retry_budgets = {NETWORK: 2, HTTP: 1, PAGE: 2}
+	cd.retry_base_delays = {NETWORK: 2.0, HTTP: 5.0, PAGE: 0.0}
+	cd.retry_max_delay = 30.0
+	for key, value in kwargs.items():
+		setattr(cd, key, value)
+	return cd
+
+
+def test_classify_http_error():
+	response = Response(URL, status=503, request=Request(URL))
+	error_class, error_str = classify_failure(get_failure(HttpError(response, "Ignoring non-200 response")))
+	assert error_class == HTTP
+	assert "503" in error_str
+
+
+def test_classify_network_errors():
+	assert classify_failure(get_failure(DNSLookupError("no host")))[0] == NETWORK
+	assert classify_failure(get_failure(TimeoutError()))[0] == NETWORK
+	# Anything else reaching the errback is treated as a network error too
+	assert classify_failure(get_failure(ConnectionLost()))[0] == NETWORK
+
+
+def test_can_retry_until_budget_is_spent():
+	policy = RetryPolicy(get_cd())
+	assert policy.can_retry(NETWORK, 0)
+	assert policy.can_retry(NETWORK, 1)
+	assert not policy.can_retry(NETWORK, 2)
+	# Error classes without a budget are never retried
+	assert not policy.can_retry("unknown", 0)
+
+
+def test_get_delay_doubles_up_to_max_delay():
+	policy = RetryPolicy(get_cd())
+	# Upper end of the jitter is the full delay
+	with mock.patch("up_scholarship.providers.retry.random.uniform", side_effect=lambda low, high: high):
+		assert [policy.get_delay(NETWORK, retries) for retries in range(6)] == [2.0, 4.0, 8.0, 16.0, 30.0, 30.0]
+		assert policy.get_delay(PAGE, 3) == 0.0
+
+
+def test_get_delay_jitter_is_within_upper_half():
+	policy = RetryPolicy(get_cd())
+	for retries in range(8):
+		full = min(30.0, 5.0 * 2 ** retries)
+		for _ in range(20):
+			assert full / 2 <= policy.get_delay(HTTP, retries) <= full
+
+
+def get_spider(cd):
+	spider = FillDataSpider.__new__(FillDataSpider)
+	spider.cd = cd
+	spider.crawler = mock.Mock()
+	spider.retry_policy = RetryPolicy(cd)
+	spider.auto_skip = True
+	spider.skip_to_next_valid = mock.Mock()
+	spider.session = StudentSession(0)
+	spider.student = {FormKeys.name(): "Test"}
+	spider.students = [spider.student]
+	spider.current_student_index = 0
+	spider.err_students = []
+	return spider
+
+
+def test_retry_error_parks_student_once_budget_is_spent():
+	spider = get_spider(get_cd())
+	assert spider.retry_error(PAGE, "Unexpected page", URL)
+	assert spider.retry_error(PAGE, "Unexpected page", URL)
+	assert spider.session.retries[PAGE] == 2
+	spider.skip_to_next_valid.assert_not_called()
+
+	assert not spider.retry_error(PAGE, "Unexpected page", URL)
+	assert spider.students[0][FormKeys.status()] == "Unexpected page"
+	assert spider.err_students == [spider.students[0]]
+	spider.skip_to_next_valid.assert_called_once_with()
+
+
+def test_retry_error_sets_session_backoff():
+	spider = get_spider(get_cd())
+	with mock.patch("up_scholarship.providers.retry.random.uniform", side_effect=lambda low, high: high):
+		spider.retry_error(NETWORK, "TimeoutError", URL)
+		assert spider.session.backoff_delay == 2.0
+		spider.retry_error(NETWORK, "TimeoutError", URL)
+		assert spider.session.backoff_delay == 4.0
+
+
+def test_budgets_are_kept_per_error_class():
+	spider = get_spider(get_cd())
+	assert spider.retry_error(HTTP, "HttpError 500", URL)
+	# Spending the http budget leaves the network one untouched
+	assert spider.retry_error(NETWORK, "TimeoutError", URL)
+	assert not spider.retry_error(HTTP, "HttpError 500", URL)
+
+
+def test_backoff_middleware_sets_endpoint_timeout():
+	middleware = BackoffMiddleware(get_cd(download_timeout=60, download_timeouts={"captcha.ashx": 15}))
+	request = Request("https://scholarship.up.gov.in/Captcha.ashx?id=1")
+	assert middleware.process_request(request, None) is None
+	assert request.meta["download_timeout"] == 15
+	request = Request(URL)
+	middleware.process_request(request, None)
+	assert request.meta["download_timeout"] == 60
+
+
+def test_backoff_middleware_holds_back_request():
+	middleware = BackoffMiddleware(get_cd())
+	request = Request(URL, meta={"backoff_delay": 5.0})
+	deferred = middleware.process_request(request, None)
+	assert isinstance(deferred, Deferred)
+	deferred.cancel()
+	deferred.addErrback(lambda failure: None)
+	# Popped so a redirect of the request is not held back again
+	assert "backoff_delay" not in request.meta
+
+
+def test_backoff_middleware_does_not_wait_on_replay():
+	middleware = BackoffMiddleware(get_cd(), replay=True)
+	request = Request(URL, meta={"backoff_delay": 5.0})
+	assert middleware.process_request(request, None) is None
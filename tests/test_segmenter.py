@@ -0,0 +1,35 @@
+import numpy as np
+
+from up_scholarship.tools.solve_captcha_using_model import _split_counts, _split_region
+
+
+def test_split_counts_give_each_region_a_letter():
+	assert list(_split_counts([10, 10, 10, 10, 10], 5)) == [1, 1, 1, 1, 1]
+
+
+def test_split_counts_follow_widths():
+	assert list(_split_counts([100, 40], 5)) == [3, 2]
+	assert list(_split_counts([120, 20], 5)) == [4, 1]
+
+
+def test_split_region_of_one_letter_is_unchanged():
+	thresh = np.full((20, 60), 255, dtype=np.uint8)
+	assert _split_region(thresh, (0, 0, 60, 20), 1) == [(0, 0, 60, 20)]
+
+
+def test_split_region_cuts_at_empty_columns():
+	thresh = np.full((20, 60), 255, dtype=np.uint8)
+	thresh[:, 20] = 0
+	thresh[:, 41] = 0
+	assert _split_region(thresh, (0, 0, 60, 20), 3) == [(0, 0, 20, 20), (20, 0, 21, 20), (41, 0, 19, 20)]
+
+
+def test_split_region_keeps_offset_and_cuts_near_even_split():
+	thresh = np.full((30, 80), 255, dtype=np.uint8)
+	# An empty column far from the middle is out of reach of the cut
+	thresh[:, 12] = 0
+	parts = _split_region(thresh, (10, 5, 40, 20), 2)
+	assert len(parts) == 2
+	assert parts[0][0] == 10 and parts[1][0] + parts[1][2] == 50
+	assert all(part[1] == 5 and part[3] == 20 for part in parts)
+	assert 15 <= parts[1][0] - 10 <= 25
@@ -3,15 +3,30 @@ import argparse
 
 def parse():
 	parser = argparse.ArgumentParser()
-	spiders_list = ["register", "filldata", "uploadphoto", "submitcheck", "renew", "submitfinal", "receive", "verify", "forward", "aadhaarauth", "savecaptchas"]
-	tools_list = ["scanphoto", "convert2pdf", "printfinal", "donestudent"]
+	spiders_list = ["register", "filldata", "uploadphoto", "submitcheck", "renew", "submitfinal", "receive", "verify", "forward", "aadhaarauth", "savecaptchas", "pipeline"]
+	tools_list = ["scanphoto", "convert2pdf", "printfinal", "donestudent", "benchcaptcha", "exportcaptcha", "quantgate", "trainctc", "captchadaemon",
+		"daemonstats", "buildcaptchadata", "retraincaptcha", "mockportal"]
 	parser.add_argument('work', help="tell which spider needed to be run.", choices=spiders_list + tools_list)
 	parser.add_argument("--filepath", "-f", help="path of input file", type=str)
+	parser.add_argument("--record", help="record http exchanges of the spider run to archive", nargs="?", const="", metavar="ARCHIVE")
+	parser.add_argument("--replay", help="replay responses from archive instead of the portal", nargs="?", const="", metavar="ARCHIVE")
 	args = parser.parse_args()
 	if args.work in spiders_list:
-		process = CrawlerProcess({
+		settings = {
 			'USER_AGENT': 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)'
-		})
+		}
+		if args.record is not None or args.replay is not None:
+			from up_scholarship.providers.constants import CommonData
+			from up_scholarship.providers.http_archive import RECORD, REPLAY, check_archive
+			mode = RECORD if args.record is not None else REPLAY
+			archive_file = args.record or args.replay or CommonData.http_archive_file
+			error = check_archive(mode, archive_file)
+			if error:
+				print(error)
+				return
+			settings['HTTP_ARCHIVE_MODE'] = mode
+			settings['HTTP_ARCHIVE_FILE'] = archive_file
+		process = CrawlerProcess(settings)
 		if args.work == "register":
 			from up_scholarship.spiders.register import RegisterSpider
 			process.crawl(RegisterSpider)
@@ -45,6 +60,9 @@ def parse():
 		elif args.work == "savecaptchas":
 			from up_scholarship.spiders.save_captchas import SaveCatpchasSpider
 			process.crawl(SaveCatpchasSpider)
+		elif args.work == "pipeline":
+			from up_scholarship.spiders.pipeline import PipelineSpider
+			process.crawl(PipelineSpider)
 		process.start()
 	elif args.work == "scanphoto":
 		from up_scholarship.tools.photo_scan_helper import scan_photos
@@ -57,4 +75,31 @@ def parse():
 		print_final()
 	elif args.work == "donestudent":
 		from up_scholarship.tools.student_done_helper import is_student_done
-		is_student_done(args.filepath)
\ No newline at end of file
+		is_student_done(args.filepath)
+	elif args.work == "benchcaptcha":
+		from up_scholarship.tools.captcha_benchmark import benchmark_captcha
+		benchmark_captcha(args.filepath)
+	elif args.work == "exportcaptcha":
+		from up_scholarship.tools.captcha_runtime import export_captcha_model
+		export_captcha_model(args.filepath)
+	elif args.work == "quantgate":
+		from up_scholarship.tools.captcha_benchmark import quantization_gate
+		quantization_gate(args.filepath)
+	elif args.work == "trainctc":
+		from up_scholarship.tools.captcha_ctc import train_ctc_model
+		train_ctc_model(args.filepath)
+	elif args.work == "captchadaemon":
+		from up_scholarship.tools.captcha_daemon import run_daemon
+		run_daemon()
+	elif args.work == "daemonstats":
+		from up_scholarship.tools.captcha_daemon import print_daemon_stats
+		print_daemon_stats()
+	elif args.work == "buildcaptchadata":
+		from up_scholarship.tools.captcha_dataset import build_dataset
+		build_dataset(args.filepath)
+	elif args.work == "retraincaptcha":
+		from up_scholarship.tools.captcha_dataset import retrain_letter_model
+		retrain_letter_model()
+	elif args.work == "mockportal":
+		from up_scholarship.tools.mock_portal import run_mock_portal
+		run_mock_portal()
\ No newline at end of file
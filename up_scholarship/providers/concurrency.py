@@ -0,0 +1,135 @@
+import logging
+import urllib.parse as urlparse
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from up_scholarship.providers.constants import CommonData, FormSets
+from up_scholarship.providers.url import UrlProviders
+
+# Sent by the spiders for every error they retry or park a student for, with spider, error_class and url
+portal_error = object()
+
+logger = logging.getLogger(__name__)
+
+
+class PortalWindow:
+	""" Latency and errors of one host or form set base url in the current interval."""
+	def __init__(self):
+		self.latency = None  # Moving average of download latency in seconds.
+		self.responses = 0
+		self.errors = 0
+
+	def add_response(self, latency: float, error: bool, smoothing: float):
+		self.responses += 1
+		self.errors += int(error)
+		if latency is not None:
+			self.latency = latency if self.latency is None else smoothing * latency + (1 - smoothing) * self.latency
+
+	def add_error(self):
+		self.errors += 1
+
+	@property
+	def error_rate(self) -> float:
+		return self.errors / self.responses if self.responses else float(self.errors > 0)
+
+	def reset(self):
+		""" Start next interval, the latency average is kept."""
+		self.responses = 0
+		self.errors = 0
+
+
+class AdaptiveConcurrency:
+	""" Extension raising and lowering the student sessions working at the same time from portal's health.
+		Every interval the session limit goes up by one if every host answered within the target latency and
+		error rate and is cut by the decrease factor if any did not (AIMD), so a portal slowing down under load
+		gets less work quickly and the limit climbs back slowly.
+	"""
+	def __init__(self, crawler, cd: CommonData):
+		self.crawler = crawler
+		self.stats = crawler.stats
+		self.cd = cd
+		self.url_provider = UrlProviders(cd)
+		self.windows = {}
+		self.spider = None
+		self.limit = 1
+		self.loop = None
+
+	@classmethod
+	def from_crawler(cls, crawler):
+		cd = CommonData()
+		if not cd.adaptive_concurrency:
+			raise NotConfigured
+		extension = cls(crawler, cd)
+		crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+		crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+		crawler.signals.connect(extension.response_received, signal=signals.response_received)
+		crawler.signals.connect(extension.portal_error, signal=portal_error)
+		return extension
+
+	def get_key(self, url: str) -> str:
+		""" Return the form set name of the url or its host if it is not on any form set."""
+		form_set = self.url_provider.get_form_set_of_url(url)
+		if form_set != FormSets.unknown:
+			return form_set.name
+		return urlparse.urlparse(url).netloc
+
+	def get_window(self, url: str) -> PortalWindow:
+		return self.windows.setdefault(self.get_key(url), PortalWindow())
+
+	def spider_opened(self, spider):
+		# Only spiders with student sessions can be throttled
+		if not hasattr(spider, "set_session_limit"):
+			return
+		self.spider = spider
+		self.limit = spider.session_limit
+		self.stats.set_value("adaptive/session_limit", self.limit)
+		self.loop = task.LoopingCall(self.adjust)
+		self.loop.start(self.cd.adaptive_interval, now=False)
+
+	def spider_closed(self, spider):
+		if self.loop and self.loop.running:
+			self.loop.stop()
+
+	def response_received(self, response, request, spider):
+		error = response.status >= 500
+		self.get_window(response.url).add_response(
+			request.meta.get("download_latency"), error, self.cd.adaptive_latency_smoothing)
+
+	def portal_error(self, spider, error_class: str, url: str):
+		self.get_window(url).add_error()
+		self.stats.inc_value("adaptive/errors/%s" % error_class)
+
+	def adjust(self):
+		""" Apply one AIMD step to the session limit from the interval's latency and errors."""
+		# The spider clamps the limit to its sessions, step from what it really is
+		self.limit = self.spider.session_limit
+		unhealthy = []
+		for key, window in self.windows.items():
+			if window.responses or window.errors:
+				if window.latency is not None:
+					self.stats.set_value("adaptive/%s/latency" % key, round(window.latency, 3))
+				self.stats.set_value("adaptive/%s/error_rate" % key, round(window.error_rate, 3))
+			if (window.latency or 0) > self.cd.adaptive_target_latency or \
+					window.error_rate > self.cd.adaptive_max_error_rate:
+				unhealthy.append(key)
+		active = any(window.responses for window in self.windows.values())
+		for window in self.windows.values():
+			window.reset()
+		if unhealthy:
+			limit = max(1, int(self.limit * self.cd.adaptive_decrease_factor))
+			reason = "slow or failing: " + ", ".join(unhealthy)
+		elif active:
+			limit = self.limit + 1
+			reason = "healthy"
+		else:
+			return
+		limit = self.spider.set_session_limit(limit)
+		if limit == self.limit:
+			return
+		logger.info("Session limit %d -> %d, portal %s", self.limit, limit, reason)
+		self.stats.inc_value("adaptive/decreases" if limit < self.limit else "adaptive/increases")
+		self.stats.set_value("adaptive/session_limit", limit)
+		self.stats.max_value("adaptive/max_session_limit", limit)
+		self.stats.min_value("adaptive/min_session_limit", limit)
+		self.limit = limit
@@ -1,3 +1,4 @@
+import os
 from enum import Enum, auto
 from datetime import datetime
 from dataclasses import dataclass
@@ -30,6 +31,7 @@ class TestStrings:
 	show_image = 'showimage'
 	final_disclaimer = 'finaldisclaimer'
 	institute_login_success = 'CollegeProcess/index.aspx'
+	institute_login = 'Inst_login'
 	application_received = 'Application Recieved Successfully !'
 	application_verified = 'Application Verified Successfully !'
 	application_forwarded = '1  Records Forwarded Successfully !'
@@ -54,6 +56,26 @@ class FormSets(Enum):
 @dataclass
 class CommonData:
 	max_tries = 5
+	# Retries of a student for every error class of providers/retry.py before the student is parked
+	retry_budgets = {'network': 5, 'http': 3, 'portal': 1, 'alert': 0, 'captcha': max_tries, 'page': max_tries}
+	# Backoff before the first retry of every error class in seconds, doubled for every retry after it
+	retry_base_delays = {'network': 2.0, 'http': 5.0, 'portal': 10.0, 'alert': 0.0, 'captcha': 0.0, 'page': 1.0}
+	retry_max_delay = 120.0
+	download_timeout = 60	# Seconds, for endpoints not in download_timeouts.
+	download_timeouts = {'captcha.ashx': 15, 'uploadphoto': 120}
+	http_archive_file = 'up_scholarship/out/http_archive.jsonl.gz'	# Used by --record and --replay.
+	# Base url used for every form set instead of the portal's, e.g. http://127.0.0.1:8800/ for 'up_scholarship mockportal'
+	portal_base_url = os.getenv('UP_SCHOLARSHIP_PORTAL', '')
+	# Stand-in portal served by 'up_scholarship mockportal' to benchmark the spiders against
+	mock_portal_host = '127.0.0.1'	# Interface to listen on, it serves corpus captchas and a fake login so keep it local.
+	mock_portal_port = 8800
+	mock_portal_latency = (0.05, 0.3)	# Seconds, every response is held back for a random time in this range.
+	mock_portal_drop_rate = 0.0	# Share of requests whose connection is dropped without a response.
+	mock_portal_error_rate = 0.0	# Share of requests answered with a 500.
+	mock_portal_code_rate = 0.0	# Share of form posts sent back with an error code in the "a" argument.
+	mock_portal_codes = ['1', '2', '3']	# Codes sent in the "a" argument, 'c' is only sent for wrong captchas.
+	mock_portal_check_captcha = True	# Turn off to accept every captcha and leave the solver's mistakes out.
+	mock_portal_strict = True	# Only allow a stage after the stages before it, off lets every spider run on its own.
 	data_dir = 'up_scholarship/data/'
 	current_year = str(datetime.now().year)
 	students_in_file = data_dir + 'students/%s/Students.xlsx' % current_year
@@ -69,6 +91,43 @@ class CommonData:
 	district_file = data_dir + 'codes/district.json'
 	sub_caste_file = data_dir + 'codes/subcaste.json'
 	institute_file = data_dir + 'codes/institute.json'
+	captchas_dir = 'up_scholarship/out/catpchas/'
+	captcha_harvest_sessions = 4	# Login sessions savecaptchas runs in parallel.
+	captcha_harvest_retry_factor = 5	# Harvest sessions end after this many times the retry budget of an error class.
+	captcha_dataset_dir = 'up_scholarship/out/captcha_dataset/'	# Letter crops built by buildcaptchadata.
+	concurrent_students = 1	# Students processed at the same time, each in its own session and cookie jar.
+	# Lower the sessions working together when the portal slows down or fails and raise them back when it recovers
+	adaptive_concurrency = True
+	adaptive_max_students = 4	# Most students adaptive concurrency raises the sessions to, starting from concurrent_students.
+	adaptive_interval = 10.0	# Seconds between adjustments.
+	adaptive_target_latency = 5.0	# Seconds, slower average download latency lowers the sessions.
+	adaptive_max_error_rate = 0.2	# Higher share of failing responses lowers the sessions.
+	adaptive_decrease_factor = 0.5
+	adaptive_latency_smoothing = 0.3
+	captcha_warm_up = True	# Load the captcha model in the background as soon as a spider starts.
+	captcha_workers = 4	# Threads used to solve captchas off the reactor, also the most captchas batched together.
+	captcha_runtime = 'keras'	# keras, tflite or tflite_int8, tflite needs 'up_scholarship exportcaptcha' first.
+	captcha_profile = 'default'	# Preprocessing profile: default, denoise_first or median, compare them with benchcaptcha.
+	captcha_segmenter = 'contours'	# contours or components, components also splits 3 or more touching letters.
+	captcha_recognizer = 'letters'	# letters or ctc, ctc reads the whole captcha and needs 'up_scholarship trainctc' first.
+	# tflite_int8 is only used if its whole string accuracy is at most this much below the float model
+	# in the last 'up_scholarship quantgate' run.
+	captcha_int8_tolerance = 0.02
+	# Captchas solved with lower confidence are refetched instead of submitted. Raising it saves wrong
+	# submissions at the cost of more captcha downloads.
+	captcha_min_confidence = 0.3
+	captcha_max_refetches = 3	# Submit whatever we have after these many refetches.
+	captcha_fast_retry = True	# On a wrong captcha resubmit the same form with a new captcha instead of reloading it.
+	# Started with 'up_scholarship captchadaemon', every process solves through it while it is running.
+	captcha_daemon_socket = 'up_scholarship/out/captcha_daemon.sock'
+	captcha_daemon_timeout = 30	# Seconds to wait for the daemon before solving in process.
+	# Seconds to wait for more captchas to classify them in one model call, 0 turns batching off in spiders.
+	# Longer windows give bigger batches and more throughput but add to every solve's latency.
+	captcha_batch_window = 0.01
+	captcha_max_batch = 16	# Most captchas classified in one model call.
+	# Outcome of every solved captcha, used to pick the profile needing the fewest portal round trips.
+	captcha_ledger_file = 'up_scholarship/out/captcha_ledger.csv'
+	captcha_auto_profile = False	# Pick the profile from the ledger instead of always using captcha_profile, letters only.
 	file_in_type = StudentFileTypes.excel
 	file_out_type = StudentFileTypes.excel
 	file_err_type = StudentFileTypes.json
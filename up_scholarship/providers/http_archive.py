@@ -0,0 +1,155 @@
+import base64
+import gzip
+import json
+import logging
+import os
+import urllib.parse as urlparse
+from collections import defaultdict, deque
+from scrapy import signals
+from scrapy.exceptions import NotConfigured, IgnoreRequest
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+from up_scholarship.providers.constants import CommonData
+
+RECORD = "record"
+REPLAY = "replay"
+# Query arguments which change on every run and would keep recorded requests from matching
+VOLATILE_ARGUMENTS = {"captcha.ashx": ["id"]}
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_url(url: str) -> str:
+	""" Drop the query arguments of the url which change on every run, like the random captcha id."""
+	parsed = urlparse.urlparse(url)
+	path = parsed.path.lower()
+	for endpoint, arguments in VOLATILE_ARGUMENTS.items():
+		if path.endswith(endpoint):
+			query = [(k, v) for k, v in urlparse.parse_qsl(parsed.query, keep_blank_values=True) if k not in arguments]
+			return urlparse.urlunparse(parsed._replace(query=urlparse.urlencode(query)))
+	return url
+
+
+def get_exchange_key(request) -> str:
+	""" Key recorded and replayed exchanges are matched on, bodies are left out as they carry solved captchas
+		and view states which may differ between runs.
+	"""
+	return "%s %s %s" % (request.method, normalize_url(request.url), request.meta.get("cookiejar", ""))
+
+
+def check_archive(mode: str, archive_file: str):
+	""" Check the archive can be recorded to or replayed from before the crawl starts.
+		Keyword arguments:
+		mode -- RECORD or REPLAY.
+		archive_file -- gzipped JSON lines archive.
+		Returns: error message or None if the archive is usable
+	"""
+	if mode == RECORD:
+		archive_dir = os.path.dirname(archive_file) or "."
+		try:
+			os.makedirs(archive_dir, exist_ok=True)
+		except OSError as e:
+			return "Unable to create http archive directory %s: %s" % (archive_dir, e)
+		if not os.access(archive_dir, os.W_OK):
+			return "Http archive directory %s is not writable" % archive_dir
+	elif not os.path.isfile(archive_file):
+		return "Http archive %s not found, record it first with --record" % archive_file
+	elif not os.path.getsize(archive_file):
+		return "Http archive %s is empty" % archive_file
+	return None
+
+
+def _encode_headers(headers: Headers) -> dict:
+	return {
+		key.decode("latin-1"): [value.decode("latin-1") for value in values] for key, values in headers.items()}
+
+
+def _decode_headers(headers: dict) -> Headers:
+	return Headers({key: [value.encode("latin-1") for value in values] for key, values in headers.items()})
+
+
+class HttpArchiveMiddleware:
+	""" Downloader middleware recording every exchange of a spider run to a gzipped JSON lines archive or serving
+		the responses of such an archive back instead of downloading them, so runs can be repeated offline.
+		It sits next to the downloader, so cookies, redirects and compression are handled as for live responses.
+		Exchanges with the same key are replayed in the order they were recorded.
+	"""
+	def __init__(self, mode: str, archive_file: str):
+		self.mode = mode
+		self.archive_file = archive_file
+		self.archive = None
+		self.exchanges = defaultdict(deque)
+		self.recorded = 0
+		self.replayed = 0
+		self.missed = 0
+
+	@classmethod
+	def from_crawler(cls, crawler):
+		mode = crawler.settings.get("HTTP_ARCHIVE_MODE")
+		if mode not in (RECORD, REPLAY):
+			raise NotConfigured
+		middleware = cls(mode, crawler.settings.get("HTTP_ARCHIVE_FILE", CommonData.http_archive_file))
+		middleware.open_archive()
+		crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+		return middleware
+
+	def open_archive(self):
+		""" Open the archive to record to or read the exchanges to replay.
+			Raises ValueError if that fails, a recording run would fail every response and a replay without
+			exchanges would park every student. main.py checks the archive with check_archive before crawling.
+		"""
+		try:
+			if self.mode == RECORD:
+				os.makedirs(os.path.dirname(self.archive_file) or ".", exist_ok=True)
+				self.archive = gzip.open(self.archive_file, "wt", encoding="utf-8")
+				logger.info("Recording http exchanges to %s", self.archive_file)
+				return
+			with gzip.open(self.archive_file, "rt", encoding="utf-8") as f:
+				for line in f:
+					exchange = json.loads(line)
+					self.exchanges[exchange["key"]].append(exchange)
+		except (OSError, ValueError, KeyError) as e:
+			raise ValueError("Unable to open http archive %s: %r" % (self.archive_file, e))
+		if not self.exchanges:
+			raise ValueError("No exchanges to replay in http archive " + self.archive_file)
+		logger.info("Replaying %d http exchanges from %s", sum(map(len, self.exchanges.values())), self.archive_file)
+
+	def spider_closed(self, spider):
+		if self.archive:
+			self.archive.close()
+		logger.info(
+			"Http archive: %d recorded, %d replayed, %d not in archive", self.recorded, self.replayed, self.missed)
+
+	def process_request(self, request, spider):
+		if self.mode != REPLAY:
+			return None
+		queue = self.exchanges.get(get_exchange_key(request))
+		if not queue:
+			self.missed += 1
+			logger.warning("No recorded response for %s %s", request.method, request.url)
+			raise IgnoreRequest("Not in http archive: " + request.url)
+		exchange = queue.popleft()
+		self.replayed += 1
+		headers = _decode_headers(exchange["headers"])
+		body = base64.b64decode(exchange["body"])
+		# Recorded url may differ in the volatile arguments, the response has to be for this request
+		response_class = responsetypes.from_args(headers=headers, url=request.url, body=body)
+		return response_class(url=request.url, status=exchange["status"], headers=headers, body=body, request=request)
+
+	def process_response(self, request, response, spider):
+		if self.mode == RECORD:
+			exchange = {
+				"key": get_exchange_key(request),
+				"method": request.method,
+				"url": request.url,
+				# Includes the Cookie header set by the cookies middleware
+				"request_headers": _encode_headers(request.headers),
+				"request_body": base64.b64encode(request.body).decode("ascii"),
+				"status": response.status,
+				"headers": _encode_headers(response.headers),
+				"body": base64.b64encode(response.body).decode("ascii"),
+			}
+			self.archive.write(json.dumps(exchange) + "\n")
+			self.recorded += 1
+		return response
@@ -0,0 +1,88 @@
+import logging
+import random
+from scrapy.spidermiddlewares.httperror import HttpError
+from twisted.internet import reactor, task
+from twisted.internet.error import DNSLookupError, TimeoutError, TCPTimedOutError
+
+from up_scholarship.providers.constants import CommonData
+
+# Classes of errors a student can run into, each gets its own retry budget
+NETWORK = "network"		# DNS failures, timeouts and dropped connections.
+HTTP = "http"			# Non 2xx responses.
+PORTAL = "portal"		# Error code in the "a" argument of the url.
+ALERT = "alert"			# Error label or alert script on the page.
+CAPTCHA = "captcha"		# Captcha was wrong.
+PAGE = "page"			# Portal sent us to an unexpected page.
+
+logger = logging.getLogger(__name__)
+
+
+def classify_failure(failure):
+	""" Get the error class and a description of a scrapy network failure.
+		Keyword arguments:
+		failure -- scrapy failure passed to the errback.
+		Returns: tuple of error class and error string
+	"""
+	if failure.check(HttpError):
+		# these exceptions come from HttpError spider middleware
+		response = failure.value.response
+		return HTTP, "HttpError %d on %s" % (response.status, response.url)
+	elif failure.check(DNSLookupError):
+		return NETWORK, "DNSLookupError on " + failure.request.url
+	elif failure.check(TimeoutError, TCPTimedOutError):
+		return NETWORK, "TimeoutError on " + failure.request.url
+	return NETWORK, repr(failure.value)
+
+
+def get_download_timeout(url: str, cd: CommonData) -> float:
+	""" Return download timeout of the endpoint the url is for."""
+	url = url.lower()
+	for endpoint, timeout in cd.download_timeouts.items():
+		if url.find(endpoint.lower()) != -1:
+			return timeout
+	return cd.download_timeout
+
+
+class RetryPolicy:
+	""" Retry budget of every error class and the backoff before each retry."""
+	def __init__(self, cd: CommonData):
+		self.budgets = cd.retry_budgets
+		self.base_delays = cd.retry_base_delays
+		self.max_delay = cd.retry_max_delay
+
+	def can_retry(self, error_class: str, retries: int) -> bool:
+		""" Check whether the budget of the error class has retries left after retries already made."""
+		return retries < self.budgets.get(error_class, 0)
+
+	def get_delay(self, error_class: str, retries: int) -> float:
+		""" Return the backoff before the next retry, doubling with every retry.
+			Half of it is random so sessions which failed together don't retry together.
+			Keyword arguments:
+			error_class -- class of the error being retried.
+			retries -- retries already made for the error class.
+			Returns: delay in seconds
+		"""
+		delay = min(self.max_delay, self.base_delays.get(error_class, 0) * 2 ** retries)
+		return delay / 2 + random.uniform(0, delay / 2)
+
+
+class BackoffMiddleware:
+	""" Downloader middleware holding back requests which have backoff_delay in meta and setting the
+		download timeout of the endpoint.
+	"""
+	def __init__(self, cd: CommonData, replay=False):
+		self.cd = cd
+		self.replay = replay  # Replayed responses come from disk, waiting for the portal to recover is pointless.
+
+	@classmethod
+	def from_crawler(cls, crawler):
+		return cls(CommonData(), crawler.settings.get("HTTP_ARCHIVE_MODE") == "replay")
+
+	def process_request(self, request, spider):
+		request.meta.setdefault("download_timeout", get_download_timeout(request.url, self.cd))
+		# Pop it so redirects and later retries of the request are not held back again
+		delay = request.meta.pop("backoff_delay", 0)
+		if delay > 0 and not self.replay:
+			logger.info("Backing off %.1fs before %s", delay, request.url)
+			return task.deferLater(reactor, delay, lambda: None)
+		return None
@@ -12,17 +12,29 @@ class UrlProviders:
 		self.pre_renewal_path = "PrematricStudents_Renewal"
 		self.post_renewal_path = "PostMatric_Renewal"
 
-	def get_base_url(self) -> str:
-		if self.cd.current_form_set == FormSets.one:
+	def get_base_url(self, form_set: FormSets = None) -> str:
+		if self.cd.portal_base_url:
+			# Stand-in portal serves every form set
+			return self.cd.portal_base_url.rstrip("/") + "/"
+		form_set = form_set if form_set else self.cd.current_form_set
+		if form_set == FormSets.one:
 			return "https://scholarship.up.gov.in/"
-		elif self.cd.current_form_set == FormSets.two:
+		elif form_set == FormSets.two:
 			return "http://164.100.181.104/"
-		elif self.cd.current_form_set == FormSets.three:
+		elif form_set == FormSets.three:
 			return "http://164.100.181.105/scholarship/"
 		else:
 			# return "http://pfms.upsdc.gov.in/sch1920/"
 			return "https://scholarship.up.gov.in/"
 
+	def get_form_set_of_url(self, url: str) -> FormSets:
+		""" Return the form set whose base url the url is on or FormSets.unknown."""
+		# Longest first so a base url with a path wins over the bare host
+		for form_set in sorted(FormSets, key=lambda f: -len(self.get_base_url(f))):
+			if form_set != FormSets.unknown and url.startswith(self.get_base_url(form_set)):
+				return form_set
+		return FormSets.unknown
+
 	def get_captcha_url(self) -> str:
 		return self.get_base_url() + "captcha.ashx?id=" + repr(random.random())
 
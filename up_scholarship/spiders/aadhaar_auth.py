@@ -4,7 +4,7 @@ import logging
 
 from up_scholarship.providers.constants import FormKeys, TestStrings, StdCategory
 from up_scholarship.spiders.base import BaseSpider, SkipConfig
-from up_scholarship.tools.solve_captcha_using_model import get_captcha_string
+from up_scholarship.tools.captcha_ledger import ACCEPTED
 from up_scholarship.providers import utilities as utl
 
 logger = logging.getLogger(__name__)
@@ -24,18 +24,22 @@ class AadhaarAuthSpider(BaseSpider):
 		skip_config.disatisfy_criterias = [FormKeys.aadhaar_authenticated()]
 		super().__init__(AadhaarAuthSpider, skip_config, *args, **kwargs)
 
-	def start_requests(self):
+	def start_student_requests(self):
 		if self.student:
 			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ""), self.is_renewal)
 			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 
-	def login_form(self, response):
+	async def login_form(self, response):
 		logger.info("In login form. Last Url: %s", response.url)
 		if self.process_errors(response, [TestStrings.error], html=False):
 			url = self.url_provider.get_login_reg_url(self.student[FormKeys.std()], self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+			return [scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)]
 		else:
-			captcha_value = get_captcha_string(response.body)
+			captcha = await self.solve_captcha(response.body)
+			request = self.refetch_captcha(response, captcha)
+			if request:
+				return [request]
+			captcha_value = captcha.text
 
 			# Get old response after getting captcha
 			response = response.meta["old_response"]
@@ -49,9 +53,10 @@ class AadhaarAuthSpider(BaseSpider):
 				formdata=form_data,
 				callback=self.accept_popup,
 				errback=self.errback_next,
-				dont_filter=True
+				dont_filter=True,
+				meta={"captcha": captcha}
 			)
-			yield request
+			return [request]
 
 	def accept_popup(self, response):
 		""" If we get popup about accepting terms accept them and if not continue filling other things.
@@ -61,7 +66,7 @@ class AadhaarAuthSpider(BaseSpider):
 		logger.info("In accept popup. Last URL: %s", response.url)
 		if self.process_errors(response, [TestStrings.error, TestStrings.login]):
 			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ""), self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+			yield self.captcha_retry_request() or scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 		# Got default response, means popup has been accepted.
 		elif response.url.lower().find(TestStrings.app_default) != -1:
 			logger.info("Got default response url %s", response.url)
@@ -89,7 +94,7 @@ class AadhaarAuthSpider(BaseSpider):
 			)
 			yield request
 
-	def fill_data(self, response):
+	async def fill_data(self, response):
 		""" Fill the aadhaar number.
 			Keyword arguments:
 			response -- previous scrapy response.
@@ -97,9 +102,13 @@ class AadhaarAuthSpider(BaseSpider):
 		logger.info("In fill data. Last URL: %s", response.url)
 		if self.process_errors(response, [TestStrings.error], html=False):
 			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ""), self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+			return [scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)]
 		else:
-			captcha_value = get_captcha_string(response.body)
+			captcha = await self.solve_captcha(response.body)
+			request = self.refetch_captcha(response, captcha)
+			if request:
+				return [request]
+			captcha_value = captcha.text
 
 			# Get old response after getting captcha
 			response = response.meta["old_response"]
@@ -111,9 +120,10 @@ class AadhaarAuthSpider(BaseSpider):
 				callback=self.parse,
 				errback=self.errback_next,
 				dont_filter=True,
-				dont_click=True
+				dont_click=True,
+				meta={"captcha": captcha}
 			)
-			yield request
+			return [request]
 
 	def parse(self, response):
 		logger.info("In parse. Last URL: %s", response.url)
@@ -128,13 +138,14 @@ class AadhaarAuthSpider(BaseSpider):
 				self.student[FormKeys.aadhaar_otp_authenticated()] = "Y"
 			self.student[FormKeys.status()] = "Success"
 			self.students[self.current_student_index] = self.student
+			self.record_captcha(response, ACCEPTED)
 			logger.info("----------------Aadhaar got authenticated---------------")
 			print("----------------Aadhaar got authenticated---------------")
 			self.skip_to_next_valid()
 		else:
 			self.process_errors(response, [TestStrings.app_default, TestStrings.aadhaar_auth, TestStrings.error])
 		url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ""), self.is_renewal)
-		yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+		yield self.captcha_retry_request() or scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 
 	def get_captcha(self, response):
 		logger.info("In Captcha. Last URL: " + response.url)
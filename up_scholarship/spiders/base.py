@@ -1,9 +1,9 @@
 import urllib.parse as urlparse
 from datetime import datetime
+import functools
+import inspect
+import itertools
 import scrapy
-from scrapy.spidermiddlewares.httperror import HttpError
-from twisted.internet.error import DNSLookupError
-from twisted.internet.error import TimeoutError, TCPTimedOutError
 from scrapy.exceptions import CloseSpider
 import logging
 from dataclasses import dataclass
@@ -14,6 +14,13 @@ from up_scholarship.providers.student_file import StudentFile
 from up_scholarship.providers import utilities as utl
 from up_scholarship.providers.url import UrlProviders
 from up_scholarship.providers.codes import CodeFileReader
+from up_scholarship.providers.retry import RetryPolicy, classify_failure, PAGE, PORTAL, ALERT, CAPTCHA
+from up_scholarship.providers.concurrency import portal_error
+from up_scholarship.providers.http_archive import REPLAY
+from up_scholarship.tools.solve_captcha_using_model import get_solver
+from up_scholarship.tools.captcha_service import get_captcha_service
+from up_scholarship.tools.captcha_daemon import daemon_running
+from up_scholarship.tools.captcha_ledger import get_ledger, ACCEPTED, REJECTED, REFETCHED
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +34,57 @@ class SkipConfig:
 	pre_required_keys = []
 	post_required_keys = []
 
+
+class SessionDone(Exception):
+	""" Raised in a callback when its session has no students left, ends the session's chain of requests."""
+
+
+class StudentSession:
+	""" State of one student being processed, several sessions run at the same time."""
+	def __init__(self, id: int):
+		self.id = id
+		self.student = None
+		self.tried = 0  # Number of times we have tried filling data for the student.
+		self.current_student_index = 0  # Student"s index in student"s list.
+		self.is_renewal = False  # Stores whether the student is renewal.
+		self.cookiejar = id  # Every student gets a fresh cookie jar so logins don't mix.
+		self.done = False
+		self.paused = False  # Waiting for the session limit to be raised before taking the next student.
+		self.captcha_request = None  # Last captcha request, its meta has the form page the captcha is for.
+		self.captcha_wrong = False  # Whether the last checked response said the captcha was wrong.
+		self.retries = {}  # Retries of the student made for every error class.
+		self.backoff_delay = 0  # Delay for the next request of the session after an error.
+
+
+class StudentSessionMiddleware:
+	""" Run callbacks with the student session of the response they got.
+		Requests from the callback are tagged with the session and its cookie jar. The session is bound
+		again before every item taken from a generator callback, since callbacks of sessions interleave.
+	"""
+	def process_spider_output(self, response, result, spider):
+		return spider.session_output(result, response.meta.get("student_session"))
+
+	def process_spider_exception(self, response, exception, spider):
+		if isinstance(exception, SessionDone):
+			return []
+		return None
+
+
 class BaseSpider(scrapy.Spider):
+	max_sessions = None	# Cap on CommonData.concurrent_students for spiders whose students can't run together.
+	custom_settings = {
+		# Closest to the spider so it sees callback output before any other middleware
+		"SPIDER_MIDDLEWARES": {"up_scholarship.spiders.base.StudentSessionMiddleware": 1000},
+		# Before DownloadTimeoutMiddleware so the endpoint timeout is not overridden
+		"DOWNLOADER_MIDDLEWARES": {
+			"up_scholarship.providers.retry.BackoffMiddleware": 50,
+			# Next to the downloader so archived responses go through cookies and redirects like live ones
+			"up_scholarship.providers.http_archive.HttpArchiveMiddleware": 900,
+		},
+		# Retries go through the retry policy of the error class instead
+		"RETRY_ENABLED": False,
+		"EXTENSIONS": {"up_scholarship.providers.concurrency.AdaptiveConcurrency": 500},
+	}
 
 	def __init__(self, cls, skip_config: SkipConfig, auto_skip=True, *args, **kwargs):
 		""" Load student"s file and init variables"""
@@ -36,6 +93,21 @@ class BaseSpider(scrapy.Spider):
 		super().__init__(cls, *args, **kwargs)
 		self.auto_skip = auto_skip
 		self.cd = CommonData()
+		concurrent_students = max(min(self.cd.concurrent_students, self.max_sessions or self.cd.concurrent_students), 1)
+		max_students = concurrent_students
+		if self.cd.adaptive_concurrency:
+			# Sessions above concurrent_students start paused until the portal proves healthy
+			max_students = max(self.cd.adaptive_max_students, concurrent_students)
+			max_students = min(max_students, self.max_sessions or max_students)
+		self.sessions = [StudentSession(i) for i in range(max_students)]
+		self.session = self.sessions[0]  # Session whose callback is running.
+		self.session_limit = concurrent_students  # Sessions allowed to work on students, changed with portal's health.
+		self.next_student_index = 0  # Last student"s index claimed by any session.
+		self.cookiejars = itertools.count()
+		self.captcha_solver = get_solver()	# Shared by every spider in this process.
+		if self.cd.captcha_warm_up and not daemon_running():
+			# Overlaps loading the model with reading students and fetching the first pages
+			self.captcha_solver.start_warm_up()
 		self.students = StudentFile().read_file(self.cd.students_in_file, self.cd.file_in_type)
 		self.total_students = len(self.students)
 		self.url_provider = UrlProviders(self.cd)
@@ -48,14 +120,141 @@ class BaseSpider(scrapy.Spider):
 		self.branch = CodeFileReader(self.cd.branch_file)
 		self.course = CodeFileReader(self.cd.course_file)
 		self.sub_caste = CodeFileReader(self.cd.sub_caste_file)
-		self.tried = 0  # Number of times we have tried filling data for a students.
-		self.current_student_index = 0  # Current student"s index in student"s list.
 		self.err_students = []  # List of students we encountered error for.
-		self.is_renewal = False  # Stores whether the current student is renewal.
 		self.skip_config = skip_config
-		self.student = None
+		self.captcha_service = get_captcha_service(self.cd.captcha_workers)
+		self.captcha_ledger = get_ledger()
+		self.retry_policy = RetryPolicy(self.cd)
 		if self.auto_skip:
+			for session in self.sessions:
+				self.bind_session(session)
+				self.skip_to_next_valid(raise_exc=False)
+
+	@property
+	def student(self):
+		return self.session.student
+
+	@student.setter
+	def student(self, student):
+		self.session.student = student
+
+	@property
+	def tried(self) -> int:
+		return self.session.tried
+
+	@tried.setter
+	def tried(self, tried: int):
+		self.session.tried = tried
+
+	@property
+	def current_student_index(self) -> int:
+		return self.session.current_student_index
+
+	@current_student_index.setter
+	def current_student_index(self, index: int):
+		self.session.current_student_index = index
+
+	@property
+	def is_renewal(self) -> bool:
+		return self.session.is_renewal
+
+	@is_renewal.setter
+	def is_renewal(self, is_renewal: bool):
+		self.session.is_renewal = is_renewal
+
+	def bind_session(self, session: StudentSession):
+		""" Make student, tried and the rest refer to the session."""
+		if session:
+			self.session = session
+
+	def bind_request(self, request):
+		""" Tag a request with the bound session and its cookie jar, its callbacks run with the session again."""
+		session = request.meta.setdefault("student_session", self.session)
+		request.meta.setdefault("cookiejar", session.cookiejar)
+		if session.backoff_delay:
+			request.meta.setdefault("backoff_delay", session.backoff_delay)
+			session.backoff_delay = 0
+		if request.callback and not hasattr(request.callback, "student_session"):
+			request.callback = self._session_bound(request.callback, session)
+		if request.errback and not hasattr(request.errback, "student_session"):
+			request.errback = self._session_bound(request.errback, session)
+		return request
+
+	def _session_bound(self, callback, session: StudentSession):
+		@functools.wraps(callback)
+		def bound(*args, **kwargs):
+			self.bind_session(session)
+			result = callback(*args, **kwargs)
+			if inspect.iscoroutine(result):
+				return self._bound_coroutine(result, session)
+			return result
+		bound.student_session = session
+		return bound
+
+	async def _bound_coroutine(self, coroutine, session: StudentSession):
+		self.bind_session(session)
+		return await coroutine
+
+	def session_output(self, result, session: StudentSession):
+		""" Iterate callback output with its session bound, tagging the requests with the session."""
+		iterator = iter(result or ())
+		while True:
+			self.bind_session(session)
+			try:
+				output = next(iterator)
+			except (StopIteration, SessionDone):
+				return
+			if isinstance(output, scrapy.Request):
+				output = self.bind_request(output)
+			yield output
+
+	def start_requests(self):
+		""" Start every session which got a student."""
+		for session in self.sessions:
+			if session.student:
+				self.bind_session(session)
+				yield from self.session_output(self.start_student_requests(), session)
+
+	def start_student_requests(self):
+		""" Yield the first requests for the bound session's student."""
+		return []
+
+	def active_sessions(self) -> int:
+		return sum(1 for session in self.sessions if session.student and not session.done)
+
+	def set_session_limit(self, limit: int) -> int:
+		""" Change how many sessions work on students at the same time.
+			Lowering it pauses sessions as they finish their students, raising it resumes paused sessions.
+			Keyword arguments:
+			limit -- wanted number of sessions.
+			Returns: the limit after clamping it to the sessions there are, at most adaptive_max_students
+		"""
+		self.session_limit = max(1, min(limit, len(self.sessions)))
+		current = self.session
+		for session in self.sessions:
+			if self.active_sessions() >= self.session_limit:
+				break
+			if not session.paused or session.done:
+				continue
+			session.paused = False
+			self.bind_session(session)
 			self.skip_to_next_valid(raise_exc=False)
+			for request in self.session_output(self.start_student_requests(), session):
+				self.crawler.engine.crawl(request, self)
+		self.bind_session(current)
+		return self.session_limit
+
+	def end_session(self, raise_exc=True):
+		""" End the bound session as no students are left for it, save and close after the last one."""
+		self.session.done = True
+		# Paused sessions would find no students either
+		for session in self.sessions:
+			if session.paused:
+				session.done = True
+		if all(session.done for session in self.sessions):
+			self.save_and_done(raise_exc)
+		elif raise_exc:
+			raise SessionDone()
 
 
 
@@ -71,20 +270,25 @@ class BaseSpider(scrapy.Spider):
 		parseq = urlparse.parse_qs(parsed.query)
 		error = False
 		errorstr = ""
+		error_class = None
+		captcha_wrong = False
 		# They are ordered for preference of error
 		# If we match the check_str set it to generic error.
 		for check_string in check_strings:
 			if response.url.lower().find(check_string.lower()) != -1:
 				error = True
 				errorstr = "Unknown error occured"
+				error_class = PAGE
 		# Process code in url argument
 		if "a" in parseq:
 			error = True
 			if parseq["a"][0] == "c":
 				errorstr = "captcha wrong"
+				captcha_wrong = True
+				error_class = CAPTCHA
 			else:
 				errorstr = "Error code: " + parseq["a"][0]
-				self.tried = self.cd.max_tries
+				error_class = PORTAL
 		# If the response is html, check for extra errors in the html page
 		if html:
 			error_in = response.xpath(
@@ -93,7 +297,10 @@ class BaseSpider(scrapy.Spider):
 				errorstr = error_in
 				error = True
 				if error_in not in TestStrings.invalid_captcha:
-					self.tried = self.cd.max_tries
+					error_class = ALERT
+				else:
+					captcha_wrong = True
+					error_class = CAPTCHA
 				if error_in == TestStrings.aadhaar_auth_failed:
 					self.student[FormKeys.skip()] = "Y"
 			# Check if error messages are in scripts
@@ -102,62 +309,143 @@ class BaseSpider(scrapy.Spider):
 				for script in scripts:
 					if 10 < len(script) < 120 and script.find(TestStrings.alert) != -1:
 						errorstr = script[7:-1]
-						self.tried = self.cd.max_tries
+						error_class = ALERT
 						error = True
 					# If we have error save page as html file.
+		self.session.captcha_wrong = captcha_wrong
+		if captcha_wrong:
+			self.record_captcha(response, REJECTED)
+		elif not error:
+			self.record_captcha(response, ACCEPTED)
 		if error:
 			logger.info("Error string: %s", errorstr)
 			utl.save_file_with_name(self.student, response, self.spider_name, str(datetime.today().year), tried=self.tried, is_debug=True)
-			# Check if we have reached max retries and then move to other students, if available
-			if self.tried >= self.cd.max_tries:
-				self.student[FormKeys.status()] = errorstr
-				self.students[self.current_student_index] = self.student
-				self.err_students.append(self.student)
-				if self.auto_skip:
-					self.skip_to_next_valid()
-			else:
-				self.tried += 1
+			self.retry_error(error_class, errorstr, response.url)
 		return error
 
+	def retry_error(self, error_class: str, error_str: str, url: str) -> bool:
+		""" Count a retry of the student for the error and set the backoff for the session's next request.
+			The student is parked and next one is taken once the retries of the error class are used up.
+			Keyword arguments:
+			error_class -- class of the error from providers/retry.py.
+			error_str -- error to be saved as student's status if parked.
+			url -- url the error happened on.
+			Returns: whether the student can be retried
+		"""
+		self.crawler.signals.send_catch_log(signal=portal_error, spider=self, error_class=error_class, url=url)
+		retries = self.session.retries.get(error_class, 0)
+		if self.retry_policy.can_retry(error_class, retries):
+			self.session.retries[error_class] = retries + 1
+			self.session.backoff_delay = self.retry_policy.get_delay(error_class, retries)
+			self.tried += 1
+			return True
+		logger.warning("No retries left for %s errors, parking student.", error_class)
+		# Spiders not working on students have nothing to park
+		if self.student:
+			self.student[FormKeys.status()] = error_str
+			self.students[self.current_student_index] = self.student
+			self.err_students.append(self.student)
+		if self.auto_skip:
+			self.skip_to_next_valid()
+		return False
+
+	async def solve_captcha(self, captcha_image_file):
+		""" Solve the captcha off the reactor thread.
+			Keyword arguments:
+			captcha_image_file -- encoded captcha image bytes.
+			Returns: the CaptchaResult, await it in the callback.
+		"""
+		session = self.session
+		profile = None
+		# The ctc model is trained on captcha_profile so it keeps that profile
+		if self.cd.captcha_auto_profile and self.cd.captcha_recognizer != "ctc":
+			profile = self.captcha_ledger.choose_profile()
+		captcha = await self.captcha_service.solve(captcha_image_file, profile)
+		# Other sessions' callbacks ran while this one waited
+		self.bind_session(session)
+		return captcha
+
+	def record_captcha(self, response, outcome: str):
+		""" Record the outcome of the captcha submitted with the response's request in the captcha ledger.
+			Nothing is recorded for responses to requests which didn't submit a captcha.
+			Keyword arguments:
+			response -- response to the captcha submission.
+			outcome -- ACCEPTED or REJECTED.
+		"""
+		# Pop it so the same submission is not counted twice
+		captcha = response.meta.pop("captcha", None)
+		if captcha:
+			self.captcha_ledger.record(captcha, outcome)
+
+	def refetch_captcha(self, response, captcha):
+		""" Get a request for a fresh captcha image if the solved one is not confident enough.
+			Keyword arguments:
+			response -- captcha image response.
+			captcha -- CaptchaResult solved from the response.
+			Returns: request with the same callback and meta or None if the captcha should be submitted.
+		"""
+		self.session.captcha_request = response.request
+		refetches = response.meta.get("captcha_refetches", 0)
+		if captcha.confidence >= self.cd.captcha_min_confidence or refetches >= self.cd.captcha_max_refetches:
+			return None
+		logger.info("Captcha confidence %.3f too low, refetching captcha.", captcha.confidence)
+		self.captcha_ledger.record(captcha, REFETCHED)
+		request = response.request.replace(url=self.url_provider.get_captcha_url())
+		request.meta["captcha_refetches"] = refetches + 1
+		return request
+
+	def captcha_retry_request(self):
+		""" Get a request for only a new captcha after the last one was wrong.
+			The form page parsed for the wrong submission is submitted again in the same cookie session, so the
+			form and the pages before it are not downloaded again.
+			Returns: captcha request or None if the form has to be opened again.
+		"""
+		request = self.session.captcha_request
+		if not self.cd.captcha_fast_retry or not self.session.captcha_wrong or request is None:
+			return None
+		self.session.captcha_wrong = False
+		logger.info("Captcha wrong, fetching only a new captcha.")
+		request = request.replace(url=self.url_provider.get_captcha_url())
+		request.meta["captcha_refetches"] = 0
+		return request
+
+	def closed(self, reason):
+		logger.info("Captcha solver stats: %s", self.captcha_solver.stats())
+		logger.info("Captcha ledger stats: %s", self.captcha_ledger.stats())
+
 	def save_and_done(self, raise_exc=True):
-		st_file = StudentFile()
-		utl.copy_file(self.cd.students_in_file, self.cd.students_old_file)
-		st_file.write_file(self.students, self.cd.students_in_file, self.cd.students_out_file, self.cd.file_out_type)
-		st_file.write_file(self.err_students, "", self.cd.students_err_file, self.cd.file_err_type)
+		if self.settings.get("HTTP_ARCHIVE_MODE") == REPLAY:
+			# Replayed responses are not the portal's current state
+			logger.info("Replayed run, students file is left unchanged.")
+		else:
+			st_file = StudentFile()
+			utl.copy_file(self.cd.students_in_file, self.cd.students_old_file)
+			st_file.write_file(self.students, self.cd.students_in_file, self.cd.students_out_file, self.cd.file_out_type)
+			st_file.write_file(self.err_students, "", self.cd.students_err_file, self.cd.file_err_type)
 		if raise_exc:
 			raise CloseSpider("All students done")
 	
 	def errback_next(self, failure):
-		""" Process network errors.
+		""" Retry the request after a network error, parking only the student once the retries are used up.
 			Keyword arguments:
 			failure -- previous scrapy network failure.
+			Returns: list of requests to continue the session with.
 		"""
 		# log all failures
 		logger.error(repr(failure))
-		error_str = repr(failure)
-		if failure.check(HttpError):
-			# these exceptions come from HttpError spider middleware
-			response = failure.value.response
-			logger.error("HttpError on %s", response.url)
-			error_str = "HttpError on " + response.url
-
-		elif failure.check(DNSLookupError):
-			# this is the original request
-			request = failure.request
-			logger.error("DNSLookupError on %s", request.url)
-			error_str = "DNSLookupError on " + request.url
-
-		elif failure.check(TimeoutError, TCPTimedOutError):
-			request = failure.request
-			logger.error("TimeoutError on %s", request.url)
-			error_str = "TimeoutError on " + request.url
-
-		# Close spider if we encounter above errors.
-		self.student[FormKeys.status()] = error_str
-		self.err_students.append(self.student)
-		self.students[self.current_student_index] = self.student
-		self.save_and_done()
-	
+		error_class, error_str = classify_failure(failure)
+		logger.error(error_str)
+		try:
+			if self.retry_error(error_class, error_str, failure.request.url):
+				request = failure.request.replace(dont_filter=True)
+				request.meta["backoff_delay"] = self.session.backoff_delay
+				self.session.backoff_delay = 0
+				return [request]
+			# Errback output skips the spider middlewares so requests of next student are tagged here
+			return list(self.session_output(self.start_student_requests(), self.session))
+		except SessionDone:
+			return []
+
 	def mark_is_renew(self):
 		if self.student.get(FormKeys.old_reg_no()):
 			logger.info("Application is renewal.")
@@ -168,9 +456,16 @@ class BaseSpider(scrapy.Spider):
 
 	def skip_to_next_valid(self, raise_exc=True) -> int:
 		self.student = None
+		if self.active_sessions() >= self.session_limit:
+			# Portal is slow, wait until the limit is raised again
+			logger.info("Session limit %d reached, pausing session.", self.session_limit)
+			self.session.paused = True
+			if raise_exc:
+				raise SessionDone()
+			return
 		current_year = datetime.now().year
 		self.tried = 0	# Set tried to 0 because we are most probably getting next student or none
-		for self.current_student_index in range(self.current_student_index + 1, self.total_students):
+		for self.current_student_index in self._unclaimed_student_indexes():
 			student = self.students[self.current_student_index]
 			logger.info("Checking student: Name: %s Std: %s", student.get(FormKeys.name()), student.get(FormKeys.std()))
 			if not utl.check_if_keys_exist(student, self.skip_config.common_required_keys):
@@ -229,10 +524,44 @@ class BaseSpider(scrapy.Spider):
 				utl.get_std_category(student.get(FormKeys.std())) == StdCategory.pre:
 				logger.warning("Not our school. Institute: %s",  student.get(FormKeys.institute()))
 				continue
+			if not self.should_process(student):
+				continue
 			logger.info("Student selected: Name: %s Std: %s", student.get(FormKeys.name()), student.get(FormKeys.std()))
 			self.student = student
+			self.session.captcha_request = None
+			self.session.captcha_wrong = False
+			self.session.retries = {}
+			self.session.backoff_delay = 0
 			self.mark_is_renew()
+			self.session.cookiejar = self.get_student_cookiejar()
 			break
 		if not self.student:
-			self.save_and_done(raise_exc)
+			self.end_session(raise_exc)
+
+	def login_request(self):
+		""" Return request for the student login page, the login starts from its captcha."""
+		url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ""), self.is_renewal)
+		return scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+
+	def stage_done(self, response):
+		""" Continue once the spider's stage is done for the student, with the next student by default.
+			Keyword arguments:
+			response -- response the stage got done with.
+		"""
+		self.skip_to_next_valid()
+		yield self.login_request()
+
+	def should_process(self, student: dict) -> bool:
+		""" Spider specific check on a student who passed the skip config."""
+		return True
+
+	def get_student_cookiejar(self):
+		""" Return the cookie jar for the student just claimed, a fresh one so every student logs in on its own."""
+		return next(self.cookiejars)
+
+	def _unclaimed_student_indexes(self):
+		""" Yield indexes of students no session has checked yet."""
+		while self.next_student_index + 1 < self.total_students:
+			self.next_student_index += 1
+			yield self.next_student_index
 		
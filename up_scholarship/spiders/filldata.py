@@ -4,7 +4,7 @@ import logging
 
 from up_scholarship.providers.constants import FormKeys, TestStrings, StdCategory
 from up_scholarship.spiders.base import BaseSpider, SkipConfig
-from up_scholarship.tools.solve_captcha_using_model import get_captcha_string
+from up_scholarship.tools.captcha_ledger import ACCEPTED
 from up_scholarship.providers import utilities as utl
 
 logger = logging.getLogger(__name__)
@@ -32,20 +32,26 @@ class FillDataSpider(BaseSpider):
 
 	def __init__(self, *args, **kwargs):
 		""" Load student's file and init variables"""
+		super().__init__(type(self), self.get_skip_config(), *args, **kwargs)
+
+	def get_skip_config(self) -> SkipConfig:
+		""" Return config of the students this spider picks, spiders reusing the fill steps pick their own.
+			Returns: SkipConfig
+		"""
 		skip_config = SkipConfig()
 		skip_config.common_required_keys = self.common_required_keys
 		skip_config.pre_required_keys = self.pre_required_keys
 		skip_config.post_required_keys = self.post_required_keys
 		skip_config.disatisfy_criterias = [FormKeys.app_filled()]
-		super().__init__(FillDataSpider, skip_config, *args, **kwargs)
+		return skip_config
 
-	def start_requests(self):
+	def start_student_requests(self):
 		""" Load student's file and get login page if we have some students"""
 		if self.student:
 			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ''), self.is_renewal)
 			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 
-	def login_form(self, response):
+	async def login_form(self, response):
 		""" Login the form after getting captcha from previous response.
 			Keyword arguments:
 			response -- previous scrapy response.
@@ -53,10 +59,14 @@ class FillDataSpider(BaseSpider):
 		logger.info('In login form. Last URL: %s', response.url)
 		if self.process_errors(response, [TestStrings.error], html=False):
 			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ''), self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+			return [scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)]
 		else:
 			# Get captcha text from our ml model
-			captcha_value = get_captcha_string(response.body)
+			captcha = await self.solve_captcha(response.body)
+			request = self.refetch_captcha(response, captcha)
+			if request:
+				return [request]
+			captcha_value = captcha.text
 
 			# Get old response after getting captcha
 			response = response.meta['old_response']
@@ -76,9 +86,10 @@ class FillDataSpider(BaseSpider):
 				formdata=form_data,
 				callback=self.accept_popup,
 				errback=self.errback_next,
-				dont_filter=True
+				dont_filter=True,
+				meta={"captcha": captcha}
 			)
-			yield request
+			return [request]
 
 	def accept_popup(self, response):
 		""" If we get popup about accepting terms accept them and if not continue filling other things.
@@ -88,7 +99,7 @@ class FillDataSpider(BaseSpider):
 		logger.info('In accept popup. Last URL: %s', response.url)
 		if self.process_errors(response, [TestStrings.error, TestStrings.login]):
 			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ''), self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+			yield self.captcha_retry_request() or scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 		# Got default response, means popup has been accepted.
 		elif response.url.lower().find(TestStrings.app_default) != -1:
 			logger.info('Got default response url %s', response.url)
@@ -192,7 +203,7 @@ class FillDataSpider(BaseSpider):
 			)
 			yield request
 
-	def fill_data(self, response):
+	async def fill_data(self, response):
 		""" Fill the other form data which does not required page to be refreshed.
 			Keyword arguments:
 			response -- previous scrapy response.
@@ -200,9 +211,13 @@ class FillDataSpider(BaseSpider):
 		logger.info('In fill data. Last URL: %s', response.url)
 		if self.process_errors(response, [TestStrings.error], html=False):
 			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ''), self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+			return [scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)]
 		else:
-			captcha_value = get_captcha_string(response.body)
+			captcha = await self.solve_captcha(response.body)
+			request = self.refetch_captcha(response, captcha)
+			if request:
+				return [request]
+			captcha_value = captcha.text
 			# Get old response after getting captcha
 			response = response.meta['old_response']
 			form_data = self.get_fill_form_data(self.student, captcha_value)
@@ -213,9 +228,10 @@ class FillDataSpider(BaseSpider):
 				callback=self.parse,
 				errback=self.errback_next,
 				dont_filter=True,
-				dont_click=True
+				dont_click=True,
+				meta={"captcha": captcha}
 			)
-			yield request
+			return [request]
 
 	def parse(self, response):
 		""" Parse the form to check if the form is really filled.
@@ -228,12 +244,13 @@ class FillDataSpider(BaseSpider):
 			self.student[FormKeys.app_filled()] = 'Y'
 			self.student[FormKeys.status()] = 'Success'
 			self.students[self.current_student_index] = self.student
+			self.record_captcha(response, ACCEPTED)
 			logger.info("----------------Application got filled---------------")
 			self.skip_to_next_valid()
 		else:
 			self.process_errors(response, [TestStrings.app_fill_form, TestStrings.error])
 		url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ''), self.is_renewal)
-		yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+		yield self.captcha_retry_request() or scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 
 	def get_captcha(self, response):
 		logger.info("In Captcha. Last URL " + response.url)
@@ -0,0 +1,207 @@
+import scrapy
+import logging
+from abc import ABC, abstractmethod
+
+from up_scholarship.providers.constants import FormKeys, TestStrings, FormSets
+from up_scholarship.spiders.base import BaseSpider, SkipConfig
+from up_scholarship.providers import utilities as utl
+
+logger = logging.getLogger(__name__)
+
+
+class InstituteBaseSpider(BaseSpider, ABC):
+	""" Base of the spiders working on students from the institute login.
+		The institute logs in once for every std category and students of the category share its cookie jar,
+		so after the first login a student only needs the search and the action. The spider logs in again only
+		when the portal sends it back to the login page.
+	"""
+	# Students of a category share one login, the portal keeps the search state in it
+	max_sessions = 1
+
+	def __init__(self, cls, skip_config: SkipConfig, *args, **kwargs):
+		""" Load student"s file and init variables"""
+		self.logged_in = set()  # Std categories whose cookie jar holds a live institute login.
+		super().__init__(cls, skip_config, *args, **kwargs)
+		self.cd.current_form_set = FormSets.two
+
+	@abstractmethod
+	def get_action_url(self, std: str) -> str:
+		""" Return url of the page where the student is searched and acted on."""
+
+	@abstractmethod
+	def get_search_callback(self):
+		""" Return the callback acting on the searched application."""
+
+	def get_student_cookiejar(self):
+		return "institute-%s" % self.std_category.name
+
+	@property
+	def std_category(self):
+		return utl.get_std_category(self.student.get(FormKeys.std()))
+
+	def start_student_requests(self):
+		""" Get institute login page"""
+		if self.student:
+			yield self.action_request()
+
+	def action_request(self):
+		""" Return request opening the action page for the student, logging in first if the category needs it."""
+		if self.std_category not in self.logged_in:
+			return self.login_request()
+		url = self.get_action_url(self.student.get(FormKeys.std(), ""))
+		return scrapy.Request(url=url, callback=self.search_application_number, dont_filter=True, errback=self.errback_next)
+
+	def login_request(self):
+		""" Return request for the institute login page of student's category."""
+		url = self.url_provider.get_institute_login_url(self.student.get(FormKeys.std(), ""))
+		return scrapy.Request(url=url, callback=self.get_district, dont_filter=True, errback=self.errback_next)
+
+	def relogin_request(self, std_category):
+		""" Forget the login of the category which got logged out and return request for the current student.
+			The failed student may have been parked, so the category is taken before its errors are processed.
+			Keyword arguments:
+			std_category -- std category of the student the action page failed for.
+			Returns: Request
+		"""
+		self.logged_in.discard(std_category)
+		return self.action_request()
+
+	def action_retry_request(self, response, std_category):
+		""" Return request retrying the action page after an error on it.
+			Only a redirect to the login page costs the category its login, other errors are retried on it.
+			Keyword arguments:
+			response -- response the error happened on.
+			std_category -- std category of the student the action page failed for.
+			Returns: Request
+		"""
+		if self.is_logged_out(response):
+			logger.info("Institute login expired, logging in again.")
+			return self.relogin_request(std_category)
+		return self.action_request()
+
+	def is_logged_out(self, response) -> bool:
+		""" Check whether the portal redirected to the login page as the login has expired."""
+		return response.url.lower().find(TestStrings.institute_login.lower()) != -1
+
+	def get_district(self, response):
+		""" Fill the school district.
+				Keyword arguments:
+				response -- previous scrapy response.
+		"""
+		logger.info("In get school. Last URL: %s", response.url)
+		if self.process_errors(response, [TestStrings.error]):
+			yield self.action_request()
+		else:
+			std_category = self.std_category
+			form_data = {
+				FormKeys.event_target()					: FormKeys.institute_login_type_radio_button(std_category=std_category),
+				FormKeys.district(form=True)			: self.district.get_code("rampur"),
+				FormKeys.institute_login_type_radio_button(form=True): FormKeys.institute_login_radio_button_value(std_category=std_category),
+			}
+			request = scrapy.FormRequest.from_response(
+				response,
+				formdata=form_data,
+				callback=self.get_captcha,
+				errback=self.errback_next,
+				dont_filter=True,
+				dont_click=True
+			)
+			yield request
+
+	def get_captcha(self, response):
+		logger.info("In Captcha. Last URL " + response.url)
+		if self.process_errors(response, [TestStrings.error]):
+			yield self.action_request()
+		else:
+			captcha_url = self.url_provider.get_captcha_url()
+			request = scrapy.Request(url=captcha_url, callback=self.login_form, dont_filter=True, errback=self.errback_next)
+			request.meta["old_response"] = response
+			yield request
+
+	async def login_form(self, response):
+		""" Login the form after getting captcha from previous response.
+			Keyword arguments:
+			response -- previous scrapy response.
+		"""
+		logger.info("In login form. Last URL: %s", response.url)
+		if self.process_errors(response, [TestStrings.error], html=False):
+			return [self.action_request()]
+		else:
+			# Get captcha text from our ml model
+			captcha = await self.solve_captcha(response.body)
+			request = self.refetch_captcha(response, captcha)
+			if request:
+				return [request]
+			captcha_value = captcha.text
+
+			# Get old response after getting captcha
+			response = response.meta["old_response"]
+
+			hf = response.xpath("//*[@id='" + FormKeys.hf() + "']/@value").extract_first()
+
+			form_data = utl.get_login_institute_data(
+				self.student,
+				captcha_value,
+				hf,
+				self.district,
+				self.institute)
+			logger.info("Login form data: %s", form_data)
+			request = scrapy.FormRequest.from_response(
+				response,
+				formdata=form_data,
+				callback=self.logged_in_page,
+				errback=self.errback_next,
+				dont_filter=True,
+				meta={"captcha": captcha}
+			)
+			return [request]
+
+	def logged_in_page(self, response):
+		""" Remember the login for the category and open the action page.
+			Keyword arguments:
+			response -- previous scrapy response.
+		"""
+		logger.info("In logged in page. Last URL: %s", response.url)
+		if self.process_errors(response, [TestStrings.error]) or \
+			response.url.lower().find(TestStrings.institute_login_success.lower()) == -1:
+			yield self.captcha_retry_request() or self.action_request()
+		else:
+			logger.info("Logged in as institute for %s students", self.std_category.name)
+			self.logged_in.add(self.std_category)
+			yield self.action_request()
+
+	def search_application_number(self, response):
+		""" Search the application number.
+			Keyword arguments:
+			response -- previous scrapy response.
+		"""
+		logger.info("In search_application_number. Last URL: %s", response.url)
+		std_category = self.std_category
+		if self.is_logged_out(response) or self.process_errors(response, [TestStrings.error]):
+			yield self.action_retry_request(response, std_category)
+		else:
+			app_type = "1" if self.is_renewal else "0"
+			form_data = {
+				FormKeys.application_type(form=True)			: app_type,
+				FormKeys.registration_number_search(form=True)	: self.student.get(FormKeys.reg_no(), ""),
+				FormKeys.search_button(form=True)				: FormKeys.search_button()
+			}
+			logger.info("Search form data: %s", form_data)
+			request = scrapy.FormRequest.from_response(
+				response,
+				formdata=form_data,
+				callback=self.get_search_callback(),
+				errback=self.errback_next,
+				dont_filter=True,
+				dont_click=True
+			)
+			yield request
+
+	def application_not_found(self):
+		""" Mark the student's application as not found and return request for the next student."""
+		message = "Application registration number not found."
+		logger.info("Application status: %s", message)
+		self.student[FormKeys.status()] = message
+		self.students[self.current_student_index] = self.student
+		self.skip_to_next_valid()
+		return self.action_request()
@@ -0,0 +1,206 @@
+import urllib.parse as urlparse
+import scrapy
+import logging
+
+from up_scholarship.providers.constants import FormKeys, TestStrings, StdCategory
+from up_scholarship.spiders.base import SkipConfig
+from up_scholarship.spiders.filldata import FillDataSpider
+from up_scholarship.spiders.uploadphoto import UploadPhotoSpider, PhotoUploadMixin
+from up_scholarship.spiders.submitcheck import SubmitDataspider, SubmitCheckMixin
+from up_scholarship.spiders.finalsubmit import FinalSubmitDataSpider, FinalSubmitMixin
+from up_scholarship.providers.retry import PAGE
+from up_scholarship.tools.captcha_ledger import ACCEPTED
+from up_scholarship.providers import utilities as utl
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineSpider(PhotoUploadMixin, SubmitCheckMixin, FinalSubmitMixin, FillDataSpider):
+	""" Fill, upload photo, submit for check and final submit a student on one login.
+		The student logs in once and every stage not marked done runs in order from the default page of the
+		same session, instead of running filldata, uploadphoto, submitcheck and submitfinal one after another.
+	"""
+	name = "pipeline"
+	login_required_keys = [FormKeys.skip(), FormKeys.std(), FormKeys.reg_no(), FormKeys.dob()]
+	# Stages in the order they run, each is pending when its key is "N" and done when it is "Y"
+	stages = [FormKeys.app_filled(), FormKeys.photo_uploaded(), FormKeys.submitted_for_check(), FormKeys.final_submitted()]
+	# Keys the standalone spider of every stage after fill requires, fill uses FillDataSpider's own keys
+	stage_required_keys = {
+		FormKeys.photo_uploaded(): UploadPhotoSpider.common_required_keys + [FormKeys.reg_year(), FormKeys.aadhaar_no()],
+		FormKeys.submitted_for_check(): SubmitDataspider.common_required_keys,
+		FormKeys.final_submitted(): FinalSubmitDataSpider.common_required_keys + [FormKeys.religion(), FormKeys.caste()],
+	}
+
+	def __init__(self, *args, **kwargs):
+		""" Load student"s file and init variables"""
+		self.default_urls = {}  # Default page of every session's student, stages start from and return to it.
+		super().__init__(*args, **kwargs)
+
+	def get_skip_config(self) -> SkipConfig:
+		skip_config = SkipConfig()
+		skip_config.common_required_keys = self.login_required_keys
+		return skip_config
+
+	def should_process(self, student: dict) -> bool:
+		return self.get_pending_stage(student) is not None
+
+	def get_pending_stage(self, student: dict):
+		""" Return key of the first stage not done yet or None if it is blocked or every stage is done.
+			Keyword arguments:
+			student -- student whose stages are checked.
+			Returns: str or None
+		"""
+		for stage in self.stages:
+			if student.get(stage) == "Y":
+				continue
+			# Like disatisfy_criterias, only "N" means the stage still has to run
+			if student.get(stage) != "N":
+				logger.warning("Stage %s is not marked N for student. Name: %s", stage, student.get(FormKeys.name()))
+				return None
+			if stage == FormKeys.app_filled():
+				std_category = utl.get_std_category(student.get(FormKeys.std()))
+				category_keys = self.pre_required_keys if std_category == StdCategory.pre else self.post_required_keys
+				ready = utl.check_if_keys_exist(student, self.common_required_keys + category_keys)
+			else:
+				ready = utl.check_if_keys_exist(student, self.stage_required_keys[stage])
+			if ready and stage == FormKeys.photo_uploaded():
+				ready = utl.check_if_file_exists(self.get_photo_file(student))
+			elif ready and stage == FormKeys.submitted_for_check():
+				# Aadhaar authentication needs the OTP so it is left to aadhaarauth
+				ready = student.get(FormKeys.aadhaar_authenticated()) == "Y" and \
+					student.get(FormKeys.aadhaar_otp_authenticated()) == "Y"
+			if not ready:
+				logger.warning("Stage %s can't run for student. Name: %s", stage, student.get(FormKeys.name()))
+			return stage if ready else None
+		return None
+
+	def default_page_request(self):
+		""" Return request going back to the default page to run the next stage."""
+		url = self.default_urls[self.session.id]
+		return scrapy.Request(url=url, callback=self.default_page, dont_filter=True, errback=self.errback_next)
+
+	def stage_done(self, response):
+		""" Start the next pending stage instead of moving to the next student.
+			Keyword arguments:
+			response -- response the stage got done with.
+		"""
+		# Submitting for check lands back on the default page, other stages go back to it
+		if response.url.lower().find(TestStrings.app_default) != -1:
+			yield from self.next_stage(response)
+		else:
+			yield self.default_page_request()
+
+	def accept_popup(self, response):
+		""" If we get popup about accepting terms accept them and if not start the pending stages.
+			Keyword arguments:
+			response -- previous scrapy response.
+		"""
+		logger.info("In accept popup. Last URL: %s", response.url)
+		if self.process_errors(response, [TestStrings.error, TestStrings.login]):
+			yield self.captcha_retry_request() or self.login_request()
+		# Got default response, means popup has been accepted.
+		elif response.url.lower().find(TestStrings.app_default) != -1:
+			self.record_captcha(response, ACCEPTED)
+			self.default_urls[self.session.id] = response.url
+			yield from self.next_stage(response)
+		# Popup might not have been accepted, accept it
+		else:
+			logger.info("Accepting popup. Last URL: %s", response.url)
+			request = scrapy.FormRequest.from_response(
+				response,
+				formdata={
+					FormKeys.check_popup_agree(form=True)	: "on",
+					FormKeys.popup_button(form=True)		: "Proceed >>>",
+				},
+				callback=self.accept_popup,
+				errback=self.errback_next,
+				dont_filter=True,
+			)
+			yield request
+
+	def default_page(self, response):
+		""" Run the next stage if the session is still logged in, else log in again.
+			Keyword arguments:
+			response -- previous scrapy response.
+		"""
+		logger.info("In default page. Last URL: %s", response.url)
+		if response.url.lower().find(TestStrings.app_default) == -1:
+			# Counts a retry even when no error matched, so a lost session can't log in again forever
+			if not self.process_errors(response, [TestStrings.app_default, TestStrings.error]):
+				self.retry_error(PAGE, "Default page not reached", response.url)
+			yield self.login_request()
+		else:
+			yield from self.next_stage(response)
+
+	def next_stage(self, response):
+		""" Start the first pending stage from the default page, or move to next student when none is left.
+			Keyword arguments:
+			response -- default page response.
+		"""
+		stage = self.get_pending_stage(self.student)
+		if stage is None:
+			self.students[self.current_student_index] = self.student
+			self.default_urls.pop(self.session.id, None)
+			self.skip_to_next_valid()
+			yield self.login_request()
+			return
+		logger.info("Running stage %s", stage)
+		parsed = urlparse.urlparse(response.url)
+		app_id = urlparse.parse_qs(parsed.query)["Appid"][0]
+		std = self.student.get(FormKeys.std(), "")
+		if stage == FormKeys.app_filled():
+			url = self.url_provider.get_fill_reg_url(std, app_id, self.is_renewal)
+			yield scrapy.Request(url=url, callback=self.get_bankname, dont_filter=True, errback=self.errback_next)
+		elif stage == FormKeys.photo_uploaded():
+			url = self.url_provider.get_photo_up_url(std, app_id, self.is_renewal)
+			yield scrapy.Request(url=url, callback=self.upload_photo, dont_filter=True, errback=self.errback_next)
+		elif stage == FormKeys.submitted_for_check():
+			yield self.check_print_request(response)
+		else:
+			yield self.final_submit_request(response, app_id)
+
+	def parse(self, response):
+		""" Check if the form got filled and go back for the next stage.
+			Keyword arguments:
+			response -- previous scrapy response.
+		"""
+		logger.info("In Parse. Last URL: %s", response.url)
+		if response.url.lower().find(TestStrings.app_new_filled.lower()) != -1 or response.url.lower().find(
+				TestStrings.app_renew_filled.lower()) != -1:
+			self.student[FormKeys.app_filled()] = "Y"
+			self.student[FormKeys.status()] = "Success"
+			self.students[self.current_student_index] = self.student
+			self.record_captcha(response, ACCEPTED)
+			logger.info("----------------Application got filled---------------")
+			yield from self.stage_done(response)
+		else:
+			self.process_errors(response, [TestStrings.app_fill_form, TestStrings.error])
+			yield self.captcha_retry_request() or self.login_request()
+
+	def upload_photo(self, response):
+		logger.info("In upload photo. Last URL: %s", response.url)
+		if self.process_errors(response, [TestStrings.error], html=False):
+			yield self.login_request()
+		else:
+			filename = self.get_photo_file(self.student)
+			if utl.check_if_file_exists(filename):
+				request = self.get_upload_request(response, filename, callback=self.photo_uploaded)
+				request.errback = self.errback_next
+				yield request
+			else:
+				self.student[FormKeys.status()] = "Photo file not found"
+				self.students[self.current_student_index] = self.student
+				self.skip_to_next_valid()
+				yield self.login_request()
+
+	def photo_uploaded(self, response):
+		logger.info("In photo uploaded. Last URL: %s", response.url)
+		if self.is_photo_uploaded(response):
+			self.student[FormKeys.photo_uploaded()] = "Y"
+			self.student[FormKeys.status()] = "Success"
+			self.students[self.current_student_index] = self.student
+			logger.info("----------------Photo successfully uploaded---------------")
+			yield from self.stage_done(response)
+		else:
+			self.process_errors(response, [TestStrings.photo_upload, TestStrings.error])
+			yield self.login_request()
@@ -4,7 +4,7 @@ import logging
 
 from up_scholarship.providers.constants import FormKeys, TestStrings, StdCategory
 from up_scholarship.spiders.base import BaseSpider, SkipConfig
-from up_scholarship.tools.solve_captcha_using_model import get_captcha_string
+from up_scholarship.tools.captcha_ledger import ACCEPTED
 from up_scholarship.providers import utilities as utl
 
 logger = logging.getLogger(__name__)
@@ -26,7 +26,7 @@ class RegisterSpider(BaseSpider):
 		skip_config.check_valid_year = False
 		super().__init__(RegisterSpider, skip_config, *args, **kwargs)
 
-	def start_requests(self):
+	def start_student_requests(self):
 		""" Get registration page if we have some students"""
 		if self.student:
 			url = self.url_provider.get_reg_url(self.student[FormKeys.caste()], self.student[FormKeys.std()], self.student[FormKeys.is_minority()] == "Y")
@@ -98,13 +98,17 @@ class RegisterSpider(BaseSpider):
 			)
 			yield request
 
-	def fill_reg(self, response):
+	async def fill_reg(self, response):
 		logger.info("In reg form. Last Url: %s", response.url)
 		if self.process_errors(response, [TestStrings.error], html=False):
 			url = self.url_provider.get_reg_url(self.student[FormKeys.caste()], self.student[FormKeys.std()], self.student[FormKeys.is_minority()] == "Y")
-			yield scrapy.Request(url=url, callback=self.get_institute, dont_filter=True)
+			return [scrapy.Request(url=url, callback=self.get_institute, dont_filter=True)]
 		else:
-			captcha_value = get_captcha_string(response.body)
+			captcha = await self.solve_captcha(response.body)
+			request = self.refetch_captcha(response, captcha)
+			if request:
+				return [request]
+			captcha_value = captcha.text
 
 			# Get old response after getting captcha
 			response = response.meta["old_response"]
@@ -115,10 +119,11 @@ class RegisterSpider(BaseSpider):
 				formdata=form_data,
 				callback=self.parse,
 				errback=self.errback_next,
-				dont_filter=True
+				dont_filter=True,
+				meta={"captcha": captcha}
 			)
 			request.meta["password"] = password
-			yield request
+			return [request]
 
 	def parse(self, response):
 		logger.info("In parse. Last URL: %s ", response.url)
@@ -129,6 +134,7 @@ class RegisterSpider(BaseSpider):
 			self.student[FormKeys.status()] = "Success"
 			self.student[FormKeys.reg_year()] = str(datetime.today().year)
 			self.students[self.current_student_index] = self.student
+			self.record_captcha(response, ACCEPTED)
 			logger.info("----------------Application got registered---------------")
 			logger.info("Reg no.: %s password: %s", reg_no, response.meta["password"])
 			utl.save_file_with_name(self.student, response, self.spider_name, str(datetime.today().year))
@@ -136,7 +142,7 @@ class RegisterSpider(BaseSpider):
 		else:
 			self.process_errors(response, [TestStrings.registration_form, TestStrings.error])
 		url = self.url_provider.get_reg_url(self.student[FormKeys.caste()], self.student[FormKeys.std()], self.student[FormKeys.is_minority()] == "Y")
-		yield scrapy.Request(url=url, callback=self.get_district, dont_filter=True, errback=self.errback_next)
+		yield self.captcha_retry_request() or scrapy.Request(url=url, callback=self.get_district, dont_filter=True, errback=self.errback_next)
 
 	def get_captcha(self, response):
 		print("In Captcha. Last URL: " + response.url)
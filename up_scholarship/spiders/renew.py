@@ -4,7 +4,7 @@ import logging
 
 from up_scholarship.providers.constants import FormKeys, TestStrings
 from up_scholarship.spiders.base import BaseSpider, SkipConfig
-from up_scholarship.tools.solve_captcha_using_model import get_captcha_string
+from up_scholarship.tools.captcha_ledger import ACCEPTED
 from up_scholarship.providers import utilities as utl
 
 logger = logging.getLogger(__name__)
@@ -22,18 +22,22 @@ class RenewSpider(BaseSpider):
 		skip_config.allow_renew = True
 		super().__init__(RenewSpider, skip_config, *args, **kwargs)
 
-	def start_requests(self):
+	def start_student_requests(self):
 		if self.student:
 			url = self.url_provider.get_renew_url(self.student[FormKeys.caste()], self.student[FormKeys.std()], self.student[FormKeys.is_minority()] == "Y")
 			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 
-	def fill_form(self, response):
+	async def fill_form(self, response):
 		logger.info("In fill form. Last URL: %s", response.url)
 		if self.process_errors(response, [TestStrings.error], html=False):
 			url = self.url_provider.get_renew_url(self.student[FormKeys.caste()], self.student[FormKeys.std()], self.student[FormKeys.is_minority()] == "Y")
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True)
+			return [scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True)]
 		else:
-			captcha_value = get_captcha_string(response.body)
+			captcha = await self.solve_captcha(response.body)
+			request = self.refetch_captcha(response, captcha)
+			if request:
+				return [request]
+			captcha_value = captcha.text
 
 			# Get old response after getting captcha
 			response = response.meta["old_response"]
@@ -50,9 +54,10 @@ class RenewSpider(BaseSpider):
 				formdata=form_data,
 				callback=self.parse,
 				errback=self.errback_next,
-				dont_filter=True
+				dont_filter=True,
+				meta={"captcha": captcha}
 			)
-			yield request
+			return [request]
 
 	def parse(self, response):
 		logger.info("In parse. Previous URL: %s", response.url)
@@ -60,6 +65,7 @@ class RenewSpider(BaseSpider):
 			new_reg_no = response.xpath(
 				"//*[@id='" + FormKeys.reg_no(form=True, reg=True) + "']/text()").extract_first()
 			vf_code = response.xpath("//*[@id='" + FormKeys.password(form=True, reg=True) + "']/text()").extract_first()
+			self.record_captcha(response, ACCEPTED)
 			logger.info("----------------Application got renewed---------------")
 			logger.info("New reg no.: %s vf_code: %s", new_reg_no, vf_code)
 			print("----------------Application got renewed---------------")
@@ -85,7 +91,7 @@ class RenewSpider(BaseSpider):
 		else:
 			self.process_errors(response, [TestStrings.renew_form, TestStrings.error, TestStrings.registration_new])
 		url = self.url_provider.get_renew_url(self.student[FormKeys.caste()], self.student[FormKeys.std()], self.student[FormKeys.is_minority()] == "Y")
-		yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+		yield self.captcha_retry_request() or scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 
 	def get_captcha(self, response):
 		logger.info("In Captcha. Last URL %s", response.url)
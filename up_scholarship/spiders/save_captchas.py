@@ -2,11 +2,15 @@ import urllib.parse as urlparse
 import scrapy
 from datetime import datetime
 import logging
+import hashlib
+import time
 
 from up_scholarship.providers.constants import FormKeys, TestStrings
-from up_scholarship.spiders.base import BaseSpider, SkipConfig
-from up_scholarship.tools.solve_captcha_using_model import get_captcha_string
+from up_scholarship.spiders.base import BaseSpider, SkipConfig, StudentSession
+from up_scholarship.tools.captcha_ledger import ACCEPTED
+from up_scholarship.providers.retry import CAPTCHA
 from up_scholarship.providers import utilities as utl
+from up_scholarship.tools.captcha_corpus import get_corpus_files, read_file
 import os
 
 logger = logging.getLogger(__name__)
@@ -14,27 +18,65 @@ MAX_CAPTCHAS_DOWNLOAD = 1000
 
 class SaveCatpchasSpider(BaseSpider):
 	"""	UP scholarship captcha downloader spider.
+		Harvests with several independent login sessions at once, each in its own cookie jar.
+		Every session logs in as the same test student, so sessions are never parked and are not throttled.
+		A session whose portal errors outlast captcha_harvest_retry_factor times their retry budget is ended.
 	"""
 	name = 'savecaptchas'
+	custom_settings = dict(
+		BaseSpider.custom_settings,
+		EXTENSIONS={"up_scholarship.providers.concurrency.AdaptiveConcurrency": None})
 
-	def __init__(self, *args, **kwargs):
-		""" Load student's file and init variables"""
+	def __init__(self, sessions=None, *args, **kwargs):
+		""" Load student's file and init variables
+			Keyword arguments:
+			sessions -- number of sessions harvesting in parallel, defaults to CommonData.captcha_harvest_sessions.
+		"""
 		skip_config = SkipConfig()
 		super().__init__(SaveCatpchasSpider, skip_config, auto_skip=False, *args, **kwargs)
-		self.student = {FormKeys.name(): "Test", FormKeys.reg_no(): "050138191000044",
+		student = {FormKeys.name(): "Test", FormKeys.reg_no(): "050138191000044",
 		FormKeys.password(): "Test@123", FormKeys.reg_year(): "2020", FormKeys.dob(): "05/05/2000",
 		FormKeys.std(): "9", FormKeys.mother_name(): "Test", FormKeys.father_name(): "Test"}
+		harvest_sessions = int(sessions) if sessions else self.cd.captcha_harvest_sessions
+		self.sessions = [StudentSession(i) for i in range(max(harvest_sessions, 1))]
+		for session in self.sessions:
+			session.student = student
+		self.session = self.sessions[0]
+		self.session_limit = len(self.sessions)
 		self.current_count = 0
-		self.current_captcha = None
-		self.current_captcha_value = None
+		self.duplicates = 0
+		self.started = time.monotonic()
+		# Hashes of every captcha in the corpus so the same image is never saved twice
+		self.saved_hashes = set()
+		for filename in get_corpus_files(self.cd.captchas_dir) + get_corpus_files(self.cd.captchas_dir, wrong=True):
+			self.saved_hashes.add(hashlib.sha1(read_file(filename)).hexdigest())
 
-	def start_requests(self):
-		""" Load student's file and get login page if we have some students"""
-		if self.student:
-			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ''), self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+	def start_student_requests(self):
+		""" Get login page for the harvest session"""
+		url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ''), self.is_renewal)
+		yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+
+	def retry_error(self, error_class: str, error_str: str, url: str) -> bool:
+		""" Back off before the harvest session's next request, the test student is never parked.
+			Wrong captchas are what we harvest so only other errors count against the session's budget.
+			Keyword arguments:
+			error_class -- class of the error from providers/retry.py.
+			error_str -- description of the error.
+			url -- url the error happened on.
+			Returns: True, the session is ended instead once its budget is spent
+		"""
+		if error_class == CAPTCHA:
+			return True
+		retries = self.session.retries.get(error_class, 0)
+		budget = max(self.retry_policy.budgets.get(error_class, 0), 1) * self.cd.captcha_harvest_retry_factor
+		if retries >= budget:
+			logger.warning("Harvest session %d ended after %d %s errors. Last: %s", self.session.id, retries, error_class, error_str)
+			self.end_session()
+		self.session.retries[error_class] = retries + 1
+		self.session.backoff_delay = self.retry_policy.get_delay(error_class, retries)
+		return True
 
-	def login_form(self, response):
+	async def login_form(self, response):
 		""" Login the form after getting captcha from previous response.
 			Keyword arguments:
 			response -- previous scrapy response.
@@ -42,13 +84,12 @@ class SaveCatpchasSpider(BaseSpider):
 		logger.info('In login form. Last URL: %s', response.url)
 		if self.process_errors(response, [TestStrings.error], html=False):
 			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ''), self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+			return [scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)]
 		else:
 			# Get captcha text from our ml model
-			captcha_value = get_captcha_string(response.body)
-
-			self.current_captcha = response.body
-			self.current_captcha_value = captcha_value
+			captcha = await self.solve_captcha(response.body)
+			captcha_value = captcha.text
+			captcha_image = response.body
 
 			# Get old response after getting captcha
 			response = response.meta['old_response']
@@ -68,9 +109,10 @@ class SaveCatpchasSpider(BaseSpider):
 				formdata=form_data,
 				callback=self.parse,
 				errback=self.errback_next,
-				dont_filter=True
+				dont_filter=True,
+				meta={"captcha": captcha, "captcha_image": captcha_image}
 			)
-			yield request
+			return [request]
 
 
 	def parse(self, response):
@@ -79,18 +121,41 @@ class SaveCatpchasSpider(BaseSpider):
 			response -- previous scrapy response.
 		"""
 		logger.info('In Parse. Last URL: %s', response.url)
+		captcha = response.meta["captcha"]
+		captcha_image = response.meta["captcha_image"]
+		filename = None
 		if response.url.lower().find("popup") != -1:
-			filename = "up_scholarship/out/catpchas/" + self.current_captcha_value + ".jpg"
-		else:
-			filename = "up_scholarship/out/catpchas/wrong/" + self.current_captcha_value + ".jpg"
-			self.process_errors(response, [TestStrings.app_fill_form, TestStrings.error])
-		os.makedirs(os.path.dirname(filename), exist_ok=True)
-		with open(filename, 'wb') as f:
-			f.write(self.current_captcha)
-		logger.info("----------------Captcha saved---------------")
-		self.current_count+=1
+			self.record_captcha(response, ACCEPTED)
+			self.session.retries = {}
+			filename = self.cd.captchas_dir + captcha.text
+		# It records the captcha as rejected in the ledger only if the portal said it was wrong
+		elif self.process_errors(response, [TestStrings.app_fill_form, TestStrings.error]) and self.session.captcha_wrong:
+			filename = self.cd.captchas_dir + "wrong/" + captcha.text
 		if self.current_count >= MAX_CAPTCHAS_DOWNLOAD:
 			return
+		image_hash = hashlib.sha1(captcha_image).hexdigest()
+		if filename is None:
+			logger.info("Portal didn't tell if captcha was right, not saving it.")
+		elif not captcha.text:
+			logger.info("Captcha could not be read, not saving it.")
+		elif image_hash in self.saved_hashes:
+			self.duplicates += 1
+			logger.info("Captcha already saved, skipping it.")
+		else:
+			self.saved_hashes.add(image_hash)
+			# Different images can be read as the same text, keep both
+			if os.path.exists(filename + ".jpg"):
+				filename += "_" + image_hash[:8]
+			filename += ".jpg"
+			os.makedirs(os.path.dirname(filename), exist_ok=True)
+			with open(filename, 'wb') as f:
+				f.write(captcha_image)
+			logger.info("----------------Captcha saved---------------")
+			self.current_count += 1
+			if self.current_count % 50 == 0:
+				logger.info("Harvest stats: %s", self.harvest_stats())
+			if self.current_count >= MAX_CAPTCHAS_DOWNLOAD:
+				return
 		url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ''), self.is_renewal)
 		yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 
@@ -105,4 +170,19 @@ class SaveCatpchasSpider(BaseSpider):
 			callback = self.login_form
 			request = scrapy.Request(url=captcha_url, callback=callback, dont_filter=True, errback=self.errback_next)
 			request.meta['old_response'] = response
-			yield request
\ No newline at end of file
+			yield request
+
+	def harvest_stats(self) -> dict:
+		elapsed = time.monotonic() - self.started
+		return {
+			"sessions": len(self.sessions),
+			"harvested": self.current_count,
+			"duplicates": self.duplicates,
+			"elapsed": elapsed,
+			"harvested_per_sec": self.current_count / elapsed if elapsed else 0.0,
+		}
+
+	def closed(self, reason):
+		super().closed(reason)
+		logger.info("Harvest stats: %s", self.harvest_stats())
+		print("Harvest stats:", self.harvest_stats())
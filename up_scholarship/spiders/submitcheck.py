@@ -5,12 +5,86 @@ from datetime import datetime
 
 from up_scholarship.providers.constants import FormKeys, TestStrings
 from up_scholarship.spiders.base import BaseSpider, SkipConfig
-from up_scholarship.tools.solve_captcha_using_model import get_captcha_string
 from up_scholarship.providers import utilities as utl
 
 logger = logging.getLogger(__name__)
 
-class SubmitDataspider(BaseSpider):
+class SubmitCheckMixin:
+	""" Submit for check steps shared by the spiders submitting the student's application for checking.
+		The check print and photo are saved before the application is locked, then stage_done continues.
+	"""
+	check_print_folder = "submitcheck"	# Folder the check print and photo are saved in.
+
+	def check_print_request(self, response):
+		""" Return request for the check print from the student's default page.
+			Keyword arguments:
+			response -- default page response, the lock is submitted from it.
+			Returns: Request
+		"""
+		parsed = urlparse.urlparse(response.url)
+		app_id = urlparse.parse_qs(parsed.query)["Appid"][0]
+		url = self.url_provider.get_temp_print_url(self.student.get(FormKeys.std(), ""), app_id, self.is_renewal)
+		request = scrapy.Request(url=url, callback=self.save_check_print, dont_filter=True, errback=self.errback_next)
+		request.meta["old_response"] = response
+		return request
+
+	def save_check_print(self, response):
+		logger.info("In save check print. Last URL: %s", response.url)
+		if self.process_errors(response, [TestStrings.error]):
+			yield self.login_request()
+		else:
+			logger.info("Saving student\"s check page")
+			utl.save_file_with_name(self.student, response, self.check_print_folder, str(datetime.today().year),
+									extra="/checkprint")
+
+			img_url = response.xpath("//*[@id='PhotoImg']/@src").extract_first()
+			parsed = urlparse.urlparse(img_url)
+			app_id = urlparse.parse_qs(parsed.query)["App_Id"][0]
+
+			url = self.url_provider.get_img_print_url(self.student.get(FormKeys.std(), ""), app_id, self.is_renewal)
+			request = scrapy.Request(url=url, callback=self.save_check_img, dont_filter=True, errback=self.errback_next)
+			request.meta["old_response"] = response.meta["old_response"]
+			yield request
+
+	def save_check_img(self, response):
+		logger.info("In save check img. Last URL: %s", response.url)
+		if self.process_errors(response, [TestStrings.error], html=False):
+			yield self.login_request()
+		else:
+			f = urlparse.urlparse(response.url).path.split("/")[-1]
+			logger.info("Saving student\"s image")
+			utl.save_file_with_name(self.student, response, self.check_print_folder, str(datetime.today().year),
+									extension="", extra="/" + f)
+			formdata = {
+				FormKeys.event_target(): FormKeys.temp_submit_lock(self.cd.current_form_set, form=True)
+			}
+			logger.info(formdata)
+			request = scrapy.FormRequest.from_response(
+				response.meta["old_response"],
+				formdata=formdata,
+				callback=self.submitted_for_check,
+				errback=self.errback_next,
+				dont_filter=True,
+			)
+			yield request
+
+	def submitted_for_check(self, response):
+		logger.info("In submitted for check. Last URL: %s", response.url)
+		locked_request = response.xpath(
+			"//*[@id='" + FormKeys.temp_submit_lock(self.cd.current_form_set) + "']").extract_first()
+		if response.url.lower().find(TestStrings.app_default) != -1 and locked_request is None:
+			self.student[FormKeys.submitted_for_check()] = "Y"
+			self.student[FormKeys.status()] = "Success"
+			self.students[self.current_student_index] = self.student
+			logger.info("----------------Application got submitted for checking---------------")
+			# Locking lands back on the default page
+			yield from self.stage_done(response)
+		else:
+			self.process_errors(response, [TestStrings.app_default, TestStrings.error])
+			yield self.login_request()
+
+
+class SubmitDataspider(SubmitCheckMixin, BaseSpider):
 	name = "submitcheck"
 	common_required_keys = [
 		FormKeys.skip(), FormKeys.std(), FormKeys.reg_no(), FormKeys.dob(), FormKeys.name(), FormKeys.app_filled(),
@@ -25,18 +99,22 @@ class SubmitDataspider(BaseSpider):
 		skip_config.satisfy_criterias = [FormKeys.aadhaar_authenticated(), FormKeys.aadhaar_otp_authenticated()]
 		super().__init__(SubmitDataspider, skip_config, *args, **kwargs)
 
-	def start_requests(self):
+	def start_student_requests(self):
 		if self.student:
 			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ""), self.is_renewal)
 			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 
-	def login_form(self, response):
+	async def login_form(self, response):
 		logger.info("In login form. Last Url: %s", response.url)
 		if self.process_errors(response, [TestStrings.error], html=False):
 			url = self.url_provider.get_login_reg_url(self.student[FormKeys.std()], self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+			return [scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)]
 		else:
-			captcha_value = get_captcha_string(response.body)
+			captcha = await self.solve_captcha(response.body)
+			request = self.refetch_captcha(response, captcha)
+			if request:
+				return [request]
+			captcha_value = captcha.text
 
 			# Get old response after getting captcha
 			response = response.meta["old_response"]
@@ -50,9 +128,10 @@ class SubmitDataspider(BaseSpider):
 				formdata=form_data,
 				callback=self.accept_popup,
 				errback=self.errback_next,
-				dont_filter=True
+				dont_filter=True,
+				meta={"captcha": captcha}
 			)
-			yield request
+			return [request]
 
 	def accept_popup(self, response):
 		""" If we get popup about accepting terms accept them and if not continue filling other things.
@@ -62,18 +141,11 @@ class SubmitDataspider(BaseSpider):
 		logger.info("In accept popup. Last URL: %s", response.url)
 		if self.process_errors(response, [TestStrings.error, TestStrings.login]):
 			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ""), self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+			yield self.captcha_retry_request() or scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 		# Got default response, means popup has been accepted.
 		elif response.url.lower().find(TestStrings.app_default) != -1:
 			logger.info("Got default response url %s", response.url)
-			# Extract appid for url
-			parsed = urlparse.urlparse(response.url)
-			app_id = urlparse.parse_qs(parsed.query)["Appid"][0]
-
-			url = self.url_provider.get_temp_print_url(self.student.get(FormKeys.std(), ""), app_id, self.is_renewal)
-			request = scrapy.Request(url=url, callback=self.save_print, dont_filter=True, errback=self.errback_next)
-			request.meta["old_response"] = response
-			yield request
+			yield self.check_print_request(response)
 		# Popup might not have been accepted, accept it
 		else:
 			logger.info("Accepting popup. Last URL: %s", response.url)
@@ -89,69 +161,6 @@ class SubmitDataspider(BaseSpider):
 			)
 			yield request
 
-	def save_print(self, response):
-		logger.info("In save print. Last URL: %s", response.url)
-		if self.process_errors(response, [TestStrings.error]):
-			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ""), self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
-		else:
-			logger.info("Saving student\"s check page")
-
-			utl.save_file_with_name(self.student, response, self.spider_name, str(datetime.today().year),
-									extra="/checkprint")
-
-			img_url = response.xpath("//*[@id='PhotoImg']/@src").extract_first()
-			parsed = urlparse.urlparse(img_url)
-			app_id = urlparse.parse_qs(parsed.query)["App_Id"][0]
-
-			url = self.url_provider.get_img_print_url(self.student.get(FormKeys.std(), ""), app_id, self.is_renewal)
-			request = scrapy.Request(url=url, callback=self.save_img, dont_filter=True, errback=self.errback_next)
-			request.meta["old_response"] = response.meta["old_response"]
-			yield request
-
-	def save_img(self, response):
-		logger.info("In save img. Last URL: %s", response.url)
-		if self.process_errors(response, [TestStrings.error], html=False):
-			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ""), self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
-		else:
-			parsed = urlparse.urlparse(response.url)
-			f = parsed.path.split("/")
-			f = f[len(f) - 1]
-
-			logger.info("Saving student\"s image")
-			utl.save_file_with_name(self.student, response,self.spider_name, str(datetime.today().year), extension="",
-									extra="/" + f)
-			formdata={
-					FormKeys.event_target(): FormKeys.temp_submit_lock(self.cd.current_form_set, form=True)
-				}
-			logger.info(formdata)
-			response = response.meta["old_response"]
-			request = scrapy.FormRequest.from_response(
-				response,
-				formdata=formdata,
-				callback=self.parse,
-				errback=self.errback_next,
-				dont_filter=True,
-			)
-			yield request
-
-	def parse(self, response):
-		logger.info("In parse. Last URL: %s", response.url)
-		locked_request = response.xpath(
-			"//*[@id='" + FormKeys.temp_submit_lock(self.cd.current_form_set) + "']").extract_first()
-		if response.url.lower().find(TestStrings.app_default) != -1 and locked_request is None:
-			self.student[FormKeys.submitted_for_check()] = "Y"
-			self.student[FormKeys.status()] = "Success"
-			self.students[self.current_student_index] = self.student
-			logger.info("----------------Application got submitted for checking---------------")
-			print("----------------Application got submitted for checking---------------")
-			self.skip_to_next_valid()
-		else:
-			self.process_errors(response, [TestStrings.app_default, TestStrings.error])
-		url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ""), self.is_renewal)
-		yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
-
 	def get_captcha(self, response):
 		print("In Captcha. Last URL: " + response.url)
 		if self.process_errors(response, [TestStrings.error]):
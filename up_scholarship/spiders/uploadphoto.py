@@ -9,13 +9,75 @@ from scrapy.http import Request
 import logging
 
 from up_scholarship.providers.constants import FormKeys, TestStrings, StdCategory
-from up_scholarship.tools.solve_captcha_using_model import get_captcha_string
 from up_scholarship.spiders.base import BaseSpider, SkipConfig
 from up_scholarship.providers import utilities as utl
 
 logger = logging.getLogger(__name__)
 
-class UploadPhotoSpider(BaseSpider):
+class PhotoUploadMixin:
+	""" Photo upload steps shared by the spiders uploading the student's photo."""
+
+	def get_photo_file(self, student: dict) -> str:
+		""" Return path of the photo file of the student.
+			Keyword arguments:
+			student -- student whose photo is uploaded.
+			Returns: str
+		"""
+		return utl.get_photo_by_uid_name(self.cd.data_dir, student, "jpg ", student[FormKeys.reg_year()], FormKeys())
+
+	def get_upload_request(self, response, filename: str, callback=None):
+		""" Create the multipart request uploading the student's photo from the photo upload page.
+			Keyword arguments:
+			response -- photo upload page response.
+			filename -- photo file of the student.
+			callback -- callback for the upload response, defaults to parse.
+			Returns: Request
+		"""
+		headers = response.request.headers
+
+		parsed = urlparse.urlparse(response.url)
+		app_id = urlparse.parse_qs(parsed.query)["Appid"][0]
+		url = self.url_provider.get_photo_up_url(self.student.get(FormKeys.std(), ""), app_id, self.is_renewal)
+
+		viewstate = response.xpath("//*[@id='" + FormKeys.view_state() + "']/@value").extract_first()
+		viewstategenerater = response.xpath \
+			("//*[@id='" + FormKeys.view_state_generator() + "']/@value").extract_first()
+		eventvalidation = response.xpath("//*[@id='" + FormKeys.event_validation() + "']/@value").extract_first()
+
+		pre = utl.get_std_category(self.student[FormKeys.std()]) == StdCategory.pre
+
+		fields = [(FormKeys.view_state(), viewstate),
+				(FormKeys.view_state_generator(), viewstategenerater),
+				(FormKeys.view_state_encrypted(), ""),
+				(FormKeys.event_validation(), eventvalidation),
+				(FormKeys.upload_photo(self.cd.current_form_set, form=True),
+					"Upload Photo")]
+		if not pre:
+			fields.append((FormKeys.is_pic_upload(), "Y"))
+			fields.append((FormKeys.is_handi_upload(), ""))
+			fields.append((FormKeys.handi_type(), "0"))
+
+		files = [(FormKeys.upload_photo_name(form=True), self.student[FormKeys.aadhaar_no()] + ".jpg", open(filename, "rb"))]
+		logger.info("Photo file %s", files)
+		logger.info("Photo fields %s", fields)
+		content_type, body = utl.MultipartFormDataEncoder().encode(fields, files)
+		headers["Content-Type"] = content_type
+		headers["Content-length"] = str(len(body))
+
+		return Request(url=url, method="POST", headers=headers, body=body, dont_filter=True, callback=callback)
+
+	def is_photo_uploaded(self, response) -> bool:
+		""" Check the alert of the upload response for the success message."""
+		upload_status = ""
+		scripts = response.xpath("//script/text()").extract()
+		for script in scripts:
+			if len(script) > 10 and script.lower().find(TestStrings.alert) != -1:
+				upload_status = script[7:-1]
+				break
+		return upload_status.lower().find(TestStrings.photo_uploaded) != -1
+
+
+class UploadPhotoSpider(PhotoUploadMixin, BaseSpider):
 	name = "uploadphoto"
 	common_required_keys = [
 		FormKeys.skip(), FormKeys.std(), FormKeys.reg_no(), FormKeys.dob(), FormKeys.name(), FormKeys.app_filled(),
@@ -29,18 +91,22 @@ class UploadPhotoSpider(BaseSpider):
 		skip_config.satisfy_criterias = [FormKeys.app_filled()]
 		super().__init__(UploadPhotoSpider, skip_config, *args, **kwargs)
 
-	def start_requests(self):
+	def start_student_requests(self):
 		if self.student:
 			url = self.url_provider.get_login_reg_url(self.student[FormKeys.std()], self.is_renewal)
 			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 
-	def login_form(self, response):
+	async def login_form(self, response):
 		logger.info("In login form. Last Url: %s", response.url)
 		if self.process_errors(response, [TestStrings.error], html=False):
 			url = self.url_provider.get_login_reg_url(self.student[FormKeys.std()], self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+			return [scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)]
 		else:
-			captcha_value = get_captcha_string(response.body)
+			captcha = await self.solve_captcha(response.body)
+			request = self.refetch_captcha(response, captcha)
+			if request:
+				return [request]
+			captcha_value = captcha.text
 
 			# Get old response after getting captcha
 			response = response.meta["old_response"]
@@ -54,9 +120,10 @@ class UploadPhotoSpider(BaseSpider):
 				formdata=form_data,
 				callback=self.accept_popup,
 				errback=self.errback_next,
-				dont_filter=True
+				dont_filter=True,
+				meta={"captcha": captcha}
 			)
-			yield request
+			return [request]
 
 	def accept_popup(self, response):
 		""" If we get popup about accepting terms accept them and if not continue filling other things.
@@ -66,7 +133,7 @@ class UploadPhotoSpider(BaseSpider):
 		logger.info("In accept popup. Last URL: %s", response.url)
 		if self.process_errors(response, [TestStrings.error, TestStrings.login]):
 			url = self.url_provider.get_login_reg_url(self.student.get(FormKeys.std(), ""), self.is_renewal)
-			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
+			yield self.captcha_retry_request() or scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 		# Got default response, means popup has been accepted.
 		elif response.url.lower().find(TestStrings.app_default) != -1:
 			logger.info("Got default response url %s", response.url)
@@ -98,41 +165,9 @@ class UploadPhotoSpider(BaseSpider):
 			url = self.url_provider.get_login_reg_url(self.student[FormKeys.std()], self.is_renewal)
 			yield scrapy.Request(url=url, callback=self.get_captcha, dont_filter=True, errback=self.errback_next)
 		else:
-			headers = response.request.headers
-
-			parsed = urlparse.urlparse(response.url)
-			app_id = urlparse.parse_qs(parsed.query)["Appid"][0]
-			url = self.url_provider.get_photo_up_url(self.student.get(FormKeys.std(), ""), app_id, self.is_renewal)
-
-			viewstate = response.xpath("//*[@id='" + FormKeys.view_state() + "']/@value").extract_first()
-			viewstategenerater = response.xpath \
-				("//*[@id='" + FormKeys.view_state_generator() + "']/@value").extract_first()
-			eventvalidation = response.xpath("//*[@id='" + FormKeys.event_validation() + "']/@value").extract_first()
-
-			filename = utl.get_photo_by_uid_name(self.cd.data_dir, self.student, "jpg ", self.student[FormKeys.reg_year()], FormKeys())
+			filename = self.get_photo_file(self.student)
 			if utl.check_if_file_exists(filename):
-				pre = utl.get_std_category(self.student[FormKeys.std()]) == StdCategory.pre
-
-				fields = [(FormKeys.view_state(), viewstate),
-						(FormKeys.view_state_generator(), viewstategenerater),
-						(FormKeys.view_state_encrypted(), ""),
-						(FormKeys.event_validation(), eventvalidation),
-						(FormKeys.upload_photo(self.cd.current_form_set, form=True),
-							"Upload Photo")]
-				if not pre:
-					fields.append((FormKeys.is_pic_upload(), "Y"))
-					fields.append((FormKeys.is_handi_upload(), ""))
-					fields.append((FormKeys.handi_type(), "0"))
-
-				files = [(FormKeys.upload_photo_name(form=True), self.student[FormKeys.aadhaar_no()] + ".jpg", open(filename, "rb"))]
-				logger.info("Photo file %s", files)
-				logger.info("Photo fields %s", fields)
-				content_type, body = utl.MultipartFormDataEncoder().encode(fields, files)
-				headers["Content-Type"] = content_type
-				headers["Content-length"] = str(len(body))
-
-				request_with_cookies = Request(url=url, method="POST", headers=headers, body=body, dont_filter=True)
-				yield request_with_cookies
+				yield self.get_upload_request(response, filename)
 			else:
 				self.student[FormKeys.status()] = "Photo file not found"
 				self.students[self.current_student_index] = self.student
@@ -142,13 +177,7 @@ class UploadPhotoSpider(BaseSpider):
 
 	def parse(self, response):
 		logger.info("Parse Got URL: %s", response.url)
-		upload_status = ""
-		scripts = response.xpath("//script/text()").extract()
-		for script in scripts:
-			if len(script) > 10 and script.lower().find(TestStrings.alert) != -1:
-				upload_status = script[7:-1]
-				break
-		if upload_status.lower().find(TestStrings.photo_uploaded) != -1:
+		if self.is_photo_uploaded(response):
 			self.student[FormKeys.photo_uploaded()] = "Y"
 			self.student[FormKeys.status()] = "Success"
 			self.students[self.current_student_index] = self.student
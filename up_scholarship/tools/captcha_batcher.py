@@ -0,0 +1,97 @@
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+from up_scholarship.providers.constants import CommonData
+
+
+class MicroBatcher:
+	""" Classify the letters of captchas solved on different threads in one model call.
+		The first captcha of a batch waits up to window seconds for others, so a longer window gives bigger
+		batches and more throughput at the cost of latency.
+	"""
+	def __init__(
+			self,
+			predict,
+			window: float = CommonData.captcha_batch_window,
+			max_batch: int = CommonData.captcha_max_batch):
+		self.predict_batch = predict
+		self.window = window
+		self.max_batch = max(max_batch, 1)
+		self.queue = queue.Queue()
+		self.batch_sizes = collections.Counter()	# Number of batches of every size in captchas.
+		self.wait_time = 0.0	# Total seconds captchas spent waiting for their batch to start.
+		self._lock = threading.Lock()
+		self._thread = None
+
+	def start(self):
+		if self._thread:
+			return
+		with self._lock:
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, name="captcha-batcher", daemon=True)
+				self._thread.start()
+
+	def predict(self, letter_images):
+		""" Queue letter images of one captcha and wait for the batch they end up in.
+			Keyword arguments:
+			letter_images -- letter images of shape (n, 20, 20, 1).
+			Returns: tuple of letters list and probability of each letter
+		"""
+		self.start()
+		future = Future()
+		self.queue.put((letter_images, future, time.perf_counter()))
+		return future.result()
+
+	def stats(self) -> dict:
+		""" Return the window, batch sizes achieved and average wait."""
+		with self._lock:
+			batches = sum(self.batch_sizes.values())
+			captchas = sum(size * count for size, count in self.batch_sizes.items())
+			return {
+				"window": self.window,
+				"max_batch": self.max_batch,
+				"batches": batches,
+				"captchas": captchas,
+				"avg_batch_size": captchas / batches if batches else 0.0,
+				"batch_sizes": dict(sorted(self.batch_sizes.items())),
+				"avg_wait_time": self.wait_time / captchas if captchas else 0.0,
+			}
+
+	def _next_batch(self) -> list:
+		""" Wait for a captcha and collect the ones queued within the window after it."""
+		batch = [self.queue.get()]
+		deadline = time.perf_counter() + self.window
+		while len(batch) < self.max_batch:
+			timeout = deadline - time.perf_counter()
+			if timeout <= 0:
+				break
+			try:
+				batch.append(self.queue.get(timeout=timeout))
+			except queue.Empty:
+				break
+		return batch
+
+	def _run(self):
+		while True:
+			batch = self._next_batch()
+			start = time.perf_counter()
+			try:
+				letters, probabilities = self.predict_batch(
+					np.concatenate([letter_images for letter_images, _, _ in batch]))
+			except Exception as err:
+				for _, future, _ in batch:
+					future.set_exception(err)
+				continue
+			# Hand every captcha back its own slice of the predictions
+			offset = 0
+			for letter_images, future, _ in batch:
+				end = offset + len(letter_images)
+				future.set_result((letters[offset:end], probabilities[offset:end]))
+				offset = end
+			with self._lock:
+				self.batch_sizes[len(batch)] += 1
+				self.wait_time += sum(start - queued for _, _, queued in batch)
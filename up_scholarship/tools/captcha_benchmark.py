@@ -0,0 +1,422 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+import numpy as np
+from cv2 import cv2
+
+from up_scholarship.providers.constants import CommonData
+from up_scholarship.tools.captcha_corpus import get_corpus_files, read_file, get_label
+from up_scholarship.tools.solve_captcha_using_model import decode_image, preprocess, find_letter_regions, \
+	extract_letter_images, get_solver, CaptchaSolver, PROFILES, \
+	SEGMENTERS, RECOGNIZERS
+from up_scholarship.tools.captcha_runtime import RUNTIMES, INT8_GATE_FILENAME, int8_gate_passed, KerasRuntime, \
+	TFLiteInt8Runtime
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_decode_image(captcha_image_file):
+	""" Decode the image the way solver used to, copying the bytes into a bytearray first."""
+	image = np.asarray(bytearray(captcha_image_file), dtype="uint8")
+	return cv2.imdecode(image, cv2.IMREAD_GRAYSCALE)
+
+
+def legacy_preprocess(image):
+	""" Pixel by pixel preprocessing the solver used before it was vectorized.
+		Kept only to check the vectorized version against it.
+	"""
+	image = cv2.resize(image, None, fx=3.3, fy=3.3, interpolation=cv2.INTER_CUBIC)
+	image = cv2.fastNlMeansDenoising(src=image, h=40)
+	height, width = image.shape
+	for y in range(width):
+		for x in range(height):
+			if image[x, y] < 90:
+				image[x, y] = 0
+	for y in range(width):
+		for x in range(height):
+			if image[x, y] < 120:
+				image[x, y] = 0
+	for y in range(width):
+		for x in range(height):
+			if image[x, y] > 0:
+				image[x, y] = 255
+	thresh = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+	return image, thresh
+
+
+def _time_it(func, repeat=1):
+	""" Return the result of last call and the best time out of repeat calls of func."""
+	best = None
+	result = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = func()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return result, best
+
+
+def benchmark_preprocess(files: list, repeat=3) -> dict:
+	""" Compare the legacy and vectorized preprocessing over the given captcha files.
+		Keyword arguments:
+		files -- captcha image files.
+		repeat -- number of times each stage is run, the best time is taken.
+		Returns: dict with total seconds for each version and whether outputs matched
+	"""
+	legacy_time = 0.0
+	vectorized_time = 0.0
+	mismatched = []
+	for filename in files:
+		data = read_file(filename)
+		(legacy_image, legacy_thresh), elapsed = _time_it(
+			lambda: legacy_preprocess(legacy_decode_image(data)), repeat=repeat)
+		legacy_time += elapsed
+		(image, thresh), elapsed = _time_it(lambda: preprocess(decode_image(data)), repeat=repeat)
+		vectorized_time += elapsed
+		if not (np.array_equal(legacy_image, image) and np.array_equal(legacy_thresh, thresh)):
+			mismatched.append(filename)
+	return {
+		"images": len(files),
+		"legacy_time": legacy_time,
+		"vectorized_time": vectorized_time,
+		"speedup": legacy_time / vectorized_time if vectorized_time else 0.0,
+		"bit_identical": not mismatched,
+		"mismatched": mismatched,
+	}
+
+
+def legacy_predict(solver, letter_images) -> list:
+	""" Classify letters one model.predict call at a time the way solver used to."""
+	letters = []
+	for letter_image in letter_images:
+		prediction = solver.runtime.model.predict(np.expand_dims(letter_image, axis=0))
+		letters.append(solver.lb.inverse_transform(prediction)[0])
+	return letters
+
+
+def benchmark_inference(files: list, repeat=3) -> dict:
+	""" Compare per letter and batched letter classification over the given captcha files.
+		Only captchas which segment into 5 letters are used.
+		Keyword arguments:
+		files -- captcha image files.
+		repeat -- number of times each stage is run, the best time is taken.
+		Returns: dict with total seconds for each version and whether predictions matched
+	"""
+	solver = get_solver("keras")
+	solver.load()
+	per_letter_time = 0.0
+	batched_time = 0.0
+	captchas = 0
+	mismatched = []
+	for filename in files:
+		image, thresh = preprocess(decode_image(read_file(filename)))
+		letter_image_regions = find_letter_regions(thresh)
+		if len(letter_image_regions) != 5:
+			continue
+		letter_images = extract_letter_images(image, letter_image_regions)
+		# Warm up so graph tracing is not counted against whichever runs first
+		if captchas == 0:
+			legacy_predict(solver, letter_images)
+			solver.predict(letter_images)
+		captchas += 1
+		per_letter, elapsed = _time_it(lambda: legacy_predict(solver, letter_images), repeat=repeat)
+		per_letter_time += elapsed
+		(batched, _), elapsed = _time_it(lambda: solver.predict(letter_images), repeat=repeat)
+		batched_time += elapsed
+		if per_letter != batched:
+			mismatched.append(filename)
+	return {
+		"captchas": captchas,
+		"per_letter_time": per_letter_time,
+		"batched_time": batched_time,
+		"per_letter_avg_time": per_letter_time / captchas if captchas else 0.0,
+		"batched_avg_time": batched_time / captchas if captchas else 0.0,
+		"speedup": per_letter_time / batched_time if batched_time else 0.0,
+		"mismatched": mismatched,
+	}
+
+
+STARTUP_SCRIPT = """
+import json
+import time
+start = time.perf_counter()
+from up_scholarship.tools.solve_captcha_using_model import CaptchaSolver
+CaptchaSolver(%r).load()
+startup_time = time.perf_counter() - start
+try:
+	import resource
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+except ImportError:
+	peak_rss = None
+print(json.dumps({"startup_time": startup_time, "peak_rss": peak_rss}))
+"""
+
+
+def measure_startup(runtime: str) -> dict:
+	""" Load the model with the runtime in a fresh interpreter.
+		Returns: dict of seconds taken to import the solver and load the model, and the peak resident memory
+			(KB on linux) of the process or None where it can't be measured.
+	"""
+	output = subprocess.run(
+		[sys.executable, "-c", STARTUP_SCRIPT % runtime], check=True, capture_output=True, text=True).stdout
+	return json.loads(output.strip().splitlines()[-1])
+
+
+def _model_size(model_filename: str) -> int:
+	""" Return bytes used on disk by a model file or saved model directory."""
+	if os.path.isfile(model_filename):
+		return os.path.getsize(model_filename)
+	return sum(
+		os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(model_filename) for name in names)
+
+
+def benchmark_runtimes(files: list) -> dict:
+	""" Compare start up and per solve latency of every inference runtime.
+		Predictions are compared against the keras runtime, which is the first one.
+		Keyword arguments:
+		files -- captcha image files.
+	"""
+	results = {}
+	reference = None
+	for runtime in RUNTIMES:
+		try:
+			startup = measure_startup(runtime)
+			solver = CaptchaSolver(runtime)
+			solver.load()
+		except (subprocess.CalledProcessError, FileNotFoundError, ImportError) as err:
+			logger.warning("Skipping %s runtime: %s", runtime, err)
+			results[runtime] = {"error": str(err)}
+			continue
+		texts = []
+		solve_times = []
+		for filename in files:
+			data = read_file(filename)
+			start = time.perf_counter()
+			texts.append(solver.solve(data))
+			solve_times.append(time.perf_counter() - start)
+		if reference is None:
+			reference = texts
+		results[runtime] = {
+			"startup_time": startup["startup_time"],
+			"peak_rss": startup["peak_rss"],
+			"model_size": _model_size(solver.runtime.model_filename),
+			"solve": _summary(solve_times),
+			"same_as_keras": sum(a == b for a, b in zip(texts, reference)) / len(files),
+		}
+	return results
+
+
+def _summary(values: list) -> dict:
+	""" Return total, mean and percentiles of the values."""
+	if not values:
+		return {"total": 0.0, "mean": 0.0, "p50": 0.0, "p95": 0.0}
+	values = np.asarray(values)
+	return {
+		"total": float(values.sum()),
+		"mean": float(values.mean()),
+		"p50": float(np.percentile(values, 50)),
+		"p95": float(np.percentile(values, 95)),
+	}
+
+
+def evaluate_solver(solver, accepted_files: list, rejected_files: list, profile: str = None) -> dict:
+	""" Replay the corpus through the solver and measure latency and accuracy.
+		Accepted captchas are named by their correct text. Rejected captchas are named by a wrong guess,
+		so they only tell whether the solver still makes the same mistake.
+		Keyword arguments:
+		solver -- loaded captcha solver.
+		accepted_files -- captchas the portal accepted.
+		rejected_files -- captchas the portal rejected.
+		profile -- preprocessing profile, defaults to the solver profile.
+		Returns: dict of stage latencies, throughput, segmentation failures and accuracy
+	"""
+	stages = {"decode": [], "denoise": [], "threshold": [], "segment": [], "predict": []}
+	totals = []
+	segmentation_failures = 0
+	correct = 0
+	letters_correct = 0
+	letters_total = 0
+	repeated_wrong = 0
+	for i, filename in enumerate(accepted_files + rejected_files):
+		data = read_file(filename)
+		start = time.perf_counter()
+		result = solver.solve_result(data, profile)
+		totals.append(time.perf_counter() - start)
+		text = result.text
+		for stage, elapsed in result.timings.items():
+			stages.setdefault(stage, []).append(elapsed)
+		label = get_label(filename)
+		if not text:
+			segmentation_failures += 1
+		if i < len(accepted_files):
+			correct += text == label
+			letters_total += len(label)
+			letters_correct += sum(a == b for a, b in zip(text, label))
+		else:
+			repeated_wrong += text == label
+	images = len(totals)
+	return {
+		"images": images,
+		"stages": {stage: _summary(values) for stage, values in stages.items()},
+		"solve": _summary(totals),
+		"throughput": images / sum(totals) if totals else 0.0,
+		"segmentation_failures": segmentation_failures,
+		"segmentation_failure_rate": segmentation_failures / images if images else 0.0,
+		"accepted": len(accepted_files),
+		"whole_string_accuracy": correct / len(accepted_files) if accepted_files else 0.0,
+		"per_letter_accuracy": letters_correct / letters_total if letters_total else 0.0,
+		"rejected": len(rejected_files),
+		"repeated_wrong_rate": repeated_wrong / len(rejected_files) if rejected_files else 0.0,
+	}
+
+
+def benchmark_profiles(solver, accepted_files: list, rejected_files: list) -> dict:
+	""" Compare latency against accuracy of every preprocessing profile.
+		Keyword arguments:
+		solver -- loaded captcha solver.
+		accepted_files -- captchas the portal accepted.
+		rejected_files -- captchas the portal rejected.
+		Returns: dict of profile name to its latency, accuracy and speedup over the default profile
+	"""
+	results = {}
+	for profile in PROFILES:
+		evaluation = evaluate_solver(solver, accepted_files, rejected_files, profile)
+		results[profile] = {
+			"denoise": evaluation["stages"]["denoise"],
+			"solve": evaluation["solve"],
+			"throughput": evaluation["throughput"],
+			"segmentation_failure_rate": evaluation["segmentation_failure_rate"],
+			"whole_string_accuracy": evaluation["whole_string_accuracy"],
+			"per_letter_accuracy": evaluation["per_letter_accuracy"],
+		}
+	default_mean = results["default"]["solve"]["mean"]
+	for result in results.values():
+		result["speedup"] = default_mean / result["solve"]["mean"] if result["solve"]["mean"] else 0.0
+		result["accuracy_change"] = result["whole_string_accuracy"] - results["default"]["whole_string_accuracy"]
+	return results
+
+
+def benchmark_segmenters(runtime: str, accepted_files: list, rejected_files: list) -> dict:
+	""" Compare how many captchas each letter segmenter splits into 5 letters and how many of them are right.
+		Keyword arguments:
+		runtime -- inference runtime used by every solver.
+		accepted_files -- captchas the portal accepted.
+		rejected_files -- captchas the portal rejected.
+		Returns: dict of segmenter name to its solvable fraction, accuracy and gain over the contours segmenter
+	"""
+	results = {}
+	for segmenter in SEGMENTERS:
+		solver = CaptchaSolver(runtime, segmenter=segmenter)
+		solver.load()
+		evaluation = evaluate_solver(solver, accepted_files, rejected_files)
+		results[segmenter] = {
+			"segment": evaluation["stages"]["segment"],
+			"solve": evaluation["solve"],
+			"solvable_fraction": 1 - evaluation["segmentation_failure_rate"],
+			"whole_string_accuracy": evaluation["whole_string_accuracy"],
+			"per_letter_accuracy": evaluation["per_letter_accuracy"],
+		}
+	reference = results["contours"]
+	for result in results.values():
+		result["solvable_gain"] = result["solvable_fraction"] - reference["solvable_fraction"]
+		result["accuracy_gain"] = result["whole_string_accuracy"] - reference["whole_string_accuracy"]
+	return results
+
+
+def benchmark_recognizers(runtime: str, accepted_files: list, rejected_files: list) -> dict:
+	""" Compare the per letter model with the whole captcha sequence model end to end.
+		Keyword arguments:
+		runtime -- inference runtime of the letter model.
+		accepted_files -- captchas the portal accepted.
+		rejected_files -- captchas the portal rejected.
+		Returns: dict of recognizer name to its latency and solve rate
+	"""
+	results = {}
+	for recognizer in RECOGNIZERS:
+		solver = CaptchaSolver(runtime, recognizer=recognizer)
+		try:
+			solver.load()
+		except (FileNotFoundError, ImportError) as err:
+			logger.warning("Skipping %s recognizer: %s", recognizer, err)
+			results[recognizer] = {"error": str(err)}
+			continue
+		evaluation = evaluate_solver(solver, accepted_files, rejected_files)
+		results[recognizer] = {
+			"load_time": solver.load_time,
+			"predict": evaluation["stages"]["predict"],
+			"solve": evaluation["solve"],
+			"throughput": evaluation["throughput"],
+			"answered_fraction": 1 - evaluation["segmentation_failure_rate"],
+			"whole_string_accuracy": evaluation["whole_string_accuracy"],
+			"per_letter_accuracy": evaluation["per_letter_accuracy"],
+		}
+	return results
+
+
+def save_results(results: dict, name: str) -> str:
+	""" Save the results as json under the benchmarks out directory and return the filename."""
+	filename = "up_scholarship/out/benchmarks/%s_%s.json" % (name, datetime.now().strftime("%Y%m%d_%H%M%S"))
+	os.makedirs(os.path.dirname(filename), exist_ok=True)
+	with open(filename, "w") as f:
+		json.dump(results, f, indent=2)
+	return filename
+
+
+def quantization_gate(corpus_dir: str = None):
+	""" Run the accuracy suite with the float and int8 models and record whether int8 can be enabled.
+		The tflite_int8 runtime is only used when the int8 whole string accuracy is within
+		CommonData.captcha_int8_tolerance of the float model in this run.
+	"""
+	corpus_dir = corpus_dir if corpus_dir else CommonData.captchas_dir
+	accepted_files = get_corpus_files(corpus_dir)
+	rejected_files = get_corpus_files(corpus_dir, wrong=True)
+	if not accepted_files:
+		print("No accepted captchas found in %s. Run savecaptchas first." % corpus_dir)
+		return
+	gate = {"corpus": corpus_dir}
+	for key, runtime in (("float", KerasRuntime.name), ("int8", TFLiteInt8Runtime.name)):
+		solver = CaptchaSolver(runtime)
+		solver.load()
+		gate[key] = evaluate_solver(solver, accepted_files, rejected_files)
+		gate[key].update(measure_startup(runtime))
+		gate[key]["model_size"] = _model_size(solver.runtime.model_filename)
+	with open(INT8_GATE_FILENAME, "w") as f:
+		json.dump(gate, f, indent=2)
+	passed = int8_gate_passed(CommonData.captcha_int8_tolerance)
+	logger.info("Int8 quantization gate passed: %s %s", passed, gate)
+	print(json.dumps(gate, indent=2))
+	print("Int8 model %s the accuracy gate (tolerance %s)." % (
+		"passed" if passed else "failed", CommonData.captcha_int8_tolerance))
+
+
+def benchmark_captcha(corpus_dir: str = None):
+	""" Run the captcha benchmarks over the saved captcha corpus, print the results as json
+		and save them so runs can be compared.
+	"""
+	corpus_dir = corpus_dir if corpus_dir else CommonData.captchas_dir
+	accepted_files = get_corpus_files(corpus_dir)
+	rejected_files = get_corpus_files(corpus_dir, wrong=True)
+	files = accepted_files + rejected_files
+	if not files:
+		print("No captchas found in %s. Run savecaptchas first." % corpus_dir)
+		return
+	solver = get_solver()
+	solver.load()
+	results = {
+		"corpus": corpus_dir,
+		"solver": evaluate_solver(solver, accepted_files, rejected_files),
+		"preprocess": benchmark_preprocess(files),
+		"inference": benchmark_inference(files),
+		"runtimes": benchmark_runtimes(files),
+		"profiles": benchmark_profiles(solver, accepted_files, rejected_files),
+		"segmenters": benchmark_segmenters(solver.runtime.name, accepted_files, rejected_files),
+		"recognizers": benchmark_recognizers(solver.runtime.name, accepted_files, rejected_files),
+	}
+	filename = save_results(results, "captcha")
+	logger.info("Captcha benchmark saved to %s: %s", filename, results)
+	print(json.dumps(results, indent=2))
+	print("Results saved to", filename)
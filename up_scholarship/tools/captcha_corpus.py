@@ -0,0 +1,25 @@
+import glob
+import os
+
+
+def get_corpus_files(corpus_dir: str, wrong=False) -> list:
+	""" Return saved captcha image files from the corpus directory.
+		Keyword arguments:
+		corpus_dir -- directory where savecaptchas spider saves the captchas.
+		wrong -- return the rejected captchas instead of accepted ones.
+	"""
+	if wrong:
+		corpus_dir = os.path.join(corpus_dir, "wrong")
+	return sorted(glob.glob(os.path.join(corpus_dir, "*.jpg")))
+
+
+def read_file(filename: str) -> bytes:
+	with open(filename, "rb") as f:
+		return f.read()
+
+
+def get_label(filename: str) -> str:
+	""" Return the captcha text the file was saved with, without the hash added to tell apart
+		different images read as the same text.
+	"""
+	return os.path.splitext(os.path.basename(filename))[0].split("_")[0]
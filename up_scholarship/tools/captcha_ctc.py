@@ -0,0 +1,163 @@
+import os
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
+import json
+import logging
+import numpy as np
+from cv2 import cv2
+
+from up_scholarship.providers.constants import CommonData
+
+CTC_MODEL_FILENAME = "up_scholarship/tools/captcha_models/captcha_ctc_model"
+CTC_CHARACTERS_FILENAME = "up_scholarship/tools/captcha_models/captcha_ctc_model_characters.json"
+IMAGE_WIDTH = 200
+IMAGE_HEIGHT = 50
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_image(image):
+	""" Resize the binarized captcha for the sequence model and make width the time axis.
+		Keyword arguments:
+		image -- binarized image returned by preprocess.
+		Returns: float32 numpy array of shape (IMAGE_WIDTH, IMAGE_HEIGHT, 1)
+	"""
+	image = cv2.resize(image, (IMAGE_WIDTH, IMAGE_HEIGHT), interpolation=cv2.INTER_AREA)
+	return np.expand_dims(image.T.astype(np.float32) / 255.0, axis=2)
+
+
+def ctc_greedy_decode(prediction, characters: list):
+	""" Decode the model output of one captcha by taking the best character at every step,
+		collapsing repeats and dropping blanks.
+		Keyword arguments:
+		prediction -- softmax output of shape (steps, len(characters) + 1), the last class is the blank.
+		characters -- characters the model was trained on.
+		Returns: tuple of text and probability of each of its characters
+	"""
+	best = prediction.argmax(axis=1)
+	blank = len(characters)
+	text = []
+	probabilities = []
+	previous = blank
+	for step, index in enumerate(best):
+		if index != previous and index != blank:
+			text.append(characters[index])
+			probabilities.append(float(prediction[step, index]))
+		previous = index
+	return "".join(text), probabilities
+
+
+def build_model(num_characters: int):
+	""" Build the CRNN: two conv blocks, two bidirectional LSTMs and a softmax over characters and blank.
+		Returns: tuple of the training model, which takes labels and outputs the ctc loss, and the
+			prediction model
+	"""
+	from tensorflow import keras
+	import tensorflow as tf
+
+	class CTCLayer(keras.layers.Layer):
+		def call(self, labels, predictions):
+			batch_size = tf.shape(labels)[0]
+			input_length = tf.fill([batch_size, 1], tf.shape(predictions)[1])
+			label_length = tf.fill([batch_size, 1], tf.shape(labels)[1])
+			self.add_loss(keras.backend.ctc_batch_cost(labels, predictions, input_length, label_length))
+			return predictions
+
+	image_input = keras.layers.Input(shape=(IMAGE_WIDTH, IMAGE_HEIGHT, 1), name="image")
+	labels = keras.layers.Input(shape=(None,), name="label", dtype="float32")
+	x = keras.layers.Conv2D(32, 3, activation="relu", padding="same")(image_input)
+	x = keras.layers.MaxPooling2D(2)(x)
+	x = keras.layers.Conv2D(64, 3, activation="relu", padding="same")(x)
+	x = keras.layers.MaxPooling2D(2)(x)
+	# Every column of the feature map becomes one step of the sequence
+	x = keras.layers.Reshape((IMAGE_WIDTH // 4, (IMAGE_HEIGHT // 4) * 64))(x)
+	x = keras.layers.Dense(64, activation="relu")(x)
+	x = keras.layers.Dropout(0.2)(x)
+	x = keras.layers.Bidirectional(keras.layers.LSTM(128, return_sequences=True, dropout=0.25))(x)
+	x = keras.layers.Bidirectional(keras.layers.LSTM(64, return_sequences=True, dropout=0.25))(x)
+	predictions = keras.layers.Dense(num_characters + 1, activation="softmax", name="predictions")(x)
+	output = CTCLayer(name="ctc_loss")(labels, predictions)
+	training_model = keras.models.Model(inputs=[image_input, labels], outputs=output)
+	training_model.compile(optimizer=keras.optimizers.Adam())
+	return training_model, keras.models.Model(inputs=image_input, outputs=predictions)
+
+
+class CTCRecognizer:
+	""" Read the whole captcha in one forward pass of the CRNN trained by train_ctc_model."""
+	def __init__(self, model_filename=CTC_MODEL_FILENAME, characters_filename=CTC_CHARACTERS_FILENAME):
+		self.model_filename = model_filename
+		self.characters_filename = characters_filename
+		self.model = None
+		self.characters = []
+
+	def load(self):
+		if not os.path.exists(self.model_filename):
+			raise FileNotFoundError(
+				"%s not found. Run 'up_scholarship trainctc' to create it." % self.model_filename)
+		from tensorflow import keras
+		logging.getLogger('tensorflow').disabled = True
+		with open(self.characters_filename, "r") as f:
+			self.characters = json.load(f)
+		self.model = keras.models.load_model(self.model_filename, compile=False)
+
+	def recognize(self, image):
+		""" Return the text and probability of each of its characters.
+			Keyword arguments:
+			image -- binarized image returned by preprocess.
+		"""
+		prediction = np.asarray(self.model.predict_on_batch(np.expand_dims(prepare_image(image), axis=0)))
+		return ctc_greedy_decode(prediction[0], self.characters)
+
+
+def load_corpus(corpus_dir: str, profile: str = CommonData.captcha_profile):
+	""" Return the prepared images and texts of the captchas the portal accepted."""
+	from up_scholarship.tools.captcha_corpus import get_corpus_files, read_file, get_label
+	from up_scholarship.tools.solve_captcha_using_model import decode_image, preprocess
+	images = []
+	texts = []
+	for filename in get_corpus_files(corpus_dir):
+		image, _ = preprocess(decode_image(read_file(filename)), profile)
+		images.append(prepare_image(image))
+		texts.append(get_label(filename))
+	return np.asarray(images), texts
+
+
+def train_ctc_model(corpus_dir: str = None, epochs=100, validation_split=0.1):
+	""" Train the CRNN on the captchas saved by savecaptchas and save it next to the letter model.
+		Keyword arguments:
+		corpus_dir -- directory with captchas named by their text, defaults to CommonData.captchas_dir.
+		epochs -- maximum epochs, training stops early when validation loss stops improving.
+		validation_split -- fraction of captchas held out to check the model.
+	"""
+	from tensorflow import keras
+	corpus_dir = corpus_dir if corpus_dir else CommonData.captchas_dir
+	images, texts = load_corpus(corpus_dir)
+	if not len(texts):
+		print("No accepted captchas found in %s. Run savecaptchas first." % corpus_dir)
+		return
+	characters = sorted(set("".join(texts)))
+	# All captchas have the same length so labels need no padding
+	labels = np.asarray([[characters.index(c) for c in text] for text in texts], dtype=np.float32)
+	order = np.random.default_rng(0).permutation(len(texts))
+	images, labels = images[order], labels[order]
+	texts = [texts[i] for i in order]
+	split = max(int(len(texts) * (1 - validation_split)), 1)
+
+	training_model, prediction_model = build_model(len(characters))
+	training_model.fit(
+		{"image": images[:split], "label": labels[:split]},
+		validation_data=({"image": images[split:], "label": labels[split:]},) if split < len(texts) else None,
+		epochs=epochs,
+		batch_size=16,
+		callbacks=[keras.callbacks.EarlyStopping(
+			monitor="val_loss" if split < len(texts) else "loss", patience=10, restore_best_weights=True)])
+
+	prediction_model.save(CTC_MODEL_FILENAME)
+	with open(CTC_CHARACTERS_FILENAME, "w") as f:
+		json.dump(characters, f)
+
+	predictions = prediction_model.predict(images[split:]) if split < len(texts) else []
+	correct = sum(
+		ctc_greedy_decode(prediction, characters)[0] == text for prediction, text in zip(predictions, texts[split:]))
+	logger.info("CTC model trained on %d captchas, %d/%d validation captchas right",
+		split, correct, len(texts) - split)
+	print("Saved CTC model to %s, validation accuracy %d/%d" % (CTC_MODEL_FILENAME, correct, len(texts) - split))
@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import time
+from dataclasses import asdict
+
+from up_scholarship.providers.constants import CommonData
+from up_scholarship.tools.captcha_runtime import resolve_runtime
+from up_scholarship.tools.solve_captcha_using_model import CaptchaSolver, CaptchaResult
+
+# Every frame is a one byte operation and the payload length followed by the payload
+HEADER = struct.Struct("!cI")
+# A solve payload starts with the length of the profile name and the name, empty for the default profile
+PROFILE_HEADER = struct.Struct("!B")
+OP_SOLVE = b"S"
+OP_STATS = b"T"
+
+logger = logging.getLogger(__name__)
+
+
+def _model_mtime(solver: CaptchaSolver) -> float:
+	""" Return the latest modification time of the files the solver loads its models from."""
+	model_filename = solver.ctc.model_filename if solver.ctc else solver.runtime.model_filename
+	filenames = [solver.ctc.characters_filename if solver.ctc else solver.labels_filename]
+	if os.path.isdir(model_filename):
+		filenames.extend(
+			os.path.join(root, name) for root, _, names in os.walk(model_filename) for name in names)
+	else:
+		filenames.append(model_filename)
+	return max((os.path.getmtime(filename) for filename in filenames if os.path.exists(filename)), default=0.0)
+
+
+class CaptchaDaemon:
+	""" Solve captchas for every up_scholarship process on the machine over a unix socket.
+		The model is loaded once, requests arriving within the batch window are solved together and
+		the model is reloaded when its files change.
+	"""
+	def __init__(
+			self,
+			socket_path: str = CommonData.captcha_daemon_socket,
+			batch_window: float = CommonData.captcha_batch_window,
+			max_batch: int = CommonData.captcha_max_batch,
+			reload_interval: float = 5.0):
+		self.socket_path = socket_path
+		self.batch_window = batch_window
+		self.max_batch = max(max_batch, 1)
+		self.reload_interval = reload_interval
+		self.solver = None
+		self.model_mtime = 0.0
+		self.last_reload_check = 0.0
+		self.reload_future = None
+		self.queue = None
+		self.started = time.monotonic()
+		self.requests = 0
+		self.batches = 0
+		self.solve_time = 0.0
+		self.max_queue_depth = 0
+		self.reloads = 0
+
+	def stats(self) -> dict:
+		""" Return request counts, throughput, batch sizes and queue depth."""
+		uptime = time.monotonic() - self.started
+		return {
+			"uptime": uptime,
+			"requests": self.requests,
+			"batches": self.batches,
+			"avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+			"throughput": self.requests / uptime if uptime else 0.0,
+			"solve_time": self.solve_time,
+			"queue_depth": self.queue.qsize() if self.queue else 0,
+			"max_queue_depth": self.max_queue_depth,
+			"reloads": self.reloads,
+			"solver": self.solver.stats() if self.solver else {},
+		}
+
+	def _load_solver(self):
+		""" Load a new solver and swap it in, requests keep using the old one until it is ready."""
+		solver = CaptchaSolver(resolve_runtime(CommonData.captcha_runtime, CommonData.captcha_int8_tolerance))
+		model_mtime = _model_mtime(solver)
+		solver.load()
+		if self.solver:
+			self.reloads += 1
+			logger.info("Captcha model files changed, reloaded the model")
+		self.solver = solver
+		self.model_mtime = model_mtime
+
+	def _check_reload(self):
+		now = time.monotonic()
+		if now - self.last_reload_check < self.reload_interval:
+			return
+		self.last_reload_check = now
+		if self.reload_future and not self.reload_future.done():
+			return
+		if _model_mtime(self.solver) > self.model_mtime:
+			self.reload_future = asyncio.get_running_loop().run_in_executor(None, self._load_solver)
+
+	async def _next_batch(self) -> list:
+		""" Wait for a request and collect the ones arriving within the batch window after it."""
+		loop = asyncio.get_running_loop()
+		batch = [await self.queue.get()]
+		deadline = loop.time() + self.batch_window
+		while len(batch) < self.max_batch:
+			timeout = deadline - loop.time()
+			if timeout <= 0:
+				break
+			try:
+				batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+			except asyncio.TimeoutError:
+				break
+		return batch
+
+	async def batch_worker(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			batch = await self._next_batch()
+			self._check_reload()
+			start = time.perf_counter()
+			# A batch is preprocessed with one profile so split it by the profile asked for
+			by_profile = {}
+			for captcha_image_file, profile, future in batch:
+				by_profile.setdefault(profile, []).append((captcha_image_file, future))
+			for profile, requests in by_profile.items():
+				try:
+					results = await loop.run_in_executor(
+						None, self.solver.solve_batch, [captcha_image_file for captcha_image_file, _ in requests],
+						profile)
+				except Exception:
+					logger.exception("Unable to solve a batch of %d captchas", len(requests))
+					results = [CaptchaResult() for _ in requests]
+				for (_, future), result in zip(requests, results):
+					if not future.done():
+						future.set_result(result)
+			self.solve_time += time.perf_counter() - start
+			self.batches += 1
+			self.requests += len(batch)
+
+	async def handle_client(self, reader, writer):
+		""" Answer frames from a client until it disconnects."""
+		loop = asyncio.get_running_loop()
+		try:
+			while True:
+				op, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+				payload = await reader.readexactly(length)
+				if op == OP_SOLVE:
+					future = loop.create_future()
+					profile_length = PROFILE_HEADER.unpack_from(payload)[0]
+					profile = payload[PROFILE_HEADER.size:PROFILE_HEADER.size + profile_length].decode()
+					captcha_image_file = payload[PROFILE_HEADER.size + profile_length:]
+					self.queue.put_nowait((captcha_image_file, profile if profile else None, future))
+					self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+					response = asdict(await future)
+				elif op == OP_STATS:
+					response = self.stats()
+				else:
+					response = {"error": "Unknown operation %r" % op}
+				data = json.dumps(response).encode()
+				writer.write(HEADER.pack(op, len(data)) + data)
+				await writer.drain()
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	async def log_stats(self, interval=60.0):
+		while True:
+			await asyncio.sleep(interval)
+			logger.info("Captcha daemon stats: %s", self.stats())
+
+	async def serve(self):
+		self.queue = asyncio.Queue()
+		await asyncio.get_running_loop().run_in_executor(None, self._load_solver)
+		if os.path.exists(self.socket_path):
+			os.remove(self.socket_path)
+		os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+		server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path)
+		logger.info("Captcha daemon listening on %s", self.socket_path)
+		print("Captcha daemon listening on", self.socket_path)
+		asyncio.ensure_future(self.batch_worker())
+		asyncio.ensure_future(self.log_stats())
+		async with server:
+			await server.serve_forever()
+
+	def run(self):
+		if not hasattr(socket, "AF_UNIX"):
+			print("Captcha daemon needs unix sockets which are not available on this platform.")
+			return
+		try:
+			asyncio.run(self.serve())
+		except KeyboardInterrupt:
+			pass
+		finally:
+			if os.path.exists(self.socket_path):
+				os.remove(self.socket_path)
+			logger.info("Captcha daemon stopped: %s", self.stats())
+
+
+def _recv_exactly(sock, size: int) -> bytes:
+	data = bytearray()
+	while len(data) < size:
+		chunk = sock.recv(size - len(data))
+		if not chunk:
+			raise ConnectionError("Captcha daemon closed the connection")
+		data.extend(chunk)
+	return bytes(data)
+
+
+def daemon_request(op: bytes, payload: bytes = b"", socket_path: str = None):
+	""" Send one frame to the daemon and return its decoded json answer.
+		Returns: the answer or None if the daemon is not running or didn't answer
+	"""
+	socket_path = socket_path if socket_path else CommonData.captcha_daemon_socket
+	if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+		return None
+	try:
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+			sock.settimeout(CommonData.captcha_daemon_timeout)
+			sock.connect(socket_path)
+			sock.sendall(HEADER.pack(op, len(payload)) + payload)
+			_, length = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+			return json.loads(_recv_exactly(sock, length))
+	except (OSError, ValueError) as err:
+		logger.debug("Captcha daemon not available: %s", err)
+		return None
+
+
+def daemon_running() -> bool:
+	return daemon_request(OP_STATS) is not None
+
+
+def solve_with_daemon(captcha_image_file, profile: str = None):
+	""" Solve the captcha with the daemon.
+		Keyword arguments:
+		captcha_image_file -- encoded captcha image bytes.
+		profile -- preprocessing profile, defaults to the daemon's profile.
+		Returns: CaptchaResult or None if the daemon is not running
+	"""
+	profile = profile.encode() if profile else b""
+	response = daemon_request(OP_SOLVE, PROFILE_HEADER.pack(len(profile)) + profile + captcha_image_file)
+	return CaptchaResult(**response) if response is not None else None
+
+
+def run_daemon():
+	CaptchaDaemon().run()
+
+
+def print_daemon_stats():
+	stats = daemon_request(OP_STATS)
+	if stats is None:
+		print("Captcha daemon is not running on", CommonData.captcha_daemon_socket)
+	else:
+		print(json.dumps(stats, indent=2))
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import numpy as np
+
+from up_scholarship.providers.constants import CommonData
+from up_scholarship.tools.captcha_corpus import get_corpus_files, read_file, get_label
+from up_scholarship.tools.solve_captcha_using_model import decode_image, preprocess, get_segmenter, \
+	extract_letter_images
+
+# Raw uint8 letter crops appended one after another, so new captchas are added without rewriting old ones
+CROPS_FILENAME = "crops.u8"
+LABELS_FILENAME = "labels.npy"
+INDEX_FILENAME = "index.json"
+CROP_SHAPE = (20, 20)
+CROP_SIZE = CROP_SHAPE[0] * CROP_SHAPE[1]	# Bytes of one crop in the crops file.
+
+logger = logging.getLogger(__name__)
+
+
+def _segment_file(args):
+	""" Cut the letters out of one captcha, run on the worker processes.
+		Returns: tuple of filename and crops of shape (5, 20, 20) or None if it didn't segment into 5 letters
+	"""
+	filename, profile, segmenter = args
+	image, thresh = preprocess(decode_image(read_file(filename)), profile)
+	letter_image_regions = get_segmenter(segmenter)(thresh)
+	if len(letter_image_regions) != 5 or len(get_label(filename)) != 5:
+		return filename, None
+	return filename, extract_letter_images(image, letter_image_regions)[..., 0]
+
+
+def _replace_file(filename: str, write):
+	""" Write the file next to its old version and swap it in, so readers see the old or the new one whole.
+		Keyword arguments:
+		filename -- file to replace.
+		write -- function writing the new contents to the binary file object it is given.
+	"""
+	temp_filename = filename + ".tmp"
+	with open(temp_filename, "wb") as f:
+		write(f)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(temp_filename, filename)
+
+
+class CaptchaDataset:
+	""" Labelled letter crops of the saved captcha corpus in a memory mapped array.
+		The index keeps the content hash of every captcha already added so the corpus can be rescanned
+		cheaply and duplicates saved under other names are skipped. The index is written last, crops and
+		labels beyond its count are left over from an interrupted update and dropped when it is read.
+	"""
+	def __init__(
+			self,
+			dataset_dir: str = CommonData.captcha_dataset_dir,
+			profile: str = CommonData.captcha_profile,
+			segmenter: str = CommonData.captcha_segmenter):
+		self.dataset_dir = dataset_dir
+		self.profile = profile
+		self.segmenter = segmenter
+		self.index = {"profile": profile, "segmenter": segmenter, "count": 0, "images": {}}
+		self.labels = np.empty(0, dtype="<U1")
+		self._read_index()
+
+	def _path(self, filename: str) -> str:
+		return os.path.join(self.dataset_dir, filename)
+
+	def _read_index(self):
+		try:
+			with open(self._path(INDEX_FILENAME), "r") as f:
+				index = json.load(f)
+		except (IOError, ValueError):
+			return
+		# Crops made with other preprocessing would not match what the solver feeds the model
+		if index["profile"] != self.profile or index["segmenter"] != self.segmenter:
+			logger.warning(
+				"Captcha dataset was built with %s profile and %s segmenter, rebuilding it.",
+				index["profile"], index["segmenter"])
+			return
+		crops_size = index["count"] * CROP_SIZE
+		try:
+			labels = np.load(self._path(LABELS_FILENAME))
+			actual_size = os.path.getsize(self._path(CROPS_FILENAME))
+		except (IOError, ValueError):
+			labels, actual_size = None, 0
+		if labels is None or len(labels) < index["count"] or actual_size < crops_size:
+			logger.warning("Captcha dataset files are missing letters counted in its index, rebuilding it.")
+			return
+		if actual_size > crops_size:
+			# Appended before an interrupted update could write the index, later appends would be misplaced
+			logger.warning("Dropping %d letter crops of an interrupted update.", (actual_size - crops_size) // CROP_SIZE)
+			with open(self._path(CROPS_FILENAME), "r+b") as f:
+				f.truncate(crops_size)
+		self.index = index
+		self.labels = labels[:index["count"]]
+
+	def __len__(self):
+		return self.index["count"]
+
+	def load(self):
+		""" Return the crops as a read only memory map of shape (n, 20, 20, 1) and the letter of each crop."""
+		if not len(self):
+			return np.empty((0,) + CROP_SHAPE + (1,), dtype=np.uint8), self.labels
+		crops = np.memmap(
+			self._path(CROPS_FILENAME), dtype=np.uint8, mode="r", shape=(len(self),) + CROP_SHAPE + (1,))
+		return crops, self.labels
+
+	def update(self, corpus_dir: str, processes: int = None) -> int:
+		""" Add the captchas of the corpus which are not in the dataset yet.
+			Keyword arguments:
+			corpus_dir -- directory where savecaptchas saves the accepted captchas.
+			processes -- worker processes segmenting captchas, defaults to the number of cores.
+			Returns: number of captchas added
+		"""
+		rebuild = not len(self)
+		new_files = {}
+		seen = set(self.index["images"])
+		for filename in get_corpus_files(corpus_dir):
+			# Hashing is much cheaper than decoding, so only new content gets segmented
+			image_hash = hashlib.sha1(read_file(filename)).hexdigest()
+			if image_hash not in seen:
+				seen.add(image_hash)
+				new_files[filename] = image_hash
+		if not new_files:
+			return 0
+
+		os.makedirs(self.dataset_dir, exist_ok=True)
+		added = 0
+		new_labels = []
+		with multiprocessing.Pool(processes) as pool, \
+				open(self._path(CROPS_FILENAME), "wb" if rebuild else "ab") as crops_file:
+			jobs = [(filename, self.profile, self.segmenter) for filename in new_files]
+			for filename, crops in pool.imap_unordered(_segment_file, jobs, chunksize=16):
+				entry = {"file": os.path.basename(filename), "text": get_label(filename), "start": None}
+				if crops is not None:
+					entry["start"] = self.index["count"]
+					crops_file.write(np.ascontiguousarray(crops, dtype=np.uint8).tobytes())
+					new_labels.extend(entry["text"])
+					self.index["count"] += len(crops)
+					added += 1
+				# Captchas which don't segment are remembered too so they are not tried on every update
+				self.index["images"][new_files[filename]] = entry
+			crops_file.flush()
+			os.fsync(crops_file.fileno())
+		self.labels = np.concatenate([self.labels, np.asarray(new_labels, dtype="<U1")])
+		_replace_file(self._path(LABELS_FILENAME), lambda f: np.save(f, self.labels))
+		_replace_file(self._path(INDEX_FILENAME), lambda f: f.write(json.dumps(self.index).encode("utf-8")))
+		return added
+
+
+def build_dataset(corpus_dir: str = None):
+	""" Add new captchas from the savecaptchas corpus to the letter crop dataset."""
+	corpus_dir = corpus_dir if corpus_dir else CommonData.captchas_dir
+	dataset = CaptchaDataset()
+	added = dataset.update(corpus_dir)
+	logger.info("Added %d captchas to the captcha dataset, %d letters in total", added, len(dataset))
+	print("Added %d captchas, dataset has %d letters in %s" % (added, len(dataset), dataset.dataset_dir))
+
+
+def retrain_letter_model(epochs=10):
+	""" Continue training the letter model on the crop dataset and save it in place of the old one."""
+	import pickle
+	from tensorflow import keras
+	from up_scholarship.tools.captcha_runtime import MODEL_FILENAME
+	from up_scholarship.tools.solve_captcha_using_model import MODEL_LABELS_FILENAME
+	crops, labels = CaptchaDataset().load()
+	with open(MODEL_LABELS_FILENAME, "rb") as f:
+		lb = pickle.load(f)
+	# The model can't learn letters it has no output for
+	known = np.isin(labels, lb.classes_)
+	if not known.any():
+		print("No letters to train on. Run buildcaptchadata first.")
+		return
+	model = keras.models.load_model(MODEL_FILENAME)
+	if not model.optimizer:
+		model.compile(loss="categorical_crossentropy", optimizer="adam", metrics=["accuracy"])
+	model.fit(crops[known], lb.transform(labels[known]), validation_split=0.1, batch_size=32, epochs=epochs)
+	model.save(MODEL_FILENAME)
+	print("Saved retrained model to", MODEL_FILENAME)
@@ -0,0 +1,105 @@
+import csv
+import logging
+import os
+import threading
+from datetime import datetime
+import numpy as np
+
+from up_scholarship.providers.constants import CommonData
+from up_scholarship.tools.solve_captcha_using_model import PROFILES
+
+ACCEPTED = "accepted"
+REJECTED = "rejected"
+REFETCHED = "refetched"
+FIELDS = ["time", "image_hash", "profile", "text", "confidence", "outcome"]
+
+logger = logging.getLogger(__name__)
+
+
+class CaptchaLedger:
+	""" Append only record of what happened to every solved captcha.
+		A captcha is accepted or rejected by the portal, or refetched without submitting when the solver
+		was not confident. The counts per profile are kept in memory to pick the profile for the next captcha.
+	"""
+	def __init__(self, filename: str = CommonData.captcha_ledger_file):
+		self.filename = filename
+		self.counts = {profile: {ACCEPTED: 0, REJECTED: 0, REFETCHED: 0} for profile in PROFILES}
+		self._lock = threading.Lock()
+		self._rng = np.random.default_rng()
+		self._load()
+
+	def _load(self):
+		if not os.path.isfile(self.filename):
+			return
+		with open(self.filename, "r", newline="") as f:
+			for row in csv.DictReader(f):
+				self._count(row["profile"], row["outcome"])
+
+	def _count(self, profile: str, outcome: str):
+		if profile in self.counts and outcome in self.counts[profile]:
+			self.counts[profile][outcome] += 1
+
+	def record(self, captcha, outcome: str):
+		""" Append the outcome of a solved captcha.
+			Keyword arguments:
+			captcha -- CaptchaResult of the captcha.
+			outcome -- ACCEPTED, REJECTED or REFETCHED.
+		"""
+		row = [
+			datetime.now().isoformat(timespec="seconds"), captcha.image_hash, captcha.profile, captcha.text,
+			"%.4f" % captcha.confidence, outcome]
+		with self._lock:
+			self._count(captcha.profile, outcome)
+			os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+			new_file = not os.path.isfile(self.filename)
+			with open(self.filename, "a", newline="") as f:
+				writer = csv.writer(f)
+				if new_file:
+					writer.writerow(FIELDS)
+				writer.writerow(row)
+
+	def stats(self) -> dict:
+		""" Return the outcome counts, accuracy of submitted captchas and round trips per login of every profile."""
+		stats = {}
+		with self._lock:
+			for profile, counts in self.counts.items():
+				submitted = counts[ACCEPTED] + counts[REJECTED]
+				fetched = submitted + counts[REFETCHED]
+				stats[profile] = dict(counts)
+				stats[profile]["accuracy"] = counts[ACCEPTED] / submitted if submitted else 0.0
+				stats[profile]["round_trips_per_login"] = \
+					(fetched + submitted) / counts[ACCEPTED] if counts[ACCEPTED] else None
+		return stats
+
+	def choose_profile(self) -> str:
+		""" Pick the profile with the fewest expected round trips per successful login by Thompson sampling.
+			Every captcha costs a captcha download and a submitted one also costs a login post. The chance a
+			downloaded captcha logs in is drawn from its Beta posterior, so profiles with few outcomes still get
+			tried while the ledger is young.
+		"""
+		best = None
+		best_cost = None
+		with self._lock:
+			for profile, counts in self.counts.items():
+				submitted = counts[ACCEPTED] + counts[REJECTED]
+				fetched = submitted + counts[REFETCHED]
+				success = self._rng.beta(1 + counts[ACCEPTED], 1 + fetched - counts[ACCEPTED])
+				submit_rate = (submitted + 1) / (fetched + 1)
+				cost = (1 + submit_rate) / success
+				if best_cost is None or cost < best_cost:
+					best, best_cost = profile, cost
+		return best
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> CaptchaLedger:
+	""" Return the process wide captcha ledger, reading the past outcomes on first use."""
+	global _ledger
+	if _ledger is None:
+		with _ledger_lock:
+			if _ledger is None:
+				_ledger = CaptchaLedger()
+	return _ledger
@@ -0,0 +1,206 @@
+import os
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
+import json
+import logging
+import threading
+import numpy as np
+from up_scholarship.providers.constants import CommonData
+
+MODEL_FILENAME = "up_scholarship/tools/captcha_models/captcha_model"
+TFLITE_MODEL_FILENAME = "up_scholarship/tools/captcha_models/captcha_model.tflite"
+TFLITE_INT8_MODEL_FILENAME = "up_scholarship/tools/captcha_models/captcha_model_int8.tflite"
+INT8_GATE_FILENAME = "up_scholarship/tools/captcha_models/captcha_model_int8_gate.json"
+
+logger = logging.getLogger(__name__)
+
+
+class KerasRuntime:
+	""" Run the letter classifier with full TensorFlow Keras."""
+	name = "keras"
+
+	def __init__(self, model_filename=MODEL_FILENAME):
+		self.model_filename = model_filename
+		self.model = None
+
+	def load(self):
+		# Importing tensorflow takes seconds so only do it when the model is needed
+		from tensorflow import keras
+		logging.getLogger('tensorflow').disabled = True
+		self.model = keras.models.load_model(self.model_filename)
+
+	def predict(self, letter_images):
+		""" Return the softmax output for a batch of letter images of shape (n, 20, 20, 1)."""
+		return np.asarray(self.model.predict_on_batch(letter_images))
+
+
+def _get_interpreter_class():
+	""" Return the lightest available tflite interpreter.
+		tflite_runtime is a few MB and imports in milliseconds, full tensorflow is used only if it is missing.
+	"""
+	try:
+		from tflite_runtime.interpreter import Interpreter
+	except ImportError:
+		from tensorflow.lite import Interpreter
+	return Interpreter
+
+
+class TFLiteRuntime:
+	""" Run the letter classifier exported by export_tflite."""
+	name = "tflite"
+
+	def __init__(self, model_filename=TFLITE_MODEL_FILENAME):
+		self.model_filename = model_filename
+		self.interpreter = None
+		self.input_detail = None
+		self.output_detail = None
+		self.batch_size = 0
+		self.lock = threading.Lock()  # Interpreter tensors are shared so one batch runs at a time.
+
+	def load(self):
+		if not os.path.isfile(self.model_filename):
+			raise FileNotFoundError(
+				"%s not found. Run 'up_scholarship exportcaptcha' to create it." % self.model_filename)
+		self.interpreter = _get_interpreter_class()(model_path=self.model_filename)
+		self.interpreter.allocate_tensors()
+		self.input_detail = self.interpreter.get_input_details()[0]
+		self.output_detail = self.interpreter.get_output_details()[0]
+		self.batch_size = self.input_detail["shape"][0]
+
+	def predict(self, letter_images):
+		""" Return the softmax output for a batch of letter images of shape (n, 20, 20, 1).
+			Safe to call from the solver's worker threads, they take turns on the interpreter.
+		"""
+		letter_images = self._quantize(letter_images)
+		with self.lock:
+			batch_size = len(letter_images)
+			if batch_size != self.batch_size:
+				self.interpreter.resize_tensor_input(self.input_detail["index"], [batch_size, 20, 20, 1])
+				self.interpreter.allocate_tensors()
+				self.batch_size = batch_size
+			self.interpreter.set_tensor(self.input_detail["index"], letter_images)
+			self.interpreter.invoke()
+			output = self.interpreter.get_tensor(self.output_detail["index"])
+		return self._dequantize(output)
+
+	def _quantize(self, letter_images):
+		""" Convert the input to the model input type, applying the input quantization if any."""
+		dtype = self.input_detail["dtype"]
+		scale, zero_point = self.input_detail["quantization"]
+		if scale:
+			info = np.iinfo(dtype)
+			letter_images = np.clip(np.round(letter_images / scale + zero_point), info.min, info.max)
+		return letter_images.astype(dtype)
+
+	def _dequantize(self, output):
+		""" Convert the model output back to float probabilities."""
+		scale, zero_point = self.output_detail["quantization"]
+		if scale:
+			return (output.astype(np.float32) - zero_point) * scale
+		return np.array(output)
+
+
+class TFLiteInt8Runtime(TFLiteRuntime):
+	""" Run the int8 post training quantized letter classifier."""
+	name = "tflite_int8"
+
+	def __init__(self, model_filename=TFLITE_INT8_MODEL_FILENAME):
+		super().__init__(model_filename)
+
+
+RUNTIMES = {
+	KerasRuntime.name: KerasRuntime,
+	TFLiteRuntime.name: TFLiteRuntime,
+	TFLiteInt8Runtime.name: TFLiteInt8Runtime,
+}
+
+
+def get_runtime(name: str):
+	""" Return a new, not yet loaded runtime by its name."""
+	try:
+		return RUNTIMES[name]()
+	except KeyError:
+		raise ValueError("Unknown captcha runtime: %s. Available: %s" % (name, ", ".join(RUNTIMES)))
+
+
+def int8_gate_passed(tolerance: float) -> bool:
+	""" Check the last accuracy gate run of the int8 model.
+		Keyword arguments:
+		tolerance -- how much lower the int8 whole string accuracy may be than the float model.
+		Returns: True if the int8 model is within tolerance of the float model.
+	"""
+	try:
+		with open(INT8_GATE_FILENAME, "r") as f:
+			gate = json.load(f)
+	except (IOError, ValueError):
+		return False
+	return gate["int8"]["whole_string_accuracy"] >= gate["float"]["whole_string_accuracy"] - tolerance
+
+
+def resolve_runtime(name: str, int8_tolerance: float) -> str:
+	""" Return the runtime to use, falling back to the float model when the int8 model is not gated in."""
+	if name == TFLiteInt8Runtime.name and not int8_gate_passed(int8_tolerance):
+		logger.warning(
+			"Int8 captcha model has not passed the accuracy gate within %s, using keras. "
+			"Run 'up_scholarship quantgate' to check it.", int8_tolerance)
+		return KerasRuntime.name
+	return name
+
+
+def export_tflite(
+		model_filename=MODEL_FILENAME,
+		out_filename=TFLITE_MODEL_FILENAME,
+		representative_images=None) -> str:
+	""" Convert the keras captcha model to a tflite flatbuffer.
+		Keyword arguments:
+		model_filename -- saved keras model directory.
+		out_filename -- where to write the tflite model.
+		representative_images -- letter images of shape (n, 20, 20, 1) to calibrate full int8 quantization,
+			the model is exported as float when not given.
+		Returns: out_filename
+	"""
+	import tensorflow as tf
+	converter = tf.lite.TFLiteConverter.from_saved_model(model_filename)
+	if representative_images is not None:
+		def representative_dataset():
+			for letter_image in representative_images:
+				yield [np.expand_dims(letter_image, axis=0).astype(np.float32)]
+		converter.optimizations = [tf.lite.Optimize.DEFAULT]
+		converter.representative_dataset = representative_dataset
+		converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+		converter.inference_input_type = tf.int8
+		converter.inference_output_type = tf.int8
+	tflite_model = converter.convert()
+	with open(out_filename, "wb") as f:
+		f.write(tflite_model)
+	logger.info("Exported %s to %s", model_filename, out_filename)
+	return out_filename
+
+
+def get_representative_images(corpus_dir: str, limit=500):
+	""" Return letter crops from the saved captcha corpus to calibrate quantization."""
+	from up_scholarship.tools.captcha_corpus import get_corpus_files, read_file
+	from up_scholarship.tools.solve_captcha_using_model import decode_image, preprocess, find_letter_regions, \
+		extract_letter_images
+	letter_images = []
+	for filename in get_corpus_files(corpus_dir):
+		image, thresh = preprocess(decode_image(read_file(filename)))
+		letter_image_regions = find_letter_regions(thresh)
+		if len(letter_image_regions) == 5:
+			letter_images.extend(extract_letter_images(image, letter_image_regions))
+		if len(letter_images) >= limit:
+			break
+	return np.asarray(letter_images)
+
+
+def export_captcha_model(corpus_dir: str = None):
+	""" Export the captcha model for lightweight runtimes.
+		The int8 model is calibrated on the saved captcha corpus and is skipped if there is none.
+	"""
+	print("Exported to", export_tflite())
+	representative_images = get_representative_images(corpus_dir if corpus_dir else CommonData.captchas_dir)
+	if len(representative_images):
+		print("Exported to", export_tflite(
+			out_filename=TFLITE_INT8_MODEL_FILENAME, representative_images=representative_images))
+		print("Run 'up_scholarship quantgate' before enabling the tflite_int8 runtime.")
+	else:
+		print("No captchas found to calibrate the int8 model. Run savecaptchas first.")
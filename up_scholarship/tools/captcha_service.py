@@ -0,0 +1,56 @@
+import logging
+import threading
+from twisted.internet import reactor, threads
+from twisted.internet.defer import Deferred
+from twisted.python.threadpool import ThreadPool
+
+from up_scholarship.providers.constants import CommonData
+from up_scholarship.tools.solve_captcha_using_model import get_captcha_result, get_solver
+
+logger = logging.getLogger(__name__)
+
+
+class CaptchaService:
+	""" Solve captchas on a worker thread pool so the reactor keeps serving other requests.
+		OpenCV and TensorFlow release the GIL during the heavy work, so threads are enough to overlap
+		captcha solving with network waits.
+	"""
+	def __init__(self, pool_size: int = CommonData.captcha_workers):
+		self.pool_size = max(pool_size, 1)
+		self.pool = ThreadPool(minthreads=1, maxthreads=self.pool_size, name="captcha")
+		self.started = False
+
+	def start(self):
+		if self.started:
+			return
+		self.pool.start()
+		if self.pool_size > 1 and CommonData.captcha_batch_window > 0:
+			# Workers solving at the same time share model calls
+			get_solver().enable_batching(CommonData.captcha_batch_window, CommonData.captcha_max_batch)
+		reactor.addSystemEventTrigger("during", "shutdown", self.pool.stop)
+		self.started = True
+		logger.info("Captcha service started with %d workers", self.pool_size)
+
+	def solve(self, captcha_image_file, profile: str = None) -> Deferred:
+		""" Solve the captcha on the pool.
+			Keyword arguments:
+			captcha_image_file -- encoded captcha image bytes.
+			profile -- preprocessing profile, defaults to CommonData.captcha_profile.
+			Returns: Deferred firing with the CaptchaResult
+		"""
+		self.start()
+		return threads.deferToThreadPool(reactor, self.pool, get_captcha_result, captcha_image_file, profile)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_captcha_service(pool_size: int = CommonData.captcha_workers) -> CaptchaService:
+	""" Return the process wide captcha service, creating it with pool_size workers on first use."""
+	global _service
+	if _service is None:
+		with _service_lock:
+			if _service is None:
+				_service = CaptchaService(pool_size)
+	return _service
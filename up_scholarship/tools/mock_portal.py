@@ -0,0 +1,600 @@
+import base64
+import hashlib
+import json
+import logging
+import posixpath
+import random
+import uuid
+import urllib.parse as urlparse
+from collections import Counter
+from html import escape
+from twisted.internet import reactor
+from twisted.web import resource, server
+
+from up_scholarship.providers.constants import CommonData, FormKeys, TestStrings, StdCategory
+from up_scholarship.providers.url import UrlProviders
+from up_scholarship.tools.captcha_corpus import get_corpus_files, get_label, read_file
+
+# Any std of the category, the portal's urls only depend on the category
+CATEGORY_STDS = {StdCategory.pre: "10", StdCategory.post: "12"}
+SESSION_COOKIE = b"ASP.NET_SessionId"
+POPUP_PAGE = "Instructions.aspx"
+DEFAULT_PAGE = "default.aspx"
+ERROR_PAGE = "Error.aspx"
+
+logger = logging.getLogger(__name__)
+
+
+def _id(name: str) -> str:
+	""" Return the element id ASP.NET gives to a control name."""
+	return name.replace("$", "_")
+
+
+def _input(name: str, value: str = "", input_type: str = "text") -> str:
+	return '<input type="%s" name="%s" id="%s" value="%s">' % (input_type, name, _id(name), escape(value))
+
+
+def _checkbox(name: str) -> str:
+	return '<input type="checkbox" name="%s" id="%s">' % (name, _id(name))
+
+
+def _select(name: str, options: list, selected: str = "", postback=False) -> str:
+	""" Return a drop down with the options, posting the form back on change like an AutoPostBack list."""
+	onchange = " onchange=\"__doPostBack('%s','')\"" % name if postback else ""
+	html = '<select name="%s" id="%s"%s>' % (name, _id(name), onchange)
+	for option in options:
+		html += '<option value="%s"%s>%s</option>' % (
+			escape(option), " selected" if option == selected else "", escape(option))
+	return html + "</select>"
+
+
+def _label(label_id: str, text: str) -> str:
+	return '<span id="%s">%s</span>' % (label_id, escape(text))
+
+
+def _alert(message: str) -> str:
+	return "alert('%s')" % message
+
+
+def _local(url: str) -> str:
+	""" Return path and query of the url, redirects stay on whatever host the spider used."""
+	parsed = urlparse.urlparse(url)
+	return parsed.path + ("?" + parsed.query if parsed.query else "")
+
+
+class Application:
+	""" Progress of one student's application on the mock portal."""
+	def __init__(self, reg_no: str, std_category: StdCategory, is_renewal: bool):
+		self.reg_no = reg_no
+		self.app_id = hashlib.md5(reg_no.encode("utf-8")).hexdigest()[:16].upper()
+		self.std_category = std_category
+		self.is_renewal = is_renewal
+		self.popup_accepted = False
+		self.filled = False
+		self.photo = b""
+		self.locked = False
+		self.final_submitted = False
+		self.received = False
+		self.verified = False
+		self.forwarded = False
+
+	@property
+	def std(self) -> str:
+		return CATEGORY_STDS[self.std_category]
+
+
+class MockPortal(resource.Resource):
+	""" Stand-in for the scholarship portal implementing the pages the spiders drive, to benchmark them
+		without sending load to the real portal.
+		Pages are found by the paths UrlProviders makes for every std category and renewal, so they move with it.
+		Captchas are served from the saved captcha corpus with their file name as the answer, every response is
+		held back by the configured latency and requests fail at the configured rates so retries and backoff
+		get exercised too. Applications are kept in memory and are created on first login.
+	"""
+	isLeaf = True
+
+	def __init__(self, cd: CommonData, captchas: list):
+		super().__init__()
+		self.cd = cd
+		self.url_provider = UrlProviders(cd)
+		self.captchas = captchas  # List of answer and image bytes.
+		self.sessions = {}
+		self.applications = {}
+		self.routes = {}
+		self.stats = Counter()
+		self.add_routes()
+
+	def add_routes(self):
+		""" Map path of every page to its handler and the std and renewal of the page."""
+		up = self.url_provider
+		self.add_route(up.get_captcha_url(), self.captcha)
+		for std in CATEGORY_STDS.values():
+			self.add_route(up.get_institute_login_url(std), self.institute_login)
+			self.add_route(up.get_institute_receive_url(std), self.institute_receive)
+			self.add_route(up.get_institute_verify_url(std), self.institute_verify)
+			self.add_route(up.get_institute_forward_url(std), self.institute_forward)
+			for is_renewal in (False, True):
+				self.add_route(up.get_login_reg_url(std, is_renewal), self.student_login, std, is_renewal)
+				self.add_route(self.get_page_url(std, is_renewal, POPUP_PAGE), self.accept_popup, std, is_renewal)
+				self.add_route(self.get_page_url(std, is_renewal, DEFAULT_PAGE), self.default_page, std, is_renewal)
+				self.add_route(up.get_fill_reg_url(std, "", is_renewal), self.fill_form, std, is_renewal)
+				filled_page = TestStrings.app_renew_filled if is_renewal else TestStrings.app_new_filled
+				self.add_route(self.get_page_url(std, is_renewal, filled_page + ".aspx"), self.filled, std, is_renewal)
+				self.add_route(up.get_photo_up_url(std, "", is_renewal), self.upload_photo, std, is_renewal)
+				self.add_route(up.get_temp_print_url(std, "", is_renewal), self.print_page, std, is_renewal)
+				self.add_route(up.get_img_print_url(std, "", is_renewal), self.show_image, std, is_renewal)
+				self.add_route(up.get_final_disclaimer_url(std, "", is_renewal), self.final_disclaimer, std, is_renewal)
+				self.add_route(up.get_final_print_url(std, "", is_renewal), self.final_print, std, is_renewal)
+		self.add_route(self.get_institute_home_url(), self.institute_home)
+		self.add_route(self.get_error_url(), self.error_page)
+
+	def add_route(self, url: str, handler, std: str = "", is_renewal: bool = False):
+		self.routes[urlparse.urlparse(url).path.lower()] = (handler, std, is_renewal)
+
+	def get_page_url(self, std: str, is_renewal: bool, page: str, app_id: str = "") -> str:
+		""" Return url of a page in the directory of the std's application form."""
+		url = posixpath.dirname(self.url_provider.get_fill_reg_url(std, "", is_renewal)) + "/" + page
+		return url + "?Appid=" + app_id if app_id else url
+
+	def get_institute_home_url(self) -> str:
+		return self.url_provider.get_base_url() + TestStrings.institute_login_success
+
+	def get_error_url(self) -> str:
+		return self.url_provider.get_base_url() + ERROR_PAGE
+
+	def render(self, request):
+		finished = []
+		request.notifyFinish().addBoth(finished.append)
+		reactor.callLater(random.uniform(*self.cd.mock_portal_latency), self.respond, request, finished)
+		return server.NOT_DONE_YET
+
+	def respond(self, request, finished: list):
+		""" Answer the request after its latency, failing it at the configured rates."""
+		if finished:
+			# Spider gave up waiting
+			return
+		route = self.routes.get(request.path.decode("utf-8").lower())
+		self.stats["requests"] += 1
+		if random.random() < self.cd.mock_portal_drop_rate:
+			self.stats["dropped"] += 1
+			request.transport.abortConnection()
+			return
+		if random.random() < self.cd.mock_portal_error_rate:
+			self.stats["errors"] += 1
+			request.setResponseCode(500)
+			request.write(self.page("Runtime Error", "<h1>Server Error in '/' Application.</h1>"))
+			request.finish()
+			return
+		if route is None:
+			self.stats["not_found"] += 1
+			request.setResponseCode(404)
+			request.write(self.page("Not Found", "The resource cannot be found."))
+			request.finish()
+			return
+		handler, std, is_renewal = route
+		self.stats[handler.__name__] += 1
+		if request.method == b"POST" and handler != self.captcha and random.random() < self.cd.mock_portal_code_rate:
+			self.stats["error_codes"] += 1
+			self.redirect_with_code(request, random.choice(self.cd.mock_portal_codes))
+		else:
+			body = handler(request, self.get_session(request), std, is_renewal)
+			if body is not None:
+				request.write(body)
+		request.finish()
+
+	def get_session(self, request) -> dict:
+		""" Return state of the cookie's session, starting a new session if there is none."""
+		session_id = request.getCookie(SESSION_COOKIE)
+		if session_id is None or session_id not in self.sessions:
+			session_id = uuid.uuid4().hex.encode("ascii")
+			request.addCookie(SESSION_COOKIE, session_id, path=b"/", httpOnly=True)
+			self.sessions[session_id] = {"captcha": None, "hf": "", "app": None, "institute": None}
+		return self.sessions[session_id]
+
+	def redirect(self, request, url: str):
+		request.redirect(_local(url).encode("utf-8"))
+
+	def redirect_with_code(self, request, code: str):
+		""" Send the request back to its page with an error code in the "a" argument."""
+		path = request.path.decode("utf-8")
+		query = urlparse.parse_qsl(urlparse.urlparse(request.uri.decode("utf-8")).query)
+		query = [(key, value) for key, value in query if key != "a"] + [("a", code)]
+		request.redirect((path + "?" + urlparse.urlencode(query)).encode("utf-8"))
+
+	def page(self, title: str, body: str, viewstate: dict = None, error: str = "", script: str = "",
+			multipart=False) -> bytes:
+		""" Render a page the way ASP.NET web forms do, with everything inside one form posting back to the page.
+			Keyword arguments:
+			title -- page title.
+			body -- html of the controls.
+			viewstate -- state of the page posted back with the form.
+			error -- message of the error label.
+			script -- script added after the form, the spiders read alerts from it.
+			multipart -- whether the form uploads files.
+			Returns: encoded html
+		"""
+		viewstate = base64.b64encode(json.dumps(viewstate or {}).encode("utf-8")).decode("ascii")
+		enctype = ' enctype="multipart/form-data"' if multipart else ""
+		html = '<html><head><title>%s</title></head><body>' % escape(title)
+		html += '<form method="post" id="aspnetForm"%s>' % enctype
+		html += _input(FormKeys.event_target(), input_type="hidden")
+		html += _input("__EVENTARGUMENT", input_type="hidden")
+		html += _input(FormKeys.view_state(), viewstate, "hidden")
+		html += _input(FormKeys.view_state_generator(), "CA0B0334", "hidden")
+		html += _input(FormKeys.event_validation(), uuid.uuid4().hex, "hidden")
+		if error:
+			html += _label(FormKeys.error_lbl(), error)
+		html += body + "</form>"
+		if script:
+			html += "<script>%s</script>" % script
+		return (html + "</body></html>").encode("utf-8")
+
+	def captcha_body(self) -> str:
+		return _input(FormKeys.captcha_value(form=True)) + '<img id="imgCaptcha" src="/captcha.ashx">'
+
+	def check_captcha(self, request, session: dict) -> bool:
+		""" Check the posted captcha against the last one served to the session, a captcha can only be used once."""
+		answer, session["captcha"] = session["captcha"], None
+		if not self.cd.mock_portal_check_captcha:
+			return True
+		correct = answer is not None and self.arg(request, FormKeys.captcha_value(form=True)) == answer
+		self.stats["captchas_right" if correct else "captchas_wrong"] += 1
+		return correct
+
+	def arg(self, request, name: str) -> str:
+		return request.args.get(name.encode("utf-8"), [b""])[0].decode("utf-8", "replace")
+
+	def get_viewstate(self, request) -> dict:
+		try:
+			return json.loads(base64.b64decode(self.arg(request, FormKeys.view_state())).decode("utf-8"))
+		except ValueError:
+			return {}
+
+	def get_application(self, reg_no: str, std_category: StdCategory, is_renewal: bool) -> Application:
+		""" Return the application of the registration number, creating it on first sight."""
+		if reg_no not in self.applications:
+			self.applications[reg_no] = Application(reg_no, std_category, is_renewal)
+		return self.applications[reg_no]
+
+	def student_application(self, request, session: dict, std: str, is_renewal: bool):
+		""" Return application the session is logged in to if it is the one in the url's Appid or App_Id."""
+		app = session["app"]
+		app_id = self.arg(request, "Appid") or self.arg(request, "App_Id")
+		if app is None or app.app_id != app_id or app.std != std or app.is_renewal != is_renewal:
+			return None
+		return app
+
+	def session_expired(self, request) -> None:
+		self.redirect(request, self.get_error_url())
+
+	def error_page(self, request, session: dict, std: str, is_renewal: bool) -> bytes:
+		return self.page("Error", "Your session has expired. Please login again.")
+
+	def captcha(self, request, session: dict, std: str, is_renewal: bool) -> bytes:
+		answer, image = random.choice(self.captchas)
+		session["captcha"] = answer
+		request.setHeader(b"Content-Type", b"image/jpeg")
+		request.setHeader(b"Cache-Control", b"no-cache")
+		return image
+
+	def student_login(self, request, session: dict, std: str, is_renewal: bool):
+		error = ""
+		if request.method == b"POST":
+			reg_no = self.arg(request, FormKeys.login_reg_no(form=True))
+			hf = self.arg(request, FormKeys.hf(form=True))
+			password = self.arg(request, FormKeys.password(form=True))
+			if not self.check_captcha(request, session):
+				self.redirect(request, self.url_provider.get_login_reg_url(std, is_renewal) + "?a=c")
+				return None
+			# Password is the hash of hf followed by hash of the password, hf may be left empty
+			if not reg_no or (hf and hf != hashlib.sha512(session["hf"].encode("utf-8")).hexdigest()) or \
+					len(password) != len(hf) + 128 or not password.startswith(hf):
+				error = "Invalid Application Id or Password."
+			else:
+				app = self.get_application(reg_no, self.get_category(std), is_renewal)
+				session["app"] = app
+				page = DEFAULT_PAGE if app.popup_accepted else POPUP_PAGE
+				self.redirect(request, self.get_page_url(std, is_renewal, page, app.app_id))
+				return None
+		session["hf"] = uuid.uuid4().hex
+		body = _input(FormKeys.hf(form=True), session["hf"], "hidden")
+		body += _input(FormKeys.login_reg_no(form=True))
+		body += _input(FormKeys.dob(form=True))
+		body += _input(FormKeys.password(form=True), input_type="password")
+		body += _input(FormKeys.renewal_button(form=True), "2" if is_renewal else "1", "radio")
+		body += _input(FormKeys.login_type(form=True), "1" if self.get_category(std) == StdCategory.pre else "2", "radio")
+		body += self.captcha_body()
+		body += _input(FormKeys.login(form=True), "Submit", "submit")
+		return self.page("Student Login", body, error=error)
+
+	def get_category(self, std: str) -> StdCategory:
+		return StdCategory.pre if std == CATEGORY_STDS[StdCategory.pre] else StdCategory.post
+
+	def accept_popup(self, request, session: dict, std: str, is_renewal: bool):
+		app = self.student_application(request, session, std, is_renewal)
+		if app is None:
+			return self.session_expired(request)
+		if request.method == b"POST" and self.arg(request, FormKeys.check_popup_agree(form=True)) == "on":
+			app.popup_accepted = True
+			self.redirect(request, self.get_page_url(std, is_renewal, DEFAULT_PAGE, app.app_id))
+			return None
+		body = "I have read the instructions and agree to them. "
+		body += _checkbox(FormKeys.check_popup_agree(form=True))
+		body += _input(FormKeys.popup_button(form=True), "Proceed >>>", "submit")
+		return self.page("Instructions", body)
+
+	def default_page(self, request, session: dict, std: str, is_renewal: bool):
+		app = self.student_application(request, session, std, is_renewal)
+		if app is None:
+			return self.session_expired(request)
+		error = ""
+		lock_key = FormKeys.temp_submit_lock(self.cd.current_form_set, form=True)
+		if request.method == b"POST" and self.arg(request, FormKeys.event_target()) == lock_key:
+			if self.cd.mock_portal_strict and not (app.filled and app.photo):
+				error = "Please fill the application and upload the photo first."
+			else:
+				app.locked = True
+				self.redirect(request, self.get_page_url(std, is_renewal, DEFAULT_PAGE, app.app_id))
+				return None
+		matched = "Yes" if app.filled else ""
+		form_set = self.cd.current_form_set
+		body = _label(FormKeys.income_cert_no_status(form_set), matched)
+		body += _label(FormKeys.caste_cert_no_status(form_set), matched)
+		body += _label(FormKeys.annual_income_status(form_set), matched)
+		body += _label(FormKeys.high_school_status(form_set), matched)
+		body += _label(FormKeys.final_form_status(form_set), "")
+		if not app.locked:
+			body += '<a id="%s" href="javascript:__doPostBack(\'%s\',\'\')">Submit for check</a>' % (
+				FormKeys.temp_submit_lock(form_set), lock_key)
+		return self.page("Student Home", body, error=error)
+
+	def fill_form(self, request, session: dict, std: str, is_renewal: bool):
+		""" Application form, the bank branch drop down is filled in three postbacks: bank, district and branch."""
+		app = self.student_application(request, session, std, is_renewal)
+		if app is None:
+			return self.session_expired(request)
+		viewstate = self.get_viewstate(request) if request.method == b"POST" else {}
+		error = ""
+		bank = self.arg(request, FormKeys.bank_name(form=True))
+		district = self.arg(request, FormKeys.branch_dist_name(form=True))
+		branch = self.arg(request, FormKeys.branch_name(form=True))
+		event_target = self.arg(request, FormKeys.event_target())
+		if event_target == FormKeys.bank_name(form=True):
+			viewstate = {"bank": bank}
+		elif event_target == FormKeys.branch_dist_name(form=True) and "bank" in viewstate:
+			viewstate["district"] = district
+		elif event_target == FormKeys.branch_name(form=True) and "district" in viewstate:
+			viewstate["branch"] = branch
+		elif request.method == b"POST" and self.arg(request, FormKeys.submit(form=True)):
+			if not self.check_captcha(request, session):
+				error = TestStrings.invalid_captcha[-1]
+			elif not branch or (viewstate.get("bank"), viewstate.get("district"), viewstate.get("branch")) != \
+					(bank, district, branch):
+				error = "Please select bank branch."
+			else:
+				app.filled = True
+				filled_page = TestStrings.app_renew_filled if is_renewal else TestStrings.app_new_filled
+				self.redirect(request, self.get_page_url(std, is_renewal, filled_page + ".aspx", app.app_id))
+				return None
+		body = _select(FormKeys.bank_name(form=True), [viewstate.get("bank", "")], viewstate.get("bank", ""), True)
+		if "bank" in viewstate:
+			body += _select(
+				FormKeys.branch_dist_name(form=True), [viewstate.get("district", "")], viewstate.get("district", ""), True)
+		if "district" in viewstate:
+			body += _select(
+				FormKeys.branch_name(form=True), [viewstate.get("branch", "")], viewstate.get("branch", ""), True)
+		body += _input(FormKeys.bank_account_no(form=True))
+		body += _input(FormKeys.bank_account_holder_name(form=True))
+		body += _checkbox(FormKeys.check_agree(form=True))
+		body += self.captcha_body()
+		body += _input(FormKeys.submit(form=True), "Submit", "submit")
+		return self.page("Application Form", body, viewstate, error)
+
+	def filled(self, request, session: dict, std: str, is_renewal: bool):
+		if self.student_application(request, session, std, is_renewal) is None:
+			return self.session_expired(request)
+		return self.page("Application", "Your application has been saved.")
+
+	def upload_photo(self, request, session: dict, std: str, is_renewal: bool):
+		app = self.student_application(request, session, std, is_renewal)
+		if app is None:
+			return self.session_expired(request)
+		script = ""
+		if request.method == b"POST" and self.arg(request, FormKeys.upload_photo(self.cd.current_form_set, form=True)):
+			photo = request.args.get(FormKeys.upload_photo_name(form=True).encode("utf-8"), [b""])[0]
+			if self.cd.mock_portal_strict and not app.filled:
+				script = _alert("Please fill the application form first.")
+			elif not photo:
+				script = _alert("Please select photo.")
+			else:
+				app.photo = photo
+				script = _alert("Photo uploaded successfully")
+		body = '<input type="file" name="%s" id="%s">' % (
+			FormKeys.upload_photo_name(form=True), _id(FormKeys.upload_photo_name(form=True)))
+		body += _input(FormKeys.upload_photo(self.cd.current_form_set, form=True), "Upload Photo", "submit")
+		if app.photo:
+			body += '<img id="%s" src="%s">' % (
+				FormKeys.view_photo(self.cd.current_form_set),
+				_local(self.url_provider.get_img_print_url(std, app.app_id, is_renewal)))
+		return self.page("Upload Photo", body, script=script, multipart=True)
+
+	def print_body(self, app: Application) -> str:
+		src = _local(self.url_provider.get_img_print_url(app.std, app.app_id, app.is_renewal))
+		body = _label("lblRegNo", app.reg_no)
+		return body + '<img id="PhotoImg" src="%s">' % escape(src)
+
+	def print_page(self, request, session: dict, std: str, is_renewal: bool):
+		app = self.student_application(request, session, std, is_renewal)
+		if app is None:
+			return self.session_expired(request)
+		if self.cd.mock_portal_strict and not app.filled:
+			self.redirect(request, self.get_page_url(std, is_renewal, DEFAULT_PAGE, app.app_id))
+			return None
+		return self.page("Print Application", self.print_body(app))
+
+	def show_image(self, request, session: dict, std: str, is_renewal: bool):
+		app = self.student_application(request, session, std, is_renewal)
+		if app is None:
+			return self.session_expired(request)
+		request.setHeader(b"Content-Type", b"image/jpeg")
+		return app.photo
+
+	def final_disclaimer(self, request, session: dict, std: str, is_renewal: bool):
+		app = self.student_application(request, session, std, is_renewal)
+		if app is None:
+			return self.session_expired(request)
+		if self.cd.mock_portal_strict and not app.locked:
+			self.redirect(request, self.get_page_url(std, is_renewal, DEFAULT_PAGE, app.app_id))
+			return None
+		return self.page("Final Disclaimer", "I declare that the details filled by me are correct.")
+
+	def final_print(self, request, session: dict, std: str, is_renewal: bool):
+		app = self.student_application(request, session, std, is_renewal)
+		if app is None:
+			return self.session_expired(request)
+		if self.cd.mock_portal_strict and not app.locked:
+			self.redirect(request, self.get_page_url(std, is_renewal, DEFAULT_PAGE, app.app_id))
+			return None
+		app.final_submitted = True
+		return self.page("Final Print", self.print_body(app))
+
+	def institute_login(self, request, session: dict, std: str, is_renewal: bool):
+		""" Institute login, the institute drop down shows after the district and login type are posted back."""
+		error = ""
+		radio = FormKeys.institute_login_type_radio_button(form=True)
+		login_type = self.arg(request, radio)
+		if request.method == b"POST" and self.arg(request, FormKeys.institute_login_button(form=True)):
+			if not self.check_captcha(request, session):
+				error = TestStrings.invalid_captcha[-1]
+			elif not self.arg(request, FormKeys.institute(form=True)) or not self.arg(request, FormKeys.text_password(form=True)):
+				error = "Invalid Institute or Password."
+			else:
+				categories = {
+					FormKeys.institute_login_radio_button_value(category): category for category in CATEGORY_STDS}
+				session["institute"] = categories.get(login_type, StdCategory.post)
+				self.redirect(request, self.get_institute_home_url())
+				return None
+		session["hf"] = uuid.uuid4().hex
+		body = _input(FormKeys.hf(form=True), session["hf"], "hidden")
+		body += _select(FormKeys.district(form=True), [self.arg(request, FormKeys.district(form=True))])
+		for i, category in enumerate(CATEGORY_STDS):
+			value = FormKeys.institute_login_radio_button_value(category)
+			body += '<input type="radio" name="%s" id="%s_%d" value="%s"%s onclick="__doPostBack(\'%s$%d\',\'\')">' % (
+				radio, _id(radio), i, value, " checked" if value == login_type else "", radio, i)
+		if request.method == b"POST":
+			body += _select(FormKeys.institute(form=True), [self.arg(request, FormKeys.institute(form=True))])
+			body += _input(FormKeys.text_password(form=True), input_type="password")
+			body += _input(FormKeys.hd_pass_text(form=True), input_type="hidden")
+			body += self.captcha_body()
+			body += _input(FormKeys.institute_login_button(form=True), FormKeys.institute_login_button(), "submit")
+		return self.page("Institute Login", body, error=error)
+
+	def institute_home(self, request, session: dict, std: str, is_renewal: bool):
+		if session["institute"] is None:
+			self.redirect(request, self.url_provider.get_institute_login_url(CATEGORY_STDS[StdCategory.post]))
+			return None
+		return self.page("Institute Home", "Welcome")
+
+	def institute_page(self, request, session: dict, title: str, is_pending, act) -> bytes:
+		""" Search page of receive, verify and forward, listing the searched application if it is pending.
+			Keyword arguments:
+			request -- twisted request.
+			session -- session state.
+			title -- page title.
+			is_pending -- function telling whether an application is waiting for this action.
+			act -- function taking the request, application, grid name and view state, acting on the application
+				and returning the alert to show or the grid row to render again.
+			Returns: encoded html or None after a redirect
+		"""
+		category = session["institute"]
+		if category is None:
+			self.redirect(request, self.url_provider.get_institute_login_url(CATEGORY_STDS[StdCategory.post]))
+			return None
+		grid = FormKeys.prefix + ("chkgridPre" if category == StdCategory.pre else "chkgridPost") + "$ctl02$"
+		viewstate = self.get_viewstate(request) if request.method == b"POST" else {}
+		body = _select(FormKeys.application_type(form=True), ["0", "1"], self.arg(request, FormKeys.application_type(form=True)))
+		body += _input(FormKeys.registration_number_search(form=True))
+		body += _input(FormKeys.search_button(form=True), FormKeys.search_button(), "submit")
+		if self.arg(request, FormKeys.search_button(form=True)):
+			reg_no = self.arg(request, FormKeys.registration_number_search(form=True))
+			if self.cd.mock_portal_strict:
+				app = self.applications.get(reg_no)
+			else:
+				app = self.get_application(reg_no, category, self.arg(request, FormKeys.application_type(form=True)) == "1")
+			viewstate = {"reg_no": reg_no} if app and app.std_category == category and is_pending(app) else {}
+		app = self.applications.get(viewstate.get("reg_no"))
+		if app is None:
+			return self.page(title, body + "No Record Found.")
+		row = act(request, app, grid, viewstate)
+		if row.startswith("alert("):
+			return self.page(title, body, script=row)
+		return self.page(title, body + row, viewstate)
+
+	def institute_receive(self, request, session: dict, std: str, is_renewal: bool):
+		def act(request, app, grid, viewstate):
+			if self.arg(request, grid + "lnkbtnRecieve"):
+				if self.arg(request, grid + "chkIs") != "on":
+					return _alert("Please select application.")
+				app.received = True
+				return _alert(TestStrings.application_received)
+			row = _label(_id(grid + "hidApp_Id"), app.reg_no)
+			row += _checkbox(grid + "chkIs")
+			return row + _input(grid + "lnkbtnRecieve", FormKeys.application_receive_button(), "submit")
+		return self.institute_page(
+			request, session, "Receive Application",
+			lambda app: not app.received and (app.final_submitted or not self.cd.mock_portal_strict), act)
+
+	def institute_verify(self, request, session: dict, std: str, is_renewal: bool):
+		def act(request, app, grid, viewstate):
+			status = self.arg(request, grid + "ddl_VRstatus") or viewstate.get("status", "")
+			if self.arg(request, FormKeys.event_target()) == grid + "LinkButton1":
+				if status != FormKeys.application_verify_status():
+					return _alert("Please select status.")
+				app.verified = True
+				return _alert(TestStrings.application_verified)
+			viewstate["status"] = status
+			row = _label(_id(grid + "hidApp_Id"), app.reg_no)
+			row += _select(grid + "ddl_VRstatus", ["", "V", "R"], status, True)
+			return row + '<a id="%s" href="javascript:__doPostBack(\'%s\',\'\')">Submit</a>' % (
+				_id(grid + "LinkButton1"), grid + "LinkButton1")
+		return self.institute_page(
+			request, session, "Verify Application",
+			lambda app: not app.verified and (app.received or not self.cd.mock_portal_strict), act)
+
+	def institute_forward(self, request, session: dict, std: str, is_renewal: bool):
+		def act(request, app, grid, viewstate):
+			if self.arg(request, FormKeys.application_forward_button(form=True)):
+				if self.arg(request, grid + "chkSelect") != "on":
+					return _alert("Please select application.")
+				app.forwarded = True
+				return _alert(TestStrings.application_forwarded)
+			# The portal names the link of both grids after the pre matric one
+			row = '<a id="%s">%s</a>' % (FormKeys.first_forward_app_id(), escape(app.reg_no))
+			row += _checkbox(grid + "chkSelect")
+			for field in ("txt_obtained", "txt_Total", "txt_att"):
+				row += _input(grid + field)
+			return row + _input(FormKeys.application_forward_button(form=True), "Forward Selected Applications", "submit")
+		return self.institute_page(
+			request, session, "Forward Application",
+			lambda app: not app.forwarded and (app.verified or not self.cd.mock_portal_strict), act)
+
+	def log_stats(self):
+		logger.info("Mock portal stats: %s", json.dumps(self.stats, sort_keys=True))
+
+
+def run_mock_portal():
+	""" Serve the mock portal on mock_portal_host and mock_portal_port until interrupted.
+		Spiders use it when UP_SCHOLARSHIP_PORTAL points at it, e.g. UP_SCHOLARSHIP_PORTAL=http://127.0.0.1:8800/
+	"""
+	logging.basicConfig(level=logging.INFO)
+	cd = CommonData()
+	captchas = [(get_label(filename), read_file(filename)) for filename in get_corpus_files(cd.captchas_dir)]
+	if not captchas:
+		print("No accepted captchas found in %s. Run savecaptchas first." % cd.captchas_dir)
+		return
+	cd.portal_base_url = "http://%s:%d/" % (cd.mock_portal_host, cd.mock_portal_port)
+	portal = MockPortal(cd, captchas)
+	reactor.listenTCP(cd.mock_portal_port, server.Site(portal), interface=cd.mock_portal_host)
+	reactor.addSystemEventTrigger("before", "shutdown", portal.log_stats)
+	logger.info("Mock portal serving %d captchas on %s", len(captchas), cd.portal_base_url)
+	reactor.run()
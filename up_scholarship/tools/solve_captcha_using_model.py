@@ -1,141 +1,578 @@
-import os
-os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
+import hashlib
 import logging
-from tensorflow import keras
+import threading
+import time
+from dataclasses import dataclass, field
 from up_scholarship.providers.utilities import resize_to_fit
+from up_scholarship.providers.constants import CommonData
+from up_scholarship.tools.captcha_runtime import get_runtime, resolve_runtime
+from up_scholarship.tools.captcha_ctc import CTCRecognizer, IMAGE_WIDTH, IMAGE_HEIGHT
+from up_scholarship.tools.captcha_batcher import MicroBatcher
 import numpy as np
 import pickle
 from cv2 import cv2
 
-MODEL_FILENAME = "up_scholarship/tools/captcha_models/captcha_model"
 MODEL_LABELS_FILENAME = "up_scholarship/tools/captcha_models/captcha_model_labels.dat"
+RECOGNIZERS = ("letters", "ctc")
 
-def get_captcha_string(captcha_image_file) -> str:
-	logging.getLogger('tensorflow').disabled = True
-	logger = logging.getLogger()
-	return_str = ''
-	# Load up the model labels (so we can translate model predictions to actual letters)
-	with open(MODEL_LABELS_FILENAME, "rb") as f:
-		lb = pickle.load(f)
+logger = logging.getLogger(__name__)
 
-	# Load the trained neural network
-	model = keras.models.load_model(MODEL_FILENAME)
 
+def decode_image(captcha_image_file):
+	""" Decode encoded image bytes to a grayscale image without copying the buffer.
+		Keyword arguments:
+		captcha_image_file -- encoded captcha image bytes.
+		Returns: 2d uint8 numpy array
+	"""
+	return cv2.imdecode(np.frombuffer(captcha_image_file, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
 
-	if captcha_image_file != None:
-		# Load the image and convert it to grayscale
-		image = np.asarray(bytearray(captcha_image_file), dtype="uint8")
-		image = cv2.imdecode(image, cv2.IMREAD_GRAYSCALE)
-
-		# Increase image size for better recognition
-		image = cv2.resize(image, None, fx=3.3, fy=3.3, interpolation=cv2.INTER_CUBIC)
-		# Remove noise from image
-		image = cv2.fastNlMeansDenoising(src=image, h=40)
-		
-		# Convert it to PIL image to work with pixels directly
-		#img = Image.fromarray(image)
-		#img = img.convert("RGBA")
-		#pixdata = img.load()
-
-		# Make the letters bolder for easier recognition
-		height, width = image.shape
-		for y in range(width):
-			for x in range(height):
-				if image[x, y] < 90:
-					image[x, y] = 0		
-		for y in range(width):
-			for x in range(height):
-				if image[x, y] < 120: #orig 136
-					image[x, y] = 0		
-		for y in range(width):
-			for x in range(height):
-				if image[x, y] > 0:
-					image[x, y] = 255
-		
-		#image = cv2.cvtColor(np.array(img), cv2.COLOR_BGR2GRAY)
-
-		# threshold the image (convert it to pure black and white)
-		thresh = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
-
-		# find the contours (continuous blobs of pixels) the image
-		contours = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-		# Hack for compatibility with different OpenCV versions
-		contours = contours[0]
-
-		letter_image_regions = []
-
-		# Now we can loop through each of the four contours and extract the letter
-		# inside of each one
-		for contour in contours:
-			# Get the rectangle that contains the contour
-			(x, y, w, h) = cv2.boundingRect(contour)
-
-			# If countour width and height is less than expected than skip it
-			if w < 20  or h < 20:
+
+def denoise(image):
+	""" Upscale and denoise the decoded captcha image.
+		Keyword arguments:
+		image -- grayscale captcha image.
+	"""
+	# Increase image size for better recognition
+	image = cv2.resize(image, None, fx=3.3, fy=3.3, interpolation=cv2.INTER_CUBIC)
+	# Remove noise from image
+	return cv2.fastNlMeansDenoising(src=image, h=40)
+
+
+def crop_to_text(image, margin=3):
+	""" Crop the columns left and right of the text, keeping the full height.
+		The height is kept because letters are cropped from the top of the image.
+		Keyword arguments:
+		image -- grayscale captcha image.
+		margin -- columns to keep on either side of the text.
+	"""
+	# Columns with more than one dark pixel, a single one is usually a noise dot
+	columns = np.flatnonzero(np.count_nonzero(image < 120, axis=0) > 1)
+	if not len(columns):
+		return image
+	return image[:, max(columns[0] - margin, 0):columns[-1] + margin + 1]
+
+
+def denoise_first(image):
+	""" Crop to the text and denoise at the original size before upscaling.
+		Denoising 3.3x fewer pixels in each direction is about ten times cheaper.
+		Keyword arguments:
+		image -- grayscale captcha image.
+	"""
+	image = cv2.fastNlMeansDenoising(src=crop_to_text(image), h=40)
+	return cv2.resize(image, None, fx=3.3, fy=3.3, interpolation=cv2.INTER_CUBIC)
+
+
+def denoise_median(image):
+	""" Crop to the text and remove noise dots with a median filter instead of non local means.
+		Keyword arguments:
+		image -- grayscale captcha image.
+	"""
+	image = cv2.medianBlur(crop_to_text(image), 3)
+	return cv2.resize(image, None, fx=3.3, fy=3.3, interpolation=cv2.INTER_CUBIC)
+
+
+PROFILES = {
+	"default": denoise,
+	"denoise_first": denoise_first,
+	"median": denoise_median,
+}
+
+
+def get_profile(name: str):
+	""" Return the denoise function of the preprocessing profile by its name."""
+	try:
+		return PROFILES[name]
+	except KeyError:
+		raise ValueError("Unknown captcha profile: %s. Available: %s" % (name, ", ".join(PROFILES)))
+
+
+def binarize(image):
+	""" Binarize the denoised image.
+		Keyword arguments:
+		image -- denoised image, modified in place.
+		Returns: tuple of the binarized image (letters black) and its inverted otsu threshold
+	"""
+	# Make the letters bolder for easier recognition, everything below 120 becomes black
+	# and the rest white.
+	cv2.threshold(image, 119, 255, cv2.THRESH_BINARY, dst=image)
+
+	# threshold the image (convert it to pure black and white)
+	thresh = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+	return image, thresh
+
+
+def preprocess(image, profile="default"):
+	""" Upscale, denoise and binarize the decoded captcha image.
+		Keyword arguments:
+		image -- grayscale captcha image.
+		profile -- name of the preprocessing profile.
+		Returns: tuple of the binarized image (letters black) and its inverted otsu threshold
+	"""
+	return binarize(get_profile(profile)(image))
+
+
+def find_letter_regions(thresh) -> list:
+	""" Find the bounding boxes of letters in the thresholded captcha.
+		Keyword arguments:
+		thresh -- inverted threshold image returned by preprocess.
+		Returns: list of (x, y, w, h) sorted from left to right
+	"""
+	# find the contours (continuous blobs of pixels) the image
+	contours = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+	# Hack for compatibility with different OpenCV versions
+	contours = contours[0]
+
+	letter_image_regions = []
+
+	# Now we can loop through each of the contours and extract the letter
+	# inside of each one
+	for contour in contours:
+		# Get the rectangle that contains the contour
+		(x, y, w, h) = cv2.boundingRect(contour)
+
+		# If countour width and height is less than expected than skip it
+		if w < 20  or h < 20:
+			continue
+
+		# Compare the width of the contour to detect letters that are conjoined into one chunk
+		if w > 79:
+			# This contour is too wide to be a single letter!
+			# Split it in half into two letter regions!
+			half_width = int(w / 2)
+			letter_image_regions.append((x, y, half_width, h))
+			letter_image_regions.append((x + half_width, y, half_width, h))
+		else:
+			# This is a normal letter by itself
+			letter_image_regions.append((x, y, w, h))
+
+	# Sort the detected letter images based on the x coordinate to make sure
+	# we are processing them from left-to-right so we match the right image
+	# with the right letter
+	return sorted(letter_image_regions, key=lambda x: x[0])
+
+
+def _merge_overlapping(boxes: list) -> list:
+	""" Merge boxes of a glyph broken into pieces lying over each other.
+		Keyword arguments:
+		boxes -- list of (x, y, w, h).
+		Returns: merged boxes sorted from left to right
+	"""
+	merged = []
+	for x, y, w, h in sorted(boxes):
+		if merged:
+			mx, my, mw, mh = merged[-1]
+			overlap = min(mx + mw, x + w) - max(mx, x)
+			if overlap > min(mw, w) / 2:
+				right, bottom = max(mx + mw, x + w), max(my + mh, y + h)
+				mx, my = min(mx, x), min(my, y)
+				merged[-1] = (mx, my, right - mx, bottom - my)
 				continue
+		merged.append((x, y, w, h))
+	return merged
+
+
+def _split_counts(widths: list, letters: int):
+	""" Share the letters among the regions in proportion to their widths, each region gets at least one.
+		Every extra letter goes to the region which is widest per letter it already has.
+	"""
+	widths = np.asarray(widths, dtype=float)
+	counts = np.ones(len(widths), dtype=int)
+	for _ in range(letters - len(widths)):
+		counts[np.argmax(widths / counts)] += 1
+	return counts
+
+
+def _split_region(thresh, region: tuple, parts: int) -> list:
+	""" Cut a region of touching letters into parts at the columns with the least foreground.
+		Each cut is searched within a quarter letter of where an even split would put it.
+	"""
+	x, y, w, h = region
+	if parts == 1:
+		return [region]
+	# Letters touch where the fewest foreground pixels are in a column
+	column_profile = np.count_nonzero(thresh[y:y + h, x:x + w], axis=0)
+	step = w / parts
+	cuts = [0]
+	for k in range(1, parts):
+		low = max(int(k * step - step / 4), cuts[-1] + 1)
+		high = int(k * step + step / 4) + 1
+		cuts.append(low + int(np.argmin(column_profile[low:high])))
+	cuts.append(w)
+	return [(x + left, y, right - left, h) for left, right in zip(cuts, cuts[1:])]
+
+
+def find_letter_components(thresh, letters=5) -> list:
+	""" Find the bounding boxes of letters using connected components.
+		Unlike find_letter_regions, pieces of a broken glyph are merged and a region of any number of
+		touching letters is split in proportion to its width.
+		Keyword arguments:
+		thresh -- inverted threshold image returned by preprocess.
+		letters -- number of letters in the captcha.
+		Returns: list of (x, y, w, h) sorted from left to right
+	"""
+	stats = cv2.connectedComponentsWithStats(thresh, connectivity=8)[2]
+	# Skip the background label and specks of noise
+	stats = stats[1:]
+	stats = stats[stats[:, cv2.CC_STAT_AREA] >= 20]
+	boxes = _merge_overlapping([tuple(int(v) for v in box[:4]) for box in stats])
+	boxes = [box for box in boxes if box[2] >= 20 and box[3] >= 20]
+
+	# Drop leftover noise blobs which are much smaller than the rest
+	while len(boxes) > letters:
+		areas = [w * h for _, _, w, h in boxes]
+		smallest = int(np.argmin(areas))
+		if areas[smallest] >= np.median(areas) / 2:
+			break
+		boxes.pop(smallest)
+	if not boxes or len(boxes) > letters:
+		return boxes
 
-			# Compare the width of the contour to detect letters that are conjoined into one chunk
-			if w > 79:
-				# This contour is too wide to be a single letter!
-				# Split it in half into two letter regions!
-				half_width = int(w / 2)
-				letter_image_regions.append((x, y, half_width, h))
-				letter_image_regions.append((x + half_width, y, half_width, h))
+	counts = _split_counts([w for _, _, w, _ in boxes], letters)
+	# Letters narrower than the smallest letter we accept mean segmentation went wrong, don't force it
+	if any(box[2] / parts < 20 for box, parts in zip(boxes, counts)):
+		return boxes
+	letter_image_regions = []
+	for box, parts in zip(boxes, counts):
+		letter_image_regions.extend(_split_region(thresh, box, parts))
+	return letter_image_regions
+
+
+SEGMENTERS = {
+	"contours": find_letter_regions,
+	"components": find_letter_components,
+}
+
+
+def get_segmenter(name: str):
+	""" Return the letter segmentation function by its name."""
+	try:
+		return SEGMENTERS[name]
+	except KeyError:
+		raise ValueError("Unknown captcha segmenter: %s. Available: %s" % (name, ", ".join(SEGMENTERS)))
+
+
+def extract_letter_images(image, letter_image_regions):
+	""" Crop the letters out of the binarized image and stack them for the model.
+		Keyword arguments:
+		image -- binarized image returned by preprocess.
+		letter_image_regions -- letter bounding boxes.
+		Returns: numpy array of shape (n, 20, 20, 1)
+	"""
+	# For saving original height to detect difference b/w upper and lower characters
+	(_, _, _, h2) = cv2.boundingRect(image)
+	letter_images = []
+	for x, y, w, h in letter_image_regions:
+		# Extract the letter from the original image with a 2-pixel margin around the edge
+		letter_image = image[0:y + h2 + 2, x - 2:x + w + 2]
+
+		# Re-size the letter image to 20x20 pixels to match training data
+		letter_images.append(resize_to_fit(letter_image, 20, 20))
+	# Turn the letters into a 4d list of images to make Keras happy
+	return np.expand_dims(np.stack(letter_images), axis=3)
+
+
+@dataclass
+class CaptchaResult:
+	text: str = ''
+	letter_probabilities: list = field(default_factory=list)	# Probability of each predicted letter.
+	confidence: float = 0.0		# Probability that the whole text is right, 0 when segmentation failed.
+	profile: str = ''			# Preprocessing profile used.
+	image_hash: str = ''		# Sha1 of the captcha image bytes.
+	timings: dict = field(default_factory=dict)	# Seconds spent in each solver stage.
+
+
+class CaptchaSolver:
+	""" Solve captcha images using the trained model.
+		The model and its label binarizer are loaded once on first use and reused for every solve.
+	"""
+	def __init__(
+			self,
+			runtime: str = CommonData.captcha_runtime,
+			labels_filename=MODEL_LABELS_FILENAME,
+			profile: str = CommonData.captcha_profile,
+			segmenter: str = CommonData.captcha_segmenter,
+			recognizer: str = CommonData.captcha_recognizer):
+		if recognizer not in RECOGNIZERS:
+			raise ValueError("Unknown captcha recognizer: %s. Available: %s" % (recognizer, ", ".join(RECOGNIZERS)))
+		self.runtime = get_runtime(runtime)
+		self.recognizer = recognizer
+		# The sequence model reads the whole captcha, so it needs neither the segmenter nor the letter model
+		self.ctc = CTCRecognizer() if recognizer == "ctc" else None
+		self.profile = profile
+		get_profile(profile)
+		self.segmenter = segmenter
+		self.find_letter_regions = get_segmenter(segmenter)
+		self.labels_filename = labels_filename
+		self.loaded = False
+		self.lb = None
+		self.batcher = None
+		self._lock = threading.Lock()
+		self.load_time = 0.0			# Seconds spent loading the model and labels.
+		self.cold_solve_time = 0.0		# Seconds spent on the first solve after load.
+		self.warm_solve_time = 0.0		# Total seconds spent on every solve after the first.
+		self.solves = 0
+		self.warm_up_time = 0.0			# Seconds the background warm up took.
+		self.first_solve_wait = None	# Seconds the first solve waited for the warm up to finish.
+		self._warm_up_thread = None
+		self._warmed = threading.Event()
+
+	@property
+	def is_loaded(self) -> bool:
+		return self.loaded
+
+	def load(self):
+		""" Load the model and labels if not already loaded."""
+		if self.is_loaded:
+			return
+		with self._lock:
+			if self.is_loaded:
+				return
+			start = time.perf_counter()
+			if self.ctc:
+				self.ctc.load()
 			else:
-				# This is a normal letter by itself
-				letter_image_regions.append((x, y, w, h))
+				# Load up the model labels (so we can translate model predictions to actual letters)
+				with open(self.labels_filename, "rb") as f:
+					self.lb = pickle.load(f)
+				# Load the trained neural network
+				self.runtime.load()
+			self.loaded = True
+			self.load_time = time.perf_counter() - start
+			logger.info(
+				"Captcha %s model loaded with %s runtime in %.3fs", self.recognizer, self.runtime.name, self.load_time)
 
-		# If we found more or less than 5 letters in the captcha, our letter extraction
-		# didn't work correcly. Skip the image instead of saving bad training data!
-		if len(letter_image_regions) == 5:
+	def stats(self) -> dict:
+		""" Return load and solve timings in seconds."""
+		warm_solves = max(self.solves - 1, 0)
+		return {
+			"runtime": self.runtime.name,
+			"recognizer": self.recognizer,
+			"load_time": self.load_time,
+			"cold_solve_time": self.cold_solve_time,
+			"warm_solves": warm_solves,
+			"warm_solve_avg_time": self.warm_solve_time / warm_solves if warm_solves else 0.0,
+			"batching": self.batcher.stats() if self.batcher else {},
+			"warm_up_time": self.warm_up_time,
+			"first_solve_wait": self.first_solve_wait,
+			# Start up which overlapped with other work instead of delaying the first captcha
+			"hidden_start_up": max(self.warm_up_time - (self.first_solve_wait or 0.0), 0.0),
+		}
 
-			# Sort the detected letter images based on the x coordinate to make sure
-			# we are processing them from left-to-right so we match the right image
-			# with the right letter
-			letter_image_regions = sorted(letter_image_regions, key=lambda x: x[0])
+	def start_warm_up(self):
+		""" Load the model and run a dummy prediction on a background thread, so the first captcha doesn't
+			pay for loading and graph tracing.
+		"""
+		with self._lock:
+			if self._warm_up_thread:
+				return
+			self._warm_up_thread = threading.Thread(target=self.warm_up, name="captcha-warm-up", daemon=True)
+			self._warm_up_thread.start()
 
-			# Create an output image and a list to hold our predicted letters
-			#output = cv2.merge([temp_img] * 3)
-			predictions = []
+	def warm_up(self):
+		start = time.perf_counter()
+		try:
+			self.load()
+			if self.ctc:
+				self.ctc.recognize(np.full((IMAGE_HEIGHT, IMAGE_WIDTH), 255, dtype=np.uint8))
+			else:
+				# Same shape and type as real letters so the traced graph is reused
+				self._predict(np.zeros((5, 20, 20, 1), dtype=np.uint8))
+		except Exception:
+			logger.exception("Unable to warm up the captcha model")
+		finally:
+			self.warm_up_time = time.perf_counter() - start
+			self._warmed.set()
+			logger.info("Captcha model warmed up in %.3fs", self.warm_up_time)
 
-			# loop over the letters
-			for letter_bounding_box in letter_image_regions:
-				# Grab the coordinates of the letter in the image
-				x, y, w, h = letter_bounding_box
+	def _wait_for_warm_up(self):
+		""" Wait for a running warm up instead of racing it, timing the wait of the first solve."""
+		if self._warm_up_thread is None or self.first_solve_wait is not None:
+			return
+		start = time.perf_counter()
+		self._warmed.wait()
+		self.first_solve_wait = time.perf_counter() - start
 
-				# For saving original height to detect difference b/w upper and lower characters
-				(_, _, _, h2) = cv2.boundingRect(image)
+	def enable_batching(
+			self,
+			window: float = CommonData.captcha_batch_window,
+			max_batch: int = CommonData.captcha_max_batch):
+		""" Classify letters of captchas solved at the same time on different threads in one model call.
+			Keyword arguments:
+			window -- seconds the first captcha waits for others.
+			max_batch -- most captchas classified together.
+		"""
+		with self._lock:
+			if self.batcher is None:
+				self.batcher = MicroBatcher(self._predict, window, max_batch)
 
-				# Extract the letter from the original image with a 2-pixel margin around the edge
-				letter_image = image[0:y + h2 + 2, x - 2:x + w + 2]
+	def solve(self, captcha_image_file, profile: str = None) -> str:
+		""" Return the captcha text found in the image or empty string if unable to solve.
+			Keyword arguments:
+			captcha_image_file -- encoded captcha image bytes.
+			profile -- preprocessing profile, defaults to the solver profile.
+		"""
+		return self.solve_result(captcha_image_file, profile).text
 
-				# Re-size the letter image to 20x20 pixels to match training data
-				letter_image = resize_to_fit(letter_image, 20, 20)
+	def solve_result(self, captcha_image_file, profile: str = None) -> CaptchaResult:
+		""" Solve the captcha and return the text along with its confidence and stage timings.
+			Keyword arguments:
+			captcha_image_file -- encoded captcha image bytes.
+			profile -- preprocessing profile, defaults to the solver profile.
+		"""
+		self._wait_for_warm_up()
+		self.load()
+		start = time.perf_counter()
+		result = self._solve(captcha_image_file, profile if profile else self.profile)
+		self._record_solves(time.perf_counter() - start, 1)
+		return result
 
-				# Turn the single image into a 4d list of images to make Keras happy
-				letter_image = np.expand_dims(letter_image, axis=2)
-				letter_image = np.expand_dims(letter_image, axis=0)
+	def solve_batch(self, captcha_image_files: list, profile: str = None) -> list:
+		""" Solve many captchas classifying the letters of all of them in a single model call.
+			Keyword arguments:
+			captcha_image_files -- list of encoded captcha image bytes.
+			profile -- preprocessing profile, defaults to the solver profile.
+			Returns: list of CaptchaResult in the same order
+		"""
+		self._wait_for_warm_up()
+		self.load()
+		start = time.perf_counter()
+		results = [CaptchaResult(profile=profile if profile else self.profile) for _ in captcha_image_files]
+		segmented = []
+		for result, captcha_image_file in zip(results, captcha_image_files):
+			letter_images = self._letter_images(captcha_image_file, result)
+			if letter_images is not None:
+				segmented.append((result, letter_images))
+		if segmented:
+			predict_start = time.perf_counter()
+			letters, probabilities = self.predict(np.concatenate([letter_images for _, letter_images in segmented]))
+			# The model call is shared so each captcha is charged an equal part of it
+			predict_time = (time.perf_counter() - predict_start) / len(segmented)
+			for i, (result, _) in enumerate(segmented):
+				result.timings["predict"] = predict_time
+				self._set_text(result, "".join(letters[i * 5:i * 5 + 5]), probabilities[i * 5:i * 5 + 5])
+		self._record_solves(time.perf_counter() - start, len(captcha_image_files))
+		return results
 
-				# Ask the neural network to make a prediction
-				prediction = model.predict(letter_image)
+	def _record_solves(self, elapsed: float, count: int):
+		""" Add count solves which took elapsed seconds in total to the solve timings."""
+		if not count:
+			return
+		with self._lock:
+			if self.solves == 0:
+				self.cold_solve_time = elapsed / count
+				self.warm_solve_time += elapsed - elapsed / count
+			else:
+				self.warm_solve_time += elapsed
+			self.solves += count
 
-				# Convert the one-hot-encoded prediction back to a normal letter
-				letter = lb.inverse_transform(prediction)[0]
-				predictions.append(letter)
+	def predict(self, letter_images):
+		""" Classify a batch of letter images in a single model call, shared with other threads when
+			batching is enabled.
+			Keyword arguments:
+			letter_images -- letter images of shape (n, 20, 20, 1).
+			Returns: tuple of letters list and probability of each letter
+		"""
+		if self.batcher:
+			return self.batcher.predict(letter_images)
+		return self._predict(letter_images)
 
-				# draw the prediction on the output image
-				#cv2.rectangle(output, (x - 2, y - 2), (x + w + 4, y + h + 4), (0, 255, 0), 1)
-				#cv2.putText(output, letter, (x - 5, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0, 255, 0), 2)
+	def _predict(self, letter_images):
+		predictions = self.runtime.predict(letter_images)
+		# Convert the one-hot-encoded predictions back to normal letters
+		return list(self.lb.inverse_transform(predictions)), [float(p) for p in predictions.max(axis=1)]
 
-			# Print the captcha's text
-			captcha_text = "".join(predictions)
-			return_str = captcha_text
-			logger.info("CAPTCHA text is: {}".format(captcha_text))
+	def _solve(self, captcha_image_file, profile: str) -> CaptchaResult:
+		result = CaptchaResult(profile=profile)
+		letter_images = self._letter_images(captcha_image_file, result)
+		if letter_images is not None:
+			start = time.perf_counter()
+			letters, probabilities = self.predict(letter_images)
+			result.timings["predict"] = time.perf_counter() - start
+			self._set_text(result, "".join(letters), probabilities)
+		return result
 
-			# Show the annotated image
-			#cv2.imshow("Output", output)
-			#cv2.waitKey()
-		else:
+	def _letter_images(self, captcha_image_file, result: CaptchaResult):
+		""" Run every stage before letter classification, recording stage timings in the result.
+			The ctc recognizer reads the text here directly.
+			Returns: letter images of shape (5, 20, 20, 1) or None if there is nothing left to classify
+		"""
+		if captcha_image_file == None:
+			return None
+		result.image_hash = hashlib.sha1(captcha_image_file).hexdigest()
+		timings = result.timings
+		last = time.perf_counter()
+
+		def lap(stage: str):
+			nonlocal last
+			now = time.perf_counter()
+			timings[stage] = now - last
+			last = now
+
+		image = decode_image(captcha_image_file)
+		lap("decode")
+		image = get_profile(result.profile)(image)
+		lap("denoise")
+		image, thresh = binarize(image)
+		lap("threshold")
+		if self.ctc:
+			text, probabilities = self.ctc.recognize(image)
+			lap("predict")
+			if len(text) == 5:
+				self._set_text(result, text, probabilities)
+			else:
+				logger.warning("More or less letters read: " + text)
+			return None
+		letter_image_regions = self.find_letter_regions(thresh)
+		lap("segment")
+
+		# If we found more or less than 5 letters in the captcha, our letter extraction
+		# didn't work correcly. Skip the image instead of saving bad training data!
+		if len(letter_image_regions) != 5:
 			logger.warning("More or less letters found: " + str(len(letter_image_regions)))
-	return return_str
\ No newline at end of file
+			return None
+		return extract_letter_images(image, letter_image_regions)
+
+	@staticmethod
+	def _set_text(result: CaptchaResult, text: str, probabilities: list):
+		result.text = text
+		result.letter_probabilities = probabilities
+		result.confidence = float(np.prod(probabilities))
+		logger.info("CAPTCHA text is: %s confidence: %.3f", result.text, result.confidence)
+
+
+_solvers = {}
+_solver_lock = threading.Lock()
+
+
+def get_solver(runtime: str = None) -> CaptchaSolver:
+	""" Return the process wide captcha solver for the runtime, creating it on first use.
+		Keyword arguments:
+		runtime -- name of the inference runtime, defaults to CommonData.captcha_runtime.
+	"""
+	runtime = resolve_runtime(runtime if runtime else CommonData.captcha_runtime, CommonData.captcha_int8_tolerance)
+	if runtime not in _solvers:
+		with _solver_lock:
+			if runtime not in _solvers:
+				_solvers[runtime] = CaptchaSolver(runtime)
+	return _solvers[runtime]
+
+
+def get_captcha_string(captcha_image_file) -> str:
+	return get_captcha_result(captcha_image_file).text
+
+
+def get_captcha_result(captcha_image_file, profile: str = None) -> CaptchaResult:
+	""" Return the captcha text with per letter probabilities and overall confidence.
+		The captcha daemon is used when it is running so the model is not loaded in this process.
+		Keyword arguments:
+		captcha_image_file -- encoded captcha image bytes.
+		profile -- preprocessing profile, defaults to CommonData.captcha_profile.
+	"""
+	if captcha_image_file != None:
+		# Imported here as the daemon itself is built on this module
+		from up_scholarship.tools.captcha_daemon import solve_with_daemon
+		result = solve_with_daemon(captcha_image_file, profile)
+		if result is not None:
+			return result
+	return get_solver().solve_result(captcha_image_file, profile)